@@ -16,8 +16,11 @@ PsychoPyCustomDisplay -- inherited from pylink.EyeLinkCustomDisplay. Defines how
 
 import array
 import string
+import threading
+import time
 import warnings
 
+import numpy as np
 import PIL
 
 import pylink
@@ -28,6 +31,116 @@ import psychopy.tools
 import psychopy.visual
 
 
+class _CameraPipeline:
+    """Converts complete camera frames to images on a worker thread.
+
+    Only the newest frame is kept at each step: a frame that arrives before the worker picked
+    up the previous one replaces it, and an image that was never shown is replaced by a newer
+    one. Both count as dropped frames, as do incomplete frames and frames that could not be
+    converted (also counted in conversion_errors, with the last error in error).
+    """
+    def __init__(self):
+        self.dropped_frames = 0
+        self.conversion_errors = 0
+        self.error = None
+        self._condition = threading.Condition()
+        self._lines = []
+        self._pending = None  # (completed time, width, height, bytes, palette)
+        self._newest = None  # (completed time, PIL image)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the worker thread, if it is not running already."""
+        if self._thread is not None:
+            return
+
+        with self._condition:
+            self._running = True
+            self._pending = None
+            self._newest = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def add_line(self, width, line, totlines, buff, palette):
+        """Collects a line of palette indices, returns True if it completed a frame.
+
+        Line 1 starts a new frame, so the lines of an interrupted frame are discarded. A frame
+        that does not have width * totlines pixels is dropped instead of submitted.
+        """
+        if line == 1:
+            self._lines = []
+        self._lines.append(bytes(buff))
+        if line != totlines:
+            return False
+
+        pixels, self._lines = b''.join(self._lines), []
+        if len(pixels) != width * totlines:
+            with self._condition:
+                self.dropped_frames += 1
+            return False
+
+        self.submit(width, totlines, pixels, palette.copy())
+        return True
+
+    def submit(self, width, height, pixels, palette):
+        """Queues a complete frame of palette indices, replacing an unconverted frame."""
+        with self._condition:
+            if self._pending is not None:
+                self.dropped_frames += 1
+            self._pending = (time.perf_counter(), width, height, pixels, palette)
+            self._condition.notify_all()
+
+    def take_newest(self):
+        """Returns (completed time, image) of a frame that was not taken yet, or None."""
+        with self._condition:
+            newest, self._newest = self._newest, None
+        return newest
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                frame, self._pending = self._pending, None
+
+            completed, width, height, pixels, palette = frame
+            try:
+                indices = np.frombuffer(pixels, dtype=np.uint8)
+                image = PIL.Image.frombytes('RGBX', (width, height), palette[indices].tobytes())
+            except Exception as e:  # A bad frame must not stop the worker
+                with self._condition:
+                    self.dropped_frames += 1
+                    self.conversion_errors += 1
+                    self.error = e
+                continue
+
+            with self._condition:
+                if self._newest is not None:
+                    self.dropped_frames += 1
+                self._newest = (completed, image)
+
+
+def _smoothed_rate(rate, previous, now):
+    """Returns the rate (per second) updated with an event at now after one at previous."""
+    if previous is None or now <= previous:
+        return rate
+
+    new_rate = 1 / (now - previous)
+    return new_rate if rate is None else 0.9 * rate + 0.1 * new_rate
+
+
 class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
     """Defines how pylink events should be handled by psychopy.
 
@@ -37,6 +150,17 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
     Parameters:
     window -- A psychopy.visual.Window object
     tracker -- A pylink.EyeLink object
+    pipelined -- If True, camera frames are converted to images on a worker thread and only the
+     newest complete frame is drawn (see draw_image_line). Stale frames are dropped, so the
+     setup screens stay responsive when drawing falls behind the camera.
+
+    Attributes (pipelined mode):
+    camera_latency -- seconds from the last line of the shown frame to its flip
+    camera_fps -- the rate at which complete camera frames arrive, smoothed
+    shown_fps -- the rate at which camera frames are shown, smoothed
+    dropped_frames -- the number of frames that were never shown, including incomplete frames
+     and frames that could not be converted
+    show_camera_stats -- whether the latency and rate are drawn below the image title
 
     Methods:
     setup_cal_display -- Clears window on calibration setup.
@@ -57,7 +181,7 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
     draw_lozenge -- Draws ovals on image.
     get_mouse_state -- Gets mouse position.
     """
-    def __init__(self, window, tracker):
+    def __init__(self, window, tracker, pipelined=False):
         pylink.EyeLinkCustomDisplay.__init__(self)
         self.window = window
         # adjusted to put center at (0,0)
@@ -67,6 +191,17 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         self.pal = []
         self.image_buffer = array.array('I')
 
+        self.pipelined = pipelined
+        self.show_camera_stats = True
+        self.camera_latency = None
+        self.camera_fps = None
+        self.shown_fps = None
+        self._pipeline = _CameraPipeline()
+        self._palette_lut = np.zeros(256, dtype=np.uint32)
+        self._image_stim = None
+        self._last_shown = None
+        self._last_completed = None
+
         if all(i >= 0.5 for i in self.window.color):
             self.text_color = (-1, -1, -1)
         else:
@@ -131,6 +266,14 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
             self.window, units='pix', radius=6, lineColor='black', fillColor='black'
         )
 
+        self.camera_stats_object = psychopy.visual.TextStim(
+            self.window, text='', pos=(0, -230), height=16, units='pix', color=self.text_color
+        )
+
+    @property
+    def dropped_frames(self):
+        return self._pipeline.dropped_frames
+
     def setup_cal_display(self):
         """Clears window on calibration setup."""
         self.window.flip()
@@ -148,12 +291,31 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         psychopy.event.Mouse(visible=True)
         self.window.flip()
 
+        if self.pipelined:
+            self._last_shown = None
+            self._last_completed = None
+            self.camera_latency = None
+            self.camera_fps = None
+            self.shown_fps = None
+            self._pipeline.start()
+
     def image_title(self, title):
         """Updates title text."""
         self.image_title_object.text = title
 
     def draw_image_line(self, width, line, totlines, buff):
-        """Draws image from buffer."""
+        """Draws image from buffer.
+
+        In pipelined mode the line is only copied and complete frames are handed to the worker
+        thread. The newest converted frame is drawn in get_input_key.
+        """
+        if self.pipelined:
+            if self._pipeline.add_line(width, line, totlines, buff, self._palette_lut):
+                completed = time.perf_counter()
+                self.camera_fps = _smoothed_rate(self.camera_fps, self._last_completed, completed)
+                self._last_completed = completed
+            return
+
         for i in buff:
             if i >= len(self.pal):
                 self.image_buffer.append(self.pal[-1])
@@ -173,6 +335,43 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
 
             self.image_buffer = array.array('I')
 
+    def show_newest_camera_image(self):
+        """Draws and flips the newest converted camera frame, if there is a new one.
+
+        Returns True if a frame was shown. Only used in pipelined mode.
+        """
+        newest = self._pipeline.take_newest()
+        if newest is None:
+            return False
+
+        completed, image = newest
+        if self._image_stim is None:
+            self._image_stim = psychopy.visual.ImageStim(self.window, image=image)
+        else:
+            self._image_stim.image = image
+
+        self._image_stim.draw()
+        self.draw_cross_hair()
+        self.image_title_object.draw()
+        if self.show_camera_stats and self.shown_fps is not None:
+            self.camera_stats_object.text = self.camera_stats()
+            self.camera_stats_object.draw()
+        self.window.flip()
+
+        self._update_camera_stats(completed, time.perf_counter())
+        return True
+
+    def camera_stats(self):
+        """Returns the camera and display rates, latency and dropped frames as text."""
+        return '%.0f camera fps, %.0f shown fps, %.0f ms latency, %i dropped' % (
+            self.camera_fps or 0, self.shown_fps or 0, 1000 * (self.camera_latency or 0),
+            self.dropped_frames)
+
+    def _update_camera_stats(self, completed, shown):
+        self.camera_latency = shown - completed
+        self.shown_fps = _smoothed_rate(self.shown_fps, self._last_shown, shown)
+        self._last_shown = shown
+
     def set_image_palette(self, r, g, b):
         """Defines image colors."""
         self.pal = []
@@ -181,8 +380,17 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         for r_, g_, b_ in zip(r, g, b):
             self.pal.append((b_ << 16) | g_ << 8 | r_)
 
+        # Indices past the end of the palette use the last color
+        n = min(len(self.pal), 256)
+        if n:
+            self._palette_lut[:n] = self.pal[:n]
+            self._palette_lut[n:] = self.pal[n - 1]
+
     def exit_image_display(self):
         """Hides mouse when camera images are no longer visible."""
+        if self.pipelined:
+            self._pipeline.stop()
+
         psychopy.event.Mouse(visible=False)
         self.window.flip()
 
@@ -210,6 +418,9 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
 
     def get_input_key(self):
         """Handles key events."""
+        if self.pipelined:  # Called often, so frames converted in between are shown sooner
+            self.show_newest_camera_image()
+
         keys = []
 
         for keycode, modifiers in psychopy.event.getKeys(modifiers=True):
@@ -19,16 +19,33 @@ MockEyelinker -- Has the same attributes and methods as ConnectedEyeLinker, but
  code if there is no tracker connected.
 """
 
+import functools
 import os
 import sys
+import threading
 import time
+import types
 
+import numpy as np
 import pylink as pl
+from linkevents import LinkEventDispatcher, SAMPLE_DTYPE, sample_rows
+import mocktracker
 from PsychoPyCustomDisplay import PsychoPyCustomDisplay
 
 import psychopy.event
 import psychopy.visual
 
+try:  # The session event log from the template directory is optional
+    import eventlog
+except ImportError:
+    eventlog = None
+
+
+def _log_event(event_type, code=0, payload=None):
+    """Writes an event to the session event log of the template experiments, if available."""
+    if eventlog is not None:
+        eventlog.log('eyelinker', event_type, code, payload)
+
 
 def _try_connection():
     """Attempts to connect to eyetracker.
@@ -69,7 +86,7 @@ def _get_connection_failure_response():
     return psychopy.event.waitKeys(keyList=['r', 'q', 'd'])[0]
 
 
-def EyeLinker(window, filename, eye, text_color=None):
+def EyeLinker(window, filename, eye, text_color=None, mock_options=None, pipelined_camera=False):
     """A factory function that either returns a ConnectedEyeLinker or MockEyeLinker.
 
     Parameters:
@@ -78,11 +95,15 @@ def EyeLinker(window, filename, eye, text_color=None):
     eye -- Which eye(s) to track, either "LEFT", "RIGHT" or "BOTH"
     text_color -- Defined using window color to black or white, but can be overwritten by
      providing a (r,g,b) tuple with values between -1 and 1
+    mock_options -- used if continuing in debug mode, see MockEyeLinker
+    pipelined_camera -- convert camera images on a worker thread during setup, see
+     PsychoPyCustomDisplay
     """
     connected, e = _try_connection()
 
     if connected:
-        return ConnectedEyeLinker(window, filename, eye, text_color=None)
+        return ConnectedEyeLinker(window, filename, eye, text_color=text_color,
+                                  pipelined_camera=pipelined_camera)
     else:
         _display_not_connected_text(window)
 
@@ -92,7 +113,8 @@ def EyeLinker(window, filename, eye, text_color=None):
         connected, e = _try_connection()
         if connected:
             window.flip()
-            return ConnectedEyeLinker(window, filename, eye, text_color=None)
+            return ConnectedEyeLinker(window, filename, eye, text_color=text_color,
+                                      pipelined_camera=pipelined_camera)
         else:
             print('Could not connect to tracker. Select again.')
             response = _get_connection_failure_response()
@@ -103,13 +125,26 @@ def EyeLinker(window, filename, eye, text_color=None):
     elif response == 'd':
         window.flip()
         print('Continuing with mock eyetracking. Eyetracking data will not be saved!')
-        return MockEyeLinker(window, filename, eye, text_color=None)
+        return MockEyeLinker(window, filename, eye, text_color=text_color,
+                             mock_options=mock_options)
+
+
+def _offset_message(text, sent):
+    """Returns a message with the offset syntax, to be recorded at time sent (perf_counter)."""
+    # The tracker subtracts the offset (in ms) from the time it receives a message
+    return '%d %s' % (round((time.perf_counter() - sent) * 1000), text)
 
 
 class ConnectedEyeLinker:
     """Returned if a connection is possible."""
-    def __init__(self, window, filename, eye, text_color=None):
-        """See Eyelinker factory function for parameter info."""
+    def __init__(self, window, filename, eye, text_color=None, pipelined_camera=False,
+                 tracker=None, create_display=True):
+        """See Eyelinker factory function for parameter info.
+
+        tracker -- an already connected pylink.EyeLink, a new connection is made if None
+        create_display -- if False, the PsychoPyCustomDisplay is created by initialize_graphics,
+         so the tracker can be connected on a thread other than the window's
+        """
         if len(filename) > 12:
             raise ValueError(
                 'EDF filename must be at most 12 characters long including the extension.')
@@ -126,9 +161,18 @@ class ConnectedEyeLinker:
         self.edf_open = False
         self.eye = eye
         self.resolution = tuple(window.size)
-        self.tracker = pl.EyeLink()
-        self.genv = PsychoPyCustomDisplay(self.window, self.tracker)
+        self.tracker = pl.EyeLink() if tracker is None else tracker
+        self.genv = None
+        self.pipelined_camera = pipelined_camera
+        if create_display:
+            self.genv = self._create_display()
         self.mock = False
+        self.max_buffered = 10000
+
+        self._link_lock = threading.Lock()
+        self.events = LinkEventDispatcher(self.tracker, link_lock=self._link_lock)
+        self._buffered = None  # A list of (time, kind, text) while the link is down
+        self._deferred = None  # A list of (time, message) between defer and flush_messages
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -138,11 +182,16 @@ class ConnectedEyeLinker:
         else:
             self.text_color = text_color
 
+    def _create_display(self):
+        return PsychoPyCustomDisplay(self.window, self.tracker, pipelined=self.pipelined_camera)
+
     def initialize_graphics(self):
-        """Opens the PsychoPyCustomDisplay object.
+        """Opens the PsychoPyCustomDisplay object, creating it if needed.
 
-        Must be called during setup phase.
+        Must be called during setup phase, from the thread that owns the window.
         """
+        if self.genv is None:
+            self.genv = self._create_display()
         self.set_offline_mode()
         pl.openGraphicsEx(self.genv)
 
@@ -249,7 +298,8 @@ class ConnectedEyeLinker:
         self.edf_open = True
 
     def close_edf(self):
-        """Closes the edf file at the end of the experiment."""
+        """Closes the edf file at the end of the experiment, after sending deferred messages."""
+        self.flush_messages()
         self.tracker.closeDataFile()
         self.edf_open = False
 
@@ -373,8 +423,9 @@ class ConnectedEyeLinker:
         """Stops the eyetracking recording.
 
         Requires a short delay before calling, so do not call this function during a timing
-         specific part of the experiment.
+         specific part of the experiment. Deferred messages are sent first, see defer_messages.
         """
+        self.flush_messages()
         time.sleep(.1)  # required
         self.tracker.stopRecording()
 
@@ -413,13 +464,65 @@ class ConnectedEyeLinker:
         """
         sample = self.tracker.getNewestSample()
 
-        if self.eye == 'LEFT':
+        if not sample:
+            return (None, None) if self.eye == 'BOTH' else None
+        elif self.eye == 'LEFT':
             return sample.getLeftEye().getPupilSize()
         elif self.eye == 'RIGHT':
             return sample.getRightEye().getPupilSize()
         else:
             return (sample.getLeftEye().getPupilSize(), sample.getRightEye().getPupilSize())
 
+    def drain_samples(self, event_callback=None):
+        """Returns every link sample received since the last call.
+
+        gaze_data and pupil_size only return the newest sample, so samples between two reads are
+         lost. This function empties pylink's link buffer instead and returns all samples as a
+         numpy array with the SAMPLE_DTYPE fields (time, eye, gaze_x, gaze_y, pupil, status), with
+         one row per recorded eye. Should be called regularly while recording, as the link buffer
+         is limited in size.
+
+        Parameters:
+        event_callback -- optionally, a function called with the pylink data type and event
+         object of every link event (e.g. pl.ENDFIX) in the buffer. Otherwise events are dropped.
+         Not used while the event dispatcher is running, which reads the buffer itself and
+         dispatches the events to the callbacks registered with `events.on`.
+        """
+        if self.events.running:
+            return self.events.drain_samples()
+
+        # If the worker thread stopped on an error, raises it once and then keeps the samples
+        # it read before the error
+        rows = self.events.drain_samples().tolist()
+        data_type = self.tracker.getNextData()
+        while data_type:
+            item = self.tracker.getFloatData()
+            if data_type == pl.SAMPLE_TYPE:
+                rows.extend(sample_rows(item))
+            elif event_callback is not None:
+                event_callback(data_type, item)
+            data_type = self.tracker.getNextData()
+
+        return np.array(rows, dtype=SAMPLE_DTYPE)
+
+    def start_event_dispatcher(self, poll_interval=0.001):
+        """Starts passing link events to the callbacks and futures registered on `events`.
+
+        Link events are read on a worker thread, e.g.
+        `tracker.events.on('saccade_start', callback)` calls callback with a LinkEvent
+         (kind, eye, time, event) for every saccade, and `tracker.events.next_event('blink_end')`
+         returns a future for the next blink. While the dispatcher runs, drain_samples returns
+         the samples read by the worker thread.
+
+        Parameters:
+        poll_interval -- seconds to wait when the link buffer is empty
+        """
+        self.events.start(poll_interval)
+
+    def stop_event_dispatcher(self):
+        """Stops the worker thread started by start_event_dispatcher."""
+        self.events.stop()
+
     def set_offline_mode(self):
         """Sets tracker to offline mode."""
         self.tracker.setOfflineMode()
@@ -432,7 +535,8 @@ class ConnectedEyeLinker:
         Parameters:
         cmd -- A string containing the command to be send to the tracker
         """
-        self.tracker.sendCommand(cmd)
+        _log_event('command', payload=cmd)
+        self._send_to_link('command', cmd)
 
     def send_message(self, msg):
         """Sends a message to be saved to the EDF file.
@@ -442,7 +546,112 @@ class ConnectedEyeLinker:
         Parameters:
         msg -- A string containing information to be saved.
         """
-        self.tracker.sendMessage(msg)
+        _log_event('message', payload=msg)
+        with self._link_lock:
+            if self._deferred is not None:
+                self._deferred.append((time.perf_counter(), msg))
+                return
+
+        self._send_to_link('message', msg)
+
+    def defer_messages(self):
+        """Queues messages instead of sending them, until flush_messages is called.
+
+        Sending a message takes time on the link, so during a trial it can delay a flip. Queued
+         messages keep the time send_message was called, and are sent with an offset by
+         flush_messages (e.g. in the intertrial interval), so the EDF file has that time.
+         stop_recording always flushes the queue first.
+        """
+        with self._link_lock:
+            if self._deferred is None:
+                self._deferred = []
+
+    def flush_messages(self):
+        """Sends the messages queued since defer_messages in order and stops queueing.
+
+        Returns the number of messages sent.
+        """
+        with self._link_lock:
+            deferred, self._deferred = self._deferred or [], None
+
+        for sent, msg in deferred:
+            self._send_to_link('message', msg, sent)
+
+        return len(deferred)
+
+    def _send_to_link(self, kind, text, sent=None):
+        """Sends a message or command, or buffers it if the link is down.
+
+        Messages with a sent time (from time.perf_counter) are sent with an offset, so the
+         tracker records them at that time.
+        """
+        with self._link_lock:
+            if self._buffered is None:
+                try:
+                    if kind == 'message' and sent is not None:
+                        error = self.tracker.sendMessage(_offset_message(text, sent))
+                    elif kind == 'message':
+                        error = self.tracker.sendMessage(text)
+                    else:
+                        error = self.tracker.sendCommand(text)
+                except RuntimeError:
+                    error = True
+                if not error:
+                    return
+                self._buffered = []  # The link dropped, raised or reported by a nonzero code
+
+            if len(self._buffered) >= self.max_buffered:
+                print('Warning: Tracker link down too long, dropping buffered %s.' % kind)
+                self._buffered.pop(0)
+            self._buffered.append((time.perf_counter() if sent is None else sent, kind, text))
+
+    @property
+    def buffering(self):
+        """True while messages and commands are buffered because the link is down."""
+        return self._buffered is not None
+
+    def is_connected(self):
+        """A cheap check of the link to the tracker, used as a heartbeat."""
+        with self._link_lock:
+            try:
+                return self.tracker.isConnected() != 0
+            except RuntimeError:
+                return False
+
+    def start_buffering(self):
+        """Buffers messages and commands instead of sending them, until reconnect is called."""
+        with self._link_lock:
+            if self._buffered is None:
+                self._buffered = []
+
+    def reconnect(self):
+        """Opens a new link to the tracker and sends the buffered messages and commands.
+
+        Messages are sent with an offset, so the EDF file has the time they were originally sent.
+        Raises RuntimeError if the tracker cannot be reached. Returns the number of messages and
+        commands that were sent.
+        """
+        tracker = pl.EyeLink()
+
+        with self._link_lock:
+            try:
+                self.tracker.close()
+            except RuntimeError:
+                pass
+
+            self.tracker = tracker
+            if self.genv is not None:
+                self.genv.tracker = tracker
+            self.events.tracker = tracker
+
+            buffered, self._buffered = self._buffered or [], None
+            for sent, kind, text in buffered:
+                if kind == 'message':
+                    tracker.sendMessage(_offset_message(text, sent))
+                else:
+                    tracker.sendCommand(text)
+
+        return len(buffered)
 
     def send_status(self, status):
         """Sends a status to be displayed to the experimenter.
@@ -457,14 +666,18 @@ class ConnectedEyeLinker:
         if len(status) >= 80:
             print('Warning: Status should be less than 80 characters.')
 
-        self.send_command("record_status_message '%s'" % status)
+        _log_event('status', payload=status)
+        self._send_to_link('command', "record_status_message '%s'" % status)
 
     def close_connection(self):
         """Closes the connection to the tracker.
 
         Must be called at the end of the experiment."""
-        self.tracker.close()
-        pl.closeGraphics()
+        try:
+            self.events.stop()
+        finally:
+            self.tracker.close()
+            pl.closeGraphics()
 
 
 # Creates a mock object to be used if tracker doesn't connect for debug purposes
@@ -476,19 +689,54 @@ def _mock_func(*args, **kwargs):
     pass
 
 
+# Methods that are not sent by a mock, but still written to the session event log
+_logged_methods = {'send_message': 'message', 'send_command': 'command', 'send_status': 'status'}
+
+
+# Methods that work with the trackers from mocktracker, as they only use the link data
+_streamed_methods = ['record', 'start_recording', 'stop_recording', 'drain_samples',
+                     'start_event_dispatcher', 'stop_event_dispatcher']
+
+
+def _mock_tracker(eye, resolution, mock_options):
+    """Returns a tracker from mocktracker for the mock_options, or None."""
+    if mock_options is None:
+        return None
+
+    options = dict(mock_options)
+    replay = options.pop('replay', None)
+    if replay is not None:
+        return mocktracker.ReplayTracker(replay, **options)
+
+    return mocktracker.SyntheticTracker(eye, resolution=resolution, **options)
+
+
 class MockEyeLinker:
-    """Returned if a connection could not be made, useful for debugging away from the trackers."""
-    def __init__(self, window, filename, eye, text_color=None):
+    """Returned if a connection could not be made, useful for debugging away from the trackers.
+
+    By default gaze_data and pupil_size contain None and drain_samples returns no samples. With
+     mock_options, samples and link events are produced by a stand-in tracker instead, so gaze
+     contingent code can be tested without an EyeLink:
+
+    {'rate': 500, 'seed': 1} -- generates a seeded stream of fixations, saccades and blinks.
+     'rate' (Hz), 'seed' and 'speed' are optional, so {} uses the defaults.
+    {'replay': 'session.asc', 'speed': 4} -- replays the samples and events of an asc file,
+     here at 4 times the original speed.
+
+    Samples arrive once start_recording is called, and can be read with the same properties,
+     drain_samples and event dispatcher as with a ConnectedEyeLinker.
+    """
+    def __init__(self, window, filename, eye, text_color=None, mock_options=None):
         self.window = window
         self.edf_filename = filename
         self.edf_open = False
         self.eye = eye
         self.resolution = tuple(window.size)
-        self.tracker = None
+        self.tracker = _mock_tracker(eye, self.resolution, mock_options)
         self.genv = None
-        self.gaze_data = (None, None)
-        self.pupil_size = (None, None)
+        self.events = LinkEventDispatcher(self.tracker)
         self.mock = True
+        self.buffering = False
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -501,8 +749,36 @@ class MockEyeLinker:
         for fn_name in _method_list:
             setattr(self, fn_name, _mock_func)
 
+        for fn_name, event_type in _logged_methods.items():
+            setattr(self, fn_name, functools.partial(_log_event, event_type, 0))
+
         # Decorator must return a function
         def record(*args, **kwargs):
             return _mock_func
 
         self.record = record
+
+        # Returns the same (empty) array a tracker would when no samples are queued
+        def drain_samples(*args, **kwargs):
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+
+        self.drain_samples = drain_samples
+
+        if self.tracker is not None:
+            for fn_name in _streamed_methods:
+                method = types.MethodType(getattr(ConnectedEyeLinker, fn_name), self)
+                setattr(self, fn_name, method)
+
+    @property
+    def gaze_data(self):
+        """See ConnectedEyeLinker.gaze_data, (None, None) without mock_options."""
+        if self.tracker is None:
+            return (None, None)
+        return ConnectedEyeLinker.gaze_data.fget(self)
+
+    @property
+    def pupil_size(self):
+        """See ConnectedEyeLinker.pupil_size, (None, None) without mock_options."""
+        if self.tracker is None:
+            return (None, None)
+        return ConnectedEyeLinker.pupil_size.fget(self)
@@ -85,6 +85,18 @@ print(len(real_time_data))
 print('Continuous data head:')
 print(real_time_data[:10])
 
+# every sample, without polling
+tracker.start_recording()
+tracker.drain_samples()  # discard anything left over
+time.sleep(1)
+samples = tracker.drain_samples()
+tracker.stop_recording()
+
+print('Number of drained samples (one row per eye):')
+print(len(samples))
+print('Drained data head:')
+print(samples[:10])
+
 # test drift correct
 tracker.drift_correct()
 print('Drift correct tests passed...')
@@ -0,0 +1,237 @@
+"""Reads samples and events from the EyeLink link, optionally on a worker thread.
+
+Used by eyelinker. initialize_tracker turns on link events for fixations, saccades and blinks,
+and a LinkEventDispatcher passes each of them to registered callbacks and futures as soon as it
+arrives, which makes gaze-contingent changes possible without polling gaze_data.
+
+While the dispatcher is running it is the only reader of the link buffer, so the samples it
+reads are kept and returned by drain_samples. If reading the link fails (e.g. a RuntimeError
+when the link drops), the worker thread stops and the error is raised by the next call to
+drain_samples or stop.
+
+Classes:
+LinkEventDispatcher -- Reads the link buffer on a worker thread and dispatches events.
+LinkEvent -- A namedtuple (kind, eye, time, event) passed to callbacks and futures.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+import traceback
+
+import numpy as np
+import pylink as pl
+
+
+# One row per eye per link sample, see drain_samples
+SAMPLE_DTYPE = np.dtype([
+    ('time', np.float64),  # tracker time in ms, with .5 at 2000 Hz
+    ('eye', np.int8),  # 0 for the left eye, 1 for the right eye
+    ('gaze_x', np.float32),  # pixels, nan if missing
+    ('gaze_y', np.float32),
+    ('pupil', np.float32),
+    ('status', np.uint16),  # the sample's error and status flags
+])
+
+# kind -- e.g. 'saccade_end'
+# eye -- 0 for the left eye, 1 for the right eye
+# time -- tracker time in ms of the start (for start events) or end (for end events)
+# event -- the pylink event object, with e.g. getEndGaze() for saccades
+LinkEvent = collections.namedtuple('LinkEvent', ['kind', 'eye', 'time', 'event'])
+
+_event_kinds = {
+    pl.STARTFIX: 'fixation_start',
+    pl.ENDFIX: 'fixation_end',
+    pl.STARTSACC: 'saccade_start',
+    pl.ENDSACC: 'saccade_end',
+    pl.STARTBLINK: 'blink_start',
+    pl.ENDBLINK: 'blink_end',
+}
+
+EVENT_KINDS = tuple(_event_kinds.values())
+
+
+def sample_rows(sample):
+    """Returns a (time, eye, gaze x, gaze y, pupil, status) tuple for each eye in a sample."""
+    rows = []
+    for eye, recorded, eye_data in ((0, sample.isLeftSample, sample.getLeftEye),
+                                    (1, sample.isRightSample, sample.getRightEye)):
+        if not recorded():
+            continue
+
+        data = eye_data()
+        x, y = data.getGaze()
+        if x == pl.MISSING_DATA or y == pl.MISSING_DATA:
+            x, y = np.nan, np.nan
+        rows.append((sample.getTime(), eye, x, y, data.getPupilSize(), sample.getStatus()))
+
+    return rows
+
+
+def _check_kind(kind):
+    if kind not in EVENT_KINDS:
+        raise ValueError('kind must be one of %s.' % ', '.join(EVENT_KINDS))
+
+
+class LinkEventDispatcher:
+    """Reads the link buffer on a worker thread and dispatches events.
+
+    Callbacks are called on the worker thread, so they should be short (e.g. set a flag or
+    change a stimulus attribute) and must not draw or flip the window.
+
+    Parameters:
+    tracker -- a pylink.EyeLink object
+    max_samples -- how many sample rows are kept for drain_samples, older rows are dropped
+    link_lock -- a lock held while reading the link, shared with other users of the tracker
+    """
+    def __init__(self, tracker, max_samples=600000, link_lock=None):
+        self.tracker = tracker
+        self.running = False
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._link_lock = threading.Lock() if link_lock is None else link_lock
+        self._samples = collections.deque(maxlen=max_samples)
+        self._callbacks = {kind: [] for kind in EVENT_KINDS}
+        self._futures = {kind: [] for kind in EVENT_KINDS}
+
+    def on(self, kind, callback):
+        """Registers a function that is called with a LinkEvent for every event of a kind.
+
+        Parameters:
+        kind -- one of EVENT_KINDS, e.g. 'saccade_start'
+        callback -- a function taking a LinkEvent
+        """
+        _check_kind(kind)
+        with self._lock:
+            self._callbacks[kind].append(callback)
+
+    def remove(self, kind, callback):
+        """Stops calling a function registered with on."""
+        with self._lock:
+            self._callbacks[kind].remove(callback)
+
+    def next_event(self, kind):
+        """Returns a concurrent.futures.Future that is resolved by the next event of a kind.
+
+        Useful in a frame loop: check future.done() before every flip, or block with
+         future.result(timeout).
+
+        Parameters:
+        kind -- one of EVENT_KINDS, e.g. 'fixation_end'
+        """
+        _check_kind(kind)
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._futures[kind].append(future)
+        return future
+
+    def dispatch(self, kind, eye, time, event=None):
+        """Passes an event to the callbacks and futures waiting for its kind.
+
+        Called by the worker thread, but can also be used to inject events (e.g. for testing).
+        """
+        link_event = LinkEvent(kind, eye, time, event)
+
+        with self._lock:
+            callbacks = list(self._callbacks[kind])
+            futures = self._futures[kind]
+            self._futures[kind] = []
+
+        for future in futures:
+            if not future.cancelled():
+                future.set_result(link_event)
+
+        for callback in callbacks:
+            try:
+                callback(link_event)
+            except Exception:  # A broken callback should not stop the dispatcher
+                traceback.print_exc()
+
+    def _handle(self, data_type, item):
+        if data_type == pl.SAMPLE_TYPE:
+            rows = sample_rows(item)
+            with self._lock:
+                self._samples.extend(rows)
+            return
+
+        kind = _event_kinds.get(data_type)
+        if kind is None:
+            return
+
+        if kind.endswith('_start'):
+            event_time = item.getStartTime()
+        else:
+            event_time = item.getEndTime()
+
+        self.dispatch(kind, item.getEye(), event_time, item)
+
+    def _read(self):
+        """Returns the type and object of the next item in the link buffer, or (0, None)."""
+        with self._link_lock:
+            data_type = self.tracker.getNextData()
+            if not data_type:
+                return 0, None
+            return data_type, self.tracker.getFloatData()
+
+    def _run(self, poll_interval):
+        try:
+            while self.running:
+                data_type, item = self._read()
+                if not data_type:
+                    time.sleep(poll_interval)
+                    continue
+                self._handle(data_type, item)
+        except Exception as e:  # Raised again by drain_samples or stop
+            self.error = e
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():  # Not replaced by a restart
+                    self.running = False
+
+    def _raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def start(self, poll_interval=0.001):
+        """Starts reading the link buffer on a worker thread.
+
+        Parameters:
+        poll_interval -- seconds to wait when the buffer is empty
+        """
+        with self._lock:
+            if self.running:
+                return
+
+            self.running = True
+            self._thread = threading.Thread(
+                target=self._run, args=(poll_interval,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the worker thread. Events that have not been read stay in the link buffer.
+
+        Raises the error that stopped the worker thread, if there was one.
+        """
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def drain_samples(self):
+        """Returns the samples read since the last call as a SAMPLE_DTYPE array.
+
+        Raises the error that stopped the worker thread, if there was one. The samples read
+        before the error are returned by the next call.
+        """
+        self._raise_error()
+
+        with self._lock:
+            rows = list(self._samples)
+            self._samples.clear()
+
+        return np.array(rows, dtype=SAMPLE_DTYPE)
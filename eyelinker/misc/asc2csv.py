@@ -1,67 +1,408 @@
 #!/usr/bin/env python
 
-"""A short script that will turn an asc file from edf2asc into a csv file."""
+"""A short script that will turn an asc file from edf2asc into a csv file.
+
+Samples can optionally be downsampled to a lower rate with an anti-aliasing filter, see
+ascresample.py (requires numpy). With --watch, a folder is watched and new or updated files
+are converted as they appear, see ascwatch.py.
+
+Optionally, the fixation, saccade and blink events computed by the tracker, as well as all
+messages, are written to separate csv files (filename_fixations.csv, filename_saccades.csv,
+filename_blinks.csv and filename_messages.csv). These are collected in the same pass over the
+file as the samples. Every row is tagged with the block and trial it occurred in.
+
+Messages sent with an offset (MSG <time> <offset> <text>, e.g. by flush_messages in
+eyelinker) are given the time they were meant for, time - offset.
+
+Compressed asc files (.asc.gz, .asc.xz and, if the zstandard package is installed, .asc.zst)
+are read as streams. With --compress (and optionally --level), the csv files are written
+compressed as well. Decompression and compression run on separate threads so that they
+overlap with parsing. See bench_asc2csv.py for throughput and size numbers.
+"""
 
 import argparse
+import csv
 import glob
+import gzip
+import io
+import lzma
 import os
+import queue
 import re
 import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+_compressions = ('.gz', '.xz', '.zst')
+
+# Levels that keep up with parsing while still compressing csv files well
+_default_levels = {'.gz': 6, '.xz': 1, '.zst': 3}
+
+_eye_names = {'LEFT': 'Left', 'RIGHT': 'Right'}
+
+# MSG <time> [<offset>] <text>, a number followed by more text is an offset
+_message_pattern = re.compile(r'MSG\s+([0-9.]+)\s+(?:(-?[0-9]+)\s+(?=\S))?(.*?)\s*$')
+_block_pattern = re.compile(r'BLOCK ([0-9]+)')
+_trial_pattern = re.compile(r'TRIAL ([0-9]+)')
+
+# Maps the line type to the table name and the number of fields kept after the line type
+_event_types = {
+    'EFIX': ('fixations', 7),
+    'ESACC': ('saccades', 10),
+    'EBLINK': ('blinks', 4),
+}
+
+_event_headers = {
+    'fixations': ['Block', 'Trial', 'Eye', 'Start', 'End', 'Duration', 'X', 'Y', 'Pupil'],
+    'saccades': ['Block', 'Trial', 'Eye', 'Start', 'End', 'Duration', 'StartX', 'StartY',
+                 'EndX', 'EndY', 'Amplitude', 'PeakVelocity'],
+    'blinks': ['Block', 'Trial', 'Eye', 'Start', 'End', 'Duration'],
+    'messages': ['Block', 'Trial', 'Time', 'Message'],
+}
+
+
+class _PrefetchReader(io.RawIOBase):
+    """Reads a (decompressing) binary stream on a separate thread.
+
+    Parameters:
+    stream -- a binary file object
+    chunk_size -- the number of bytes read at a time
+    depth -- the number of chunks that can be waiting to be parsed
+    """
+    def __init__(self, stream, chunk_size=1 << 20, depth=8):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=depth)
+        self.pending = memoryview(b'')
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read_chunks, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _read_chunks(self):
+        try:
+            chunk = self.stream.read(self.chunk_size)
+            while chunk and not self.stopped.is_set():
+                self._put(chunk)
+                chunk = self.stream.read(self.chunk_size)
+            self._put(b'')
+        except Exception as e:  # Raised again on the reading thread
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.chunks.put(b'')  # Every later read also sees the end of the file
+            self.pending = memoryview(chunk)
+
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.stream.close()
+        super().close()
+
+
+class _BackgroundWriter(io.RawIOBase):
+    """Writes to a (compressing) binary stream on a separate thread.
+
+    Parameters:
+    stream -- a binary file object
+    depth -- the number of chunks that can be waiting to be compressed
+    """
+    def __init__(self, stream, depth=8):
+        self.stream = stream
+        self.chunks = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self.thread.start()
+
+    def _write_chunks(self):
+        chunk = self.chunks.get()
+        while chunk is not None:
+            if self.error is None:
+                try:
+                    self.stream.write(chunk)
+                except Exception as e:  # Raised again on the writing thread
+                    self.error = e
+            chunk = self.chunks.get()
+
+    def writable(self):
+        return True
+
+    def write(self, buffer):
+        if self.error is not None:
+            raise self.error
+        self.chunks.put(bytes(buffer))
+        return len(buffer)
+
+    def close(self):
+        if not self.closed:
+            self.chunks.put(None)
+            self.thread.join()
+            self.stream.close()
+        super().close()
+        if self.error is not None:
+            raise self.error
+
+
+def _split_compression(filename):
+    """Returns the filename without a compression extension, and the extension."""
+    for extension in _compressions:
+        if filename.endswith(extension):
+            return filename[:-len(extension)], extension
+    return filename, ''
+
+
+def _open_binary(filename, mode, level=None):
+    """Opens a binary (de)compressing stream based on the filename extension."""
+    extension = _split_compression(filename)[1]
+
+    if level is None:
+        level = _default_levels[extension]
+
+    if extension == '.gz':
+        return gzip.open(filename, mode, compresslevel=level)
+    elif extension == '.xz':
+        return lzma.open(filename, mode, preset=None if mode == 'rb' else level)
+    elif zstandard is None:
+        raise ImportError('The zstandard package is required for .zst files.')
+    elif mode == 'rb':
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'))
+    else:
+        return zstandard.ZstdCompressor(level=level).stream_writer(open(filename, 'wb'))
+
+
+def open_asc(filename):
+    """Opens an asc file for reading text, decompressing it on a separate thread if needed."""
+    if not _split_compression(filename)[1]:
+        return open(filename)
+
+    reader = _PrefetchReader(_open_binary(filename, 'rb'))
+    return io.TextIOWrapper(io.BufferedReader(reader, buffer_size=1 << 20))
+
+
+def _open_output(filename, level=None, newline=None):
+    """Opens a file for writing text.
+
+    If the filename has a compression extension, the file is compressed on a separate thread.
+    """
+    if not _split_compression(filename)[1]:
+        return open(filename, 'w', newline=newline)
+
+    writer = _BackgroundWriter(_open_binary(filename, 'wb', level))
+    return io.TextIOWrapper(io.BufferedWriter(writer, buffer_size=1 << 20), newline=newline)
+
+
+class EventTables:
+    """Writes tracker events to one csv file per event type.
+
+    Parameters:
+    file_base -- the filename of the sample csv with no extension, table names are appended
+    extension -- the extension of the csv files, e.g. '.csv' or '.csv.gz'
+    level -- the compression level if the files are compressed
+    """
+    def __init__(self, file_base, extension='.csv', level=None):
+        self.files = {}
+        self.writers = {}
+
+        for table, table_header in _event_headers.items():
+            self.files[table] = _open_output(
+                file_base + '_' + table + extension, level=level, newline='')
+            self.writers[table] = csv.writer(self.files[table])
+            self.writers[table].writerow(table_header)
+
+    def add_line(self, line, block, trial):
+        """Writes the line to the matching table if it is an event or message line."""
+        if line.startswith('MSG'):
+            message = parse_message(line)
+            if message is not None:
+                self.writers['messages'].writerow([block, trial, message[0], message[1]])
+            return
+
+        fields = line.split()
+
+        if not fields:
+            return
+
+        if fields[0] in _event_types:
+            table, n_fields = _event_types[fields[0]]
+            values = ['NA' if value == '.' else value for value in fields[1:n_fields + 1]]
+            self.writers[table].writerow([block, trial] + values)
 
+    def close(self):
+        for table_file in self.files.values():
+            table_file.close()
 
-def convert_to_csv(filename, header, overwrite):
-    file_base = filename.rstrip('.asc')
-    newfile = file_base + '.csv'
+
+def parse_samples_line(line):
+    """Returns the sample rate and channel names from a SAMPLES line."""
+    fields = line.split()
+    rate = float(fields[fields.index('RATE') + 1])
+
+    channels = []
+    for field in fields:
+        if field in _eye_names:
+            eye = _eye_names[field]
+            channels.extend([eye + 'GazeX', eye + 'GazeY', eye + 'PupilArea'])
+
+    return rate, channels
+
+
+def parse_timestamp(text):
+    """Returns a timestamp as an int, or a float for fractional times (e.g. at 2000 Hz)."""
+    return float(text) if '.' in text else int(text)
+
+
+def parse_message(line):
+    """Returns the time and text of a MSG line, or None if it has no text.
+
+    The time of a message sent with an offset is time - offset, when it was meant to be sent.
+    """
+    match = _message_pattern.match(line)
+    if match is None or not match.group(3):
+        return None
+
+    time = parse_timestamp(match.group(1))
+    if match.group(2) is not None:
+        time -= int(match.group(2))
+
+    return time, match.group(3)
+
+
+def update_block_and_trial(line, block, trial):
+    """Returns the block and trial, updated if the line is a BLOCK or TRIAL message."""
+    message = parse_message(line)
+    if message is None:
+        return block, trial
+
+    block_match = _block_pattern.match(message[1])
+    if block_match:
+        block = block_match.group(1)
+    trial_match = _trial_pattern.match(message[1])
+    if trial_match:
+        trial = trial_match.group(1)
+
+    return block, trial
+
+
+def _file_base(filename):
+    """Returns the filename without the .asc extension (and any compression extension)."""
+    filename = _split_compression(filename)[0]
+    if filename[-4:] == '.asc':
+        return filename[:-4]
+    return filename
+
+
+def is_asc(filename):
+    """Returns True if the filename is an asc file, compressed or not."""
+    return _split_compression(filename)[0][-4:] == '.asc'
+
+
+def _has_flags(filename):
+    """Returns True if samples end with a field of flags that should be converted to bools."""
+    with open_asc(filename) as old_file:
+        first = old_file.readline().strip()
+        match = re.match('[0-9]+.?[0-9]+', first[-5:])
+
+    return match is None
+
+
+def _format_sample(line, add_bools):
+    """Returns the csv formatted sample line, without block and trial."""
+    if not add_bools:
+        line = line.replace('   .', 'NA')
+        return line.replace('\t', ',')
+
+    line = line.strip()
+    base_line = line[:-6].replace('   .', 'NA').replace('\t', ',')
+    bools = ''.join([',' + str(c != '.') for c in line[-5:]])
+
+    return base_line + bools + '\n'
+
+
+def _new_filename(file_base, overwrite, extension='.csv'):
+    """Returns the csv filename, adding (i) to the name if the file exists."""
+    newfile = file_base + extension
     if not overwrite:
         i = 1
         while os.path.isfile(newfile):
-            newfile = file_base + '(%i).csv' % i
+            newfile = file_base + '(%i)' % i + extension
             i += 1
 
-    with open(newfile, 'w') as newfile:
+    return newfile
+
+
+def _sample_writer(newfile, resample):
+    """Returns the resampler (or None) and the function that sample rows are passed to."""
+    if not resample:
+        return None, newfile.write
+
+    import ascresample
+    resampler = ascresample.ResampledWriter(newfile, resample)
+    return resampler, resampler.add_row
+
+
+def convert_to_csv(filename, header, overwrite, events=False, resample=None, compress=None,
+                   level=None):
+    extension = '.csv' if compress is None else '.csv.' + compress.lstrip('.')
+    newfile = _new_filename(_file_base(filename), overwrite, extension)
+    add_bools = _has_flags(filename)
+
+    if events:
+        event_tables = EventTables(newfile[:-len(extension)], extension, level)
+    else:
+        event_tables = None
+
+    with _open_output(newfile, level) as newfile, open_asc(filename) as old_file:
         if header:
             newfile.write(header+'\n')
 
-        with open(filename) as old_file:
-            first = old_file.readline().strip()
-            match = re.match('[0-9]+.?[0-9]+', first[-5:])
-
-        if match is None:
-            add_bools = True
-        else:
-            add_bools = False
-
-        # TODO refactor this
-        with open(filename) as old_file:
-            block = 0
-            trial = 0
-            for line in old_file.readlines():
-                if re.match('[0-9].*', line):
-                    newfile.write(str(block) + ',' + str(trial) + ',')
-                    if add_bools:
-                        base_line = line.strip()[:-6]
-                        base_line = base_line.replace('   .', 'NA')
-                        newfile.write(base_line.replace('\t', ','))
-
-                        bools = []
-                        for c in line.strip()[-5:]:
-                            if c == '.':
-                                bools.append(False)
-                            else:
-                                bools.append(True)
-
-                        for b in bools:
-                            newfile.write(',' + str(b))
-
-                        newfile.write('\n')
-                    else:
-                        line = line.replace('   .', 'NA')
-                        newfile.write(line.replace('\t', ','))
-                else:
-                    if re.match('MSG\t[0-9]+\tBLOCK ([0-9]+)', line):
-                        block = re.match('MSG\t[0-9]+\tBLOCK ([0-9]+)', line).group(1)
-                    if re.match('MSG\t[0-9]+\tTRIAL ([0-9]+)', line):
-                        trial = re.match('MSG\t[0-9]+\tTRIAL ([0-9]+)', line).group(1)
+        resampler, write_sample = _sample_writer(newfile, resample)
+
+        block = 0
+        trial = 0
+        for line in old_file:
+            if line[:1].isdigit():
+                write_sample(str(block) + ',' + str(trial) + ',' + _format_sample(line, add_bools))
+                continue
+
+            if resampler is not None and line.startswith('SAMPLES'):
+                rate, channels = parse_samples_line(line)
+                resampler.start_recording(rate, len(channels))
+            elif line.startswith('MSG'):
+                block, trial = update_block_and_trial(line, block, trial)
+
+            if event_tables is not None:
+                event_tables.add_line(line, block, trial)
+
+        if resampler is not None:
+            resampler.close()
+
+    if event_tables is not None:
+        event_tables.close()
 
 
 def find_files():
@@ -70,10 +411,12 @@ def find_files():
     if not sys.stdin.isatty():
         for file in sys.stdin:
             file = file.strip().lstrip('./')
-            if file[-4:] == '.asc':
+            if is_asc(file):
                 files.append(file)
     else:
         files = glob.glob('*.asc')
+        for extension in _compressions:
+            files.extend(glob.glob('*.asc' + extension))
 
     return files
 
@@ -85,10 +428,31 @@ def main():
     )
     ap.add_argument('-H', '--header', help='The header for the csv files.')
     ap.add_argument('-o', '--overwrite', help='Files will be overwritten.', action='store_true')
+    ap.add_argument(
+        '-e', '--events', action='store_true',
+        help='Also write fixations, saccades, blinks and messages to separate csv files.'
+    )
+    ap.add_argument(
+        '-r', '--resample', type=float,
+        help='Downsample to this rate in Hz (the recorded rate must be a multiple of it).'
+    )
+
+    ap.add_argument(
+        '-c', '--compress', choices=['gz', 'xz', 'zst'], help='Write compressed csv files.'
+    )
+    ap.add_argument('-l', '--level', type=int, help='The compression level.')
+    ap.add_argument(
+        '-w', '--watch', metavar='DIR',
+        help='Keep converting new or updated files in DIR as they appear (see ascwatch.py).'
+    )
 
     args = vars(ap.parse_args())
 
     overwrite = args['overwrite']
+    events = args['events']
+    resample = args['resample']
+    compress = args['compress']
+    level = args['level']
 
     if args['filename']:
         filename = args['filename']
@@ -105,11 +469,18 @@ def main():
     else:
         header = args['header']
 
-    if filename:
-        convert_to_csv(filename, header, overwrite)
+    if args['watch']:
+        import ascwatch
+        try:
+            ascwatch.watch(args['watch'], header, events, resample, compress=compress,
+                           level=level)
+        except KeyboardInterrupt:
+            pass
+    elif filename:
+        convert_to_csv(filename, header, overwrite, events, resample, compress, level)
     else:
         for filename in find_files():
-            convert_to_csv(filename, header, overwrite)
+            convert_to_csv(filename, header, overwrite, events, resample, compress, level)
 
 
 if __name__ == '__main__':
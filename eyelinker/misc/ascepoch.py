@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""A short script that cuts an asc file from edf2asc into epochs around messages.
+
+Every message matching one of the given patterns (e.g. the 'SYNC <code>' messages sent by
+send_synced_event) starts an epoch covering tmin to tmax milliseconds around the message.
+The file is streamed once and samples are written directly into a preallocated
+epochs x times x channels array, so the full sample table is never held in memory. Samples
+before each message are kept in a small ring buffer for windows that start before the event,
+and for messages sent with an offset (see asc2csv.parse_message), which are written after the
+samples of the time they refer to.
+
+The result is saved as an npz file containing 'epochs', 'times', 'channels' and one array per
+metadata field ('block', 'trial', 'time', 'message').
+"""
+
+import argparse
+import math
+import re
+
+import numpy as np
+
+import asc2csv
+
+
+def _parse_sample(line, n_channels):
+    """Returns the timestamp and the channel values of a sample line, '.' becomes nan."""
+    fields = line.split()
+    values = [math.nan if value == '.' else float(value) for value in fields[1:n_channels + 1]]
+    return asc2csv.parse_timestamp(fields[0]), values
+
+
+class _Epocher:
+    """Holds the state needed to fill epochs while streaming samples."""
+    def __init__(self, tmin, tmax, rate, n_channels, capacity, max_offset=0):
+        self.tmin = tmin
+        self.rate = rate
+        self.n_times = int(round((tmax - tmin) * rate / 1000))
+        self.n_channels = n_channels
+        self.epochs = np.full((capacity, self.n_times, n_channels), np.nan)
+        self.n_epochs = 0
+        self.open_epochs = []  # (epoch index, event time)
+
+        # Samples that could fall in the window before an event, or before a message's offset
+        n_before = max(0, int(math.ceil((max_offset - tmin) * rate / 1000)))
+        self.ring_times = np.full(n_before, -1e12)
+        self.ring_values = np.full((n_before, n_channels), np.nan)
+        self.ring_index = 0
+
+    def _index(self, timestamp, event_time):
+        return int(round((timestamp - event_time - self.tmin) * self.rate / 1000))
+
+    def open_epoch(self, event_time):
+        if self.n_epochs == self.epochs.shape[0]:
+            grown = np.full((max(1, 2 * self.n_epochs), self.n_times, self.n_channels), np.nan)
+            grown[:self.n_epochs] = self.epochs
+            self.epochs = grown
+
+        epoch = self.n_epochs
+        self.n_epochs += 1
+
+        k = np.round((self.ring_times - event_time - self.tmin) * self.rate / 1000).astype(int)
+        in_window = (k >= 0) & (k < self.n_times)
+        self.epochs[epoch, k[in_window]] = self.ring_values[in_window]
+
+        self.open_epochs.append((epoch, event_time))
+
+    def add_sample(self, timestamp, values):
+        if len(self.ring_times):
+            self.ring_times[self.ring_index] = timestamp
+            self.ring_values[self.ring_index] = values
+            self.ring_index = (self.ring_index + 1) % len(self.ring_times)
+
+        still_open = []
+        for epoch, event_time in self.open_epochs:
+            k = self._index(timestamp, event_time)
+            if k >= self.n_times:
+                continue
+            if k >= 0:
+                self.epochs[epoch, k] = values
+            still_open.append((epoch, event_time))
+        self.open_epochs = still_open
+
+
+def epoch_asc(filename, patterns, tmin=-200, tmax=1000, expected_epochs=64, max_offset=5000):
+    """Cuts the samples of an asc file into epochs around matching messages.
+
+    Returns a dictionary with the keys:
+    epochs -- an (epochs, times, channels) float array, missing samples are nan
+    times -- the time of each sample relative to the message in ms
+    channels -- the channel names
+    metadata -- a list containing a dictionary (block, trial, time, message) for each epoch
+
+    Parameters:
+    filename -- the asc file to read
+    patterns -- a list of regular expressions, messages matching any of them start an epoch
+    tmin -- the start of the window relative to the message in ms
+    tmax -- the end of the window relative to the message in ms
+    expected_epochs -- the number of epochs to preallocate space for, grown if needed
+    max_offset -- the largest message offset in ms whose samples are still available
+    """
+    if tmax <= tmin:
+        raise ValueError('tmax must be larger than tmin.')
+
+    patterns = [re.compile(pattern) for pattern in patterns]
+
+    epocher = None
+    channels = []
+    metadata = []
+    block = 0
+    trial = 0
+
+    with asc2csv.open_asc(filename) as asc_file:
+        for line in asc_file:
+            if line[:1].isdigit():
+                if epocher is not None:
+                    epocher.add_sample(*_parse_sample(line, len(channels)))
+            elif line.startswith('SAMPLES') and epocher is None:
+                rate, channels = asc2csv.parse_samples_line(line)
+                epocher = _Epocher(tmin, tmax, rate, len(channels), expected_epochs,
+                                   max_offset)
+            elif line.startswith('MSG'):
+                block, trial = asc2csv.update_block_and_trial(line, block, trial)
+
+                parsed = asc2csv.parse_message(line)
+                if parsed is None:  # A message with no text
+                    continue
+                time, message = parsed
+                if epocher is not None and any(p.search(message) for p in patterns):
+                    epocher.open_epoch(time)
+                    metadata.append({'block': int(block), 'trial': int(trial),
+                                     'time': time, 'message': message})
+
+    if epocher is None:
+        raise ValueError('No SAMPLES line was found in %s.' % filename)
+
+    return {
+        'epochs': epocher.epochs[:epocher.n_epochs],
+        'times': tmin + np.arange(epocher.n_times) * 1000 / epocher.rate,
+        'channels': channels,
+        'metadata': metadata,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Cuts asc files into epochs around messages.')
+    ap.add_argument('filename', help='The asc file to epoch.')
+    ap.add_argument(
+        '-p', '--pattern', action='append', required=True,
+        help='A regular expression for messages that start an epoch (can be repeated).'
+    )
+    ap.add_argument('--tmin', type=float, default=-200, help='Window start in ms.')
+    ap.add_argument('--tmax', type=float, default=1000, help='Window end in ms.')
+    ap.add_argument(
+        '--max-offset', type=float, default=5000,
+        help='The largest offset of deferred messages in ms.'
+    )
+    ap.add_argument('-o', '--output', help='The npz file to write.')
+
+    args = vars(ap.parse_args())
+
+    result = epoch_asc(args['filename'], args['pattern'], tmin=args['tmin'], tmax=args['tmax'],
+                       max_offset=args['max_offset'])
+
+    output = args['output']
+    if output is None:
+        output = asc2csv._file_base(args['filename']) + '_epochs.npz'
+
+    metadata = {
+        field: np.array([epoch[field] for epoch in result['metadata']])
+        for field in ('block', 'trial', 'time', 'message')
+    }
+
+    np.savez(output, epochs=result['epochs'], times=result['times'],
+             channels=np.array(result['channels']), **metadata)
+
+    print('Wrote %i epochs to %s.' % (len(result['metadata']), output))
+
+
+if __name__ == '__main__':
+    main()
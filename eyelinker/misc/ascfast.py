@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""A fast path for reading the samples in large asc files into numpy arrays.
+
+The asc file is memory mapped and processed in large chunks. Lines are classified by their
+first byte, so only the (rare) MSG lines are decoded and matched with regular expressions.
+Sample lines are never turned into python strings: their flags are blanked and missing values
+('   .') are rewritten to 'nan' in place with array operations, and the numeric text of all
+samples in a chunk is handed to numpy's parser at once. Timestamps are integers unless a
+fractional one is found (e.g. 1000.5 at 2000 Hz), then they are all floats.
+
+Only uncompressed asc files can be memory mapped. The result is saved as an npz file
+containing 'time', 'values', 'flags', 'block', 'trial' and 'columns'.
+
+Functions:
+read_samples -- Reads every sample of an asc file into numpy arrays.
+"""
+
+import argparse
+import mmap
+import time
+import warnings
+
+import numpy as np
+
+import asc2csv
+
+
+_NEWLINE = ord('\n')
+_RETURN = ord('\r')
+_TAB = ord('\t')
+_SPACE = ord(' ')
+_DOT = ord('.')
+_ZERO = ord('0')
+
+
+def _sample_layout(mm):
+    """Returns the number of numeric fields and the width of the flags field of the samples."""
+    position = 0
+    while position < len(mm):
+        end = mm.find(b'\n', position)
+        end = len(mm) if end == -1 else end
+        line = mm[position:end].decode().rstrip('\r')
+        if line[:1].isdigit():
+            fields = line.split('\t')
+            flags = fields[-1].strip()
+            if flags and flags != '.' and not any(c.isdigit() for c in flags):
+                return len(fields) - 1, len(fields[-1])
+            return len(fields), 0
+        position = end + 1
+
+    raise ValueError('No samples were found.')
+
+
+def _column_names(mm, n_fields):
+    """Returns names for the numeric sample fields, based on the first SAMPLES line."""
+    position = mm.find(b'\nSAMPLES')
+    if position == -1:
+        return ['Timestamp'] + ['Value%i' % i for i in range(1, n_fields)]
+
+    end = mm.find(b'\n', position + 1)
+    channels = asc2csv.parse_samples_line(mm[position + 1:end].decode())[1]
+    n_extra = n_fields - 1 - len(channels)
+    extra = ['Input'] if n_extra == 1 else ['Input%i' % i for i in range(1, n_extra + 1)]
+
+    return ['Timestamp'] + channels + extra
+
+
+class _Output:
+    """Preallocated arrays that grow by doubling when an estimate was too small."""
+    def __init__(self, capacity, n_fields, flag_width):
+        self.n = 0
+        self.time = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty((capacity, n_fields - 1))
+        self.flags = np.empty((capacity, flag_width), dtype=bool)
+        self.block = np.empty(capacity, dtype=np.int32)
+        self.trial = np.empty(capacity, dtype=np.int32)
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.time))
+        for name in ('time', 'values', 'flags', 'block', 'trial'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def add(self, time, values, flags, block, trial):
+        if time.dtype.kind == 'f' and self.time.dtype.kind != 'f':
+            self.time = self.time.astype(float)
+
+        n = len(time)
+        if self.n + n > len(self.time):
+            self._grow(self.n + n)
+
+        part = slice(self.n, self.n + n)
+        self.time[part] = time
+        self.values[part] = values
+        self.flags[part] = flags
+        self.block[part] = block
+        self.trial[part] = trial
+        self.n += n
+
+
+def _line_bounds(data):
+    """Returns the start and end (excluding newline and carriage return) of every line."""
+    newlines = np.flatnonzero(data == _NEWLINE)
+    starts = np.concatenate([[0], newlines[:-1] + 1])
+    ends = newlines - (data[np.maximum(newlines - 1, 0)] == _RETURN)
+    return starts, np.maximum(ends, starts)
+
+
+def _message_state(data, starts, ends, is_message, block, trial):
+    """Returns the MSG lines and the block and trial in effect after each of them.
+
+    The first block and trial are the ones in effect before the first MSG line.
+    """
+    message_lines = np.flatnonzero(is_message)
+    blocks = np.empty(len(message_lines) + 1, dtype=np.int32)
+    trials = np.empty(len(message_lines) + 1, dtype=np.int32)
+    blocks[0], trials[0] = int(block), int(trial)
+
+    for i, line in enumerate(message_lines):
+        text = data[starts[line]:ends[line]].tobytes().decode(errors='replace')
+        block, trial = asc2csv.update_block_and_trial(text, block, trial)
+        blocks[i + 1] = int(block)
+        trials[i + 1] = int(trial)
+
+    return message_lines, blocks, trials
+
+
+def _parse_text(data, sample_starts, sample_ends, n_fields, flag_width):
+    """Parses the sample lines by handing their numeric text to numpy in one call.
+
+    data is modified in place.
+    """
+    # Cut out the flags and the tab before them, everything left is numeric
+    flags = np.zeros((len(sample_starts), flag_width), dtype=bool)
+    if flag_width:
+        flag_index = sample_ends[:, None] - flag_width + np.arange(flag_width)
+        flags = data[flag_index] != _DOT
+        data[flag_index] = _SPACE
+        sample_ends = sample_ends - flag_width - 1
+    data[sample_ends] = _NEWLINE
+
+    # Missing values are written as '   .', which becomes 'nan' in place
+    dots = np.flatnonzero(data == _DOT)
+    dots = dots[(dots >= 2) & (dots < len(data) - 1)]
+    after = data[dots + 1]
+    missing = dots[(data[dots - 1] == _SPACE) & (data[dots - 2] == _SPACE) &
+                   ((after == _TAB) | (after == _SPACE) | (after == _NEWLINE))]
+    data[missing[:, None] - 2 + np.arange(3)] = np.frombuffer(b'nan', dtype=np.uint8)
+
+    # Keep only the sample lines (with their newline) and parse them in one call
+    keep = np.zeros(len(data) + 1, dtype=np.int8)
+    keep[sample_starts] += 1
+    keep[sample_ends + 1] -= 1
+    text = data[np.cumsum(keep[:-1]) > 0].tobytes()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        fields = np.fromstring(text, dtype=float, sep=' ')
+
+    if len(fields) != len(sample_starts) * n_fields:
+        raise ValueError('Samples do not all have %i numeric fields.' % n_fields)
+
+    fields = fields.reshape(-1, n_fields)
+    time = fields[:, 0]
+    if np.all(time == np.floor(time)):
+        time = time.astype(np.int64)
+    return time, fields[:, 1:], flags
+
+
+def _parse_chunk(data, n_fields, flag_width, output, block, trial):
+    """Parses the samples in a chunk (ending with a newline) into the output arrays.
+
+    data is modified in place. Returns the block and trial in effect at the end of the chunk.
+    """
+    starts, ends = _line_bounds(data)
+    first = data[starts]
+    is_sample = (first >= _ZERO) & (first <= _ZERO + 9) & (ends > starts)
+    is_message = first == ord('M')
+
+    message_lines, blocks, trials = _message_state(data, starts, ends, is_message, block, trial)
+
+    sample_lines = np.flatnonzero(is_sample)
+    if not len(sample_lines):
+        return blocks[-1], trials[-1]
+
+    sample_starts = starts[sample_lines]
+    sample_ends = ends[sample_lines]
+    parsed = _parse_text(data, sample_starts, sample_ends, n_fields, flag_width)
+
+    # The block and trial of each sample is set by the last MSG line before it
+    previous_message = np.searchsorted(message_lines, sample_lines)
+    output.add(*parsed, blocks[previous_message], trials[previous_message])
+
+    return blocks[-1], trials[-1]
+
+
+def read_samples(filename, chunk_size=1 << 20):
+    """Reads every sample of an asc file into numpy arrays.
+
+    Returns a dictionary with the keys:
+    time -- the timestamp of each sample, floats if any timestamp is fractional
+    values -- a (samples, fields) float array of the remaining numeric fields, missing is nan
+    flags -- a (samples, flag width) bool array, True where the flag is set
+    block -- the block of each sample, from BLOCK messages
+    trial -- the trial of each sample, from TRIAL messages
+    columns -- names for the timestamp and the numeric fields
+
+    Parameters:
+    filename -- an uncompressed asc file
+    chunk_size -- the number of bytes processed at once, small enough to stay in the cache
+    """
+    if not filename.endswith('.asc'):
+        raise ValueError('Only uncompressed asc files can be memory mapped.')
+
+    with open(filename, 'rb') as asc_file, \
+            mmap.mmap(asc_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        n_fields, flag_width = _sample_layout(mm)
+        columns = _column_names(mm, n_fields)
+
+        # Assume about 8 bytes per field, the arrays grow if there are more samples
+        estimate = len(mm) // max(1, 8 * n_fields) + 1
+        output = _Output(estimate, n_fields, flag_width)
+
+        block, trial = 0, 0
+        position = 0
+        while position < len(mm):
+            end = mm.rfind(b'\n', position, position + chunk_size) + 1
+            if end <= position:
+                end = min(len(mm), position + chunk_size)
+                newline = mm.find(b'\n', end)
+                end = len(mm) if newline == -1 else newline + 1
+
+            # One copy of the chunk, which is edited in place while parsing
+            view = np.frombuffer(mm, dtype=np.uint8, count=end - position, offset=position)
+            data = np.empty(len(view) + 1, dtype=np.uint8)
+            data[:-1] = view
+            data[-1] = _NEWLINE
+            del view  # The mmap cannot be closed while a view exists
+
+            block, trial = _parse_chunk(data, n_fields, flag_width, output, block, trial)
+            position = end
+
+    n = output.n
+    return {
+        'time': output.time[:n], 'values': output.values[:n], 'flags': output.flags[:n],
+        'block': output.block[:n], 'trial': output.trial[:n], 'columns': columns,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Reads asc samples into an npz file quickly.')
+    ap.add_argument('filename', help='The (uncompressed) asc file to read.')
+    ap.add_argument('-o', '--output', help='The npz file to write.')
+
+    args = vars(ap.parse_args())
+
+    start = time.perf_counter()
+    samples = read_samples(args['filename'])
+    seconds = time.perf_counter() - start
+
+    output = args['output']
+    if output is None:
+        output = asc2csv._file_base(args['filename']) + '_samples.npz'
+
+    samples['columns'] = np.array(samples['columns'])
+    np.savez(output, **samples)
+
+    print('Read %i samples in %.2f s, wrote %s.' % (len(samples['time']), seconds, output))
+
+
+if __name__ == '__main__':
+    main()
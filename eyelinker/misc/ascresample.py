@@ -0,0 +1,195 @@
+"""Downsamples the samples written by asc2csv to a lower sample rate.
+
+Used by asc2csv when --resample is given. Samples are collected into chunks and filtered with
+a linear phase, Hamming windowed sinc lowpass filter before every q-th sample is kept, where q
+is the ratio between the recorded and the target rate (which must be a whole number, as it is
+for 250/500/1000/2000 Hz).
+
+Missing values (NA, e.g. during blinks) are not filtered across. edf2asc writes blink samples
+with a missing gaze but a pupil size of 0, so a sample with a missing gaze or a pupil of 0 is
+missing in every channel of that eye. The filter weights are
+renormalized over the valid samples in each window (normalized convolution), so a blink stays
+exactly as long as it was and does not leak into the samples next to it. Gaps in the
+timestamps (e.g. between recordings) are treated as the end of one segment and the start of a
+new one.
+
+Classes:
+Decimator -- Filters and decimates a stream of samples chunk by chunk.
+ResampledWriter -- Collects csv rows from asc2csv and writes the decimated rows.
+"""
+
+import numpy as np
+
+
+def _lowpass_filter(q):
+    """Returns the taps of a lowpass filter with a cutoff at the new nyquist frequency."""
+    n_taps = 20 * q + 1
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    taps = np.sinc(n / q) * np.hamming(n_taps)
+    return taps / taps.sum()
+
+
+class Decimator:
+    """Filters and decimates a stream of samples chunk by chunk.
+
+    Parameters:
+    in_rate -- the recorded sample rate in Hz
+    out_rate -- the target sample rate in Hz
+    n_channels -- the number of values in each sample
+    """
+    def __init__(self, in_rate, out_rate, n_channels):
+        q = in_rate / out_rate
+        if q < 1 or q != int(q):
+            raise ValueError(
+                'The recorded rate (%g Hz) must be a multiple of the target rate (%g Hz).'
+                % (in_rate, out_rate))
+
+        self.q = int(q)
+        self.taps = _lowpass_filter(self.q)
+        self.half = len(self.taps) // 2
+        self.period = 1000 / in_rate
+        self.n_channels = n_channels
+        self._reset()
+
+    def _reset(self):
+        self.times = np.empty(0)
+        self.values = np.empty((0, self.n_channels))
+        self.extra = []
+        self.start = 0  # samples before start have been output and are only kept as context
+        self.phase = 0  # position of the first buffered sample within the segment
+
+    def _emit(self, final):
+        """Returns the decimated samples whose filter window is complete."""
+        n = len(self.times)
+        ready = n if final else max(self.start, n - self.half)
+
+        index = np.arange(self.start, ready)
+        index = index[(index + self.phase) % self.q == 0]
+
+        padded = np.full((n + 2 * self.half, self.n_channels), np.nan)
+        padded[self.half:self.half + n] = self.values
+
+        windows = padded[index[:, None] + np.arange(len(self.taps))]  # (out, taps, channels)
+        valid = ~np.isnan(windows)
+        weights = np.tensordot(self.taps, valid, axes=(0, 1))
+        filtered = np.tensordot(self.taps, np.where(valid, windows, 0), axes=(0, 1))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            filtered = filtered / weights
+        filtered[np.isnan(self.values[index]) | (weights < 0.5)] = np.nan
+
+        output = list(zip(self.times[index], filtered, [self.extra[i] for i in index]))
+
+        # Keep enough samples before the next output for its filter window
+        keep = max(0, ready - self.half)
+        self.times = self.times[keep:]
+        self.values = self.values[keep:]
+        self.extra = self.extra[keep:]
+        self.start = ready - keep
+        self.phase += keep
+
+        return output
+
+    def process(self, times, values, extra):
+        """Adds a chunk of samples and returns the decimated samples that are ready.
+
+        Returns a list of (time, filtered values, extra) tuples.
+
+        Parameters:
+        times -- a 1d array of timestamps in ms
+        values -- a 2d array (samples, channels), missing values are nan
+        extra -- a list with anything that should be passed along with each sample
+        """
+        output = []
+
+        # A gap in the timestamps, including one between the buffer and this chunk, ends the
+        # current segment
+        last = self.times[-1:]
+        breaks = np.flatnonzero(np.diff(np.concatenate([last, times])) > 1.5 * self.period)
+        breaks = breaks + 1 - len(last)
+
+        previous = 0
+        for split in list(breaks) + [len(times)]:
+            self.times = np.concatenate([self.times, times[previous:split]])
+            self.values = np.concatenate([self.values, values[previous:split]])
+            self.extra.extend(extra[previous:split])
+            if split < len(times):
+                output.extend(self.flush())
+            previous = split
+
+        output.extend(self._emit(final=False))
+
+        return output
+
+    def flush(self):
+        """Returns the remaining samples and starts a new segment."""
+        output = self._emit(final=True)
+        self._reset()
+        return output
+
+
+def _mask_missing(values):
+    """Sets every channel of an eye (gaze x, gaze y, pupil) to nan if its sample is missing."""
+    for eye in range(values.shape[1] // 3):
+        channels = values[:, 3 * eye:3 * eye + 3]
+        missing = np.isnan(channels).any(axis=1) | (channels[:, 2] == 0)
+        channels[missing] = np.nan
+    return values
+
+
+class ResampledWriter:
+    """Collects csv rows from asc2csv and writes the decimated rows.
+
+    Rows are expected in the asc2csv format: block, trial, timestamp, channel values, and then
+    any remaining fields, which are copied from the kept sample.
+
+    Parameters:
+    out_file -- an open file to write to
+    out_rate -- the target sample rate in Hz
+    chunk_size -- how many samples are collected before they are filtered
+    """
+    def __init__(self, out_file, out_rate, chunk_size=20000):
+        self.out_file = out_file
+        self.out_rate = out_rate
+        self.chunk_size = chunk_size
+        self.decimator = None
+        self.rows = []
+
+    def start_recording(self, in_rate, n_channels):
+        """Called for each SAMPLES line, which starts a new recording."""
+        self.close()
+        self.decimator = Decimator(in_rate, self.out_rate, n_channels)
+
+    def add_row(self, row):
+        if self.decimator is None:
+            raise ValueError('A SAMPLES line is required before samples can be resampled.')
+
+        self.rows.append(row.rstrip('\n').split(','))
+        if len(self.rows) >= self.chunk_size:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        n_channels = self.decimator.n_channels
+        fields = np.array([row[2:3 + n_channels] for row in self.rows])
+        fields[fields == 'NA'] = 'nan'
+        fields = fields.astype(float)
+
+        values = _mask_missing(fields[:, 1:])
+        output = self.decimator.process(fields[:, 0], values, self.rows)
+        self._write(output)
+        self.rows = []
+
+    def _write(self, output):
+        n_channels = self.decimator.n_channels
+        for _, filtered, row in output:
+            values = ['NA' if np.isnan(v) else '%.1f' % v for v in filtered]
+            self.out_file.write(','.join(row[:3] + values + row[3 + n_channels:]) + '\n')
+
+    def close(self):
+        """Writes any remaining samples."""
+        if self.decimator is None:
+            return
+
+        if self.rows:
+            self._write_chunk()
+        self._write(self.decimator.flush())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""Watches a folder and converts new or updated asc files with asc2csv.
+
+A file is only converted once its size and modification time have stopped changing between
+two polls, so files that are still being written are left alone. Conversions run on a small
+pool of worker processes.
+
+A manifest (.asc2csv_manifest.json in the watched folder) stores the size, modification time
+and sha1 hash of every converted file. Files whose size and modification time match the
+manifest are skipped with a single dictionary lookup. If only the modification time changed
+(e.g. the file was copied again), the hash is compared before converting. Updated files
+replace their previous csv instead of creating (i).csv copies. Files that could not be
+converted are not retried until their size or modification time changes.
+
+If --edf2asc is given, new edf files are first converted with SR Research's edf2asc, which
+must be on the path. The resulting asc file is then picked up like any other.
+
+Functions:
+watch -- Polls a folder forever, converting files as they appear.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+import asc2csv
+
+
+MANIFEST_FILENAME = '.asc2csv_manifest.json'
+
+
+def _file_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _convert(filename, header, events, resample, compress, level):
+    """Converts a single file in a worker process and returns its hash."""
+    # Hashed first, so the hash is of the content that was converted
+    file_hash = _file_hash(filename)
+
+    if filename[-4:] == '.edf':
+        subprocess.run(['edf2asc', '-y', filename], check=True, stdout=subprocess.DEVNULL)
+    else:
+        asc2csv.convert_to_csv(filename, header, True, events, resample, compress, level)
+
+    return file_hash
+
+
+class _Manifest:
+    """The record of converted files, saved as json in the watched folder."""
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, MANIFEST_FILENAME)
+        try:
+            with open(self.filename) as manifest_file:
+                self.entries = json.loads(manifest_file.read())
+        except FileNotFoundError:
+            self.entries = {}
+
+    def is_converted(self, filename, size, mtime):
+        entry = self.entries.get(os.path.basename(filename))
+        if entry is None:
+            return False
+        if entry['size'] == size and entry['mtime'] == mtime:
+            return True
+
+        # Same content with a new timestamp does not need to be converted again
+        if entry['size'] == size and entry['hash'] == _file_hash(filename):
+            self.add(filename, size, mtime, entry['hash'])
+            return True
+
+        return False
+
+    def add(self, filename, size, mtime, file_hash):
+        self.entries[os.path.basename(filename)] = {
+            'size': size, 'mtime': mtime, 'hash': file_hash
+        }
+
+        with open(self.filename, 'w') as manifest_file:
+            manifest_file.write(json.dumps(self.entries, indent=1))
+
+
+def _find_candidates(directory, edf2asc):
+    patterns = ['*.asc'] + ['*.asc' + extension for extension in asc2csv._compressions]
+    if edf2asc:
+        patterns.append('*.edf')
+
+    candidates = {}
+    for pattern in patterns:
+        for filename in glob.glob(os.path.join(directory, pattern)):
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            candidates[filename] = (stat.st_size, stat.st_mtime_ns)
+
+    return candidates
+
+
+class _Watcher:
+    """Submits finished, unconverted files to an executor and records the results.
+
+    Parameters:
+    directory -- the folder to watch
+    executor -- a concurrent.futures executor that runs _convert
+    convert_args -- header, events, resample, compress and level, passed to _convert
+    edf2asc -- if True, edf files are converted to asc files first
+    """
+    def __init__(self, directory, executor, convert_args, edf2asc=False):
+        self.directory = directory
+        self.executor = executor
+        self.convert_args = convert_args
+        self.edf2asc = edf2asc
+        self.manifest = _Manifest(directory)
+        self.previous = {}
+        self.running = {}
+        self.failed = {}  # filename: (size, mtime) of the failed attempt
+
+    def _collect(self):
+        """Records the conversions that have finished."""
+        for future in [f for f in self.running if f.done()]:
+            filename, size, mtime = self.running.pop(future)
+            try:
+                self.manifest.add(filename, size, mtime, future.result())
+                self.failed.pop(filename, None)
+                print('Converted %s.' % filename)
+            except Exception as e:  # Keep watching, the file will be retried if it changes
+                self.failed[filename] = (size, mtime)
+                print('Could not convert %s: %s' % (filename, e))
+
+    def poll(self):
+        """Records finished conversions and submits files that need to be converted."""
+        self._collect()
+
+        busy = set(filename for filename, _, _ in self.running.values())
+        candidates = _find_candidates(self.directory, self.edf2asc)
+
+        for filename, (size, mtime) in candidates.items():
+            # Only files that have not changed since the last poll are finished
+            if filename in busy or self.previous.get(filename) != (size, mtime):
+                continue
+            if self.failed.get(filename) == (size, mtime):
+                continue
+            if self.manifest.is_converted(filename, size, mtime):
+                continue
+
+            future = self.executor.submit(_convert, filename, *self.convert_args)
+            self.running[future] = (filename, size, mtime)
+
+        self.previous = candidates
+
+
+def watch(directory, header=None, events=False, resample=None, edf2asc=False, workers=2,
+          interval=2.0, compress=None, level=None):
+    """Polls a folder forever, converting files as they appear.
+
+    Parameters:
+    directory -- the folder to watch
+    header -- the header for the csv files
+    events -- if True, event tables are also written (see asc2csv)
+    resample -- a target rate in Hz, or None to keep the recorded rate
+    edf2asc -- if True, edf files are converted to asc files first
+    workers -- the number of files converted at once
+    interval -- the number of seconds between polls
+    compress -- 'gz', 'xz' or 'zst' to write compressed csv files
+    level -- the compression level
+    """
+    print('Watching %s for new files. Press Ctrl+C to stop.' % directory)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        watcher = _Watcher(directory, executor, (header, events, resample, compress, level),
+                           edf2asc)
+        while True:
+            watcher.poll()
+            time.sleep(interval)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Converts asc files as they appear in a folder.')
+    ap.add_argument('directory', help='The folder to watch.')
+    ap.add_argument('-H', '--header', help='The header for the csv files.')
+    ap.add_argument('-e', '--events', action='store_true', help='Also write event tables.')
+    ap.add_argument('-r', '--resample', type=float, help='Downsample to this rate in Hz.')
+    ap.add_argument('-c', '--compress', choices=['gz', 'xz', 'zst'], help='Compress the csvs.')
+    ap.add_argument('-l', '--level', type=int, help='The compression level.')
+    ap.add_argument('--edf2asc', action='store_true', help='Convert edf files with edf2asc.')
+    ap.add_argument('-j', '--workers', type=int, default=2, help='Files converted at once.')
+    ap.add_argument('-i', '--interval', type=float, default=2.0, help='Seconds between polls.')
+
+    args = vars(ap.parse_args())
+
+    watch(args['directory'], header=args['header'], events=args['events'],
+          resample=args['resample'], edf2asc=args['edf2asc'], workers=args['workers'],
+          interval=args['interval'], compress=args['compress'], level=args['level'])
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
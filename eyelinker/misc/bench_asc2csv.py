@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Benchmarks asc2csv on a synthetic recording.
+
+The fixture looks like a 1 kHz binocular recording converted with edf2asc: samples with
+status flags, blinks (missing values), fixation and saccade events and BLOCK/TRIAL/SYNC
+messages. It is converted with asc2csv, parsed line by line by asc2csv without writing (the
+like-for-like baseline for ascfast) and read with the ascfast memory mapped path, and then
+compressed with every available method and converted again, reporting the throughput (in MB
+of uncompressed asc per second) and the size of each file relative to the uncompressed one.
+
+Functions:
+write_fixture -- Writes a synthetic 1 kHz binocular asc file.
+main -- Command line entry point.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import asc2csv
+import ascfast
+
+
+def write_fixture(filename, minutes=10, seed=0):
+    """Writes a synthetic 1 kHz binocular asc file.
+
+    Parameters:
+    filename -- the asc file to write
+    minutes -- the length of the recording
+    seed -- the random seed
+    """
+    rng = random.Random(seed)
+    n_samples = int(minutes * 60 * 1000)
+
+    with open(filename, 'w') as asc_file:
+        asc_file.write('** CONVERTED FROM fixture.edf using edfapi 4.1\n** DATE: fixture\n\n')
+        asc_file.write('MSG\t999 DISPLAY_COORDS 0 0 1919 1079\n')
+        asc_file.write('START\t1000 \tLEFT\tRIGHT\tSAMPLES\tEVENTS\n')
+        asc_file.write('SAMPLES\tGAZE\tLEFT\tRIGHT\tRATE\t1000.00\tTRACKING\tCR\tFILTER\t2\n')
+
+        x, y = 960.0, 540.0
+        blink_end = 0
+        trial = 0
+        for i in range(n_samples):
+            t = 1000 + i
+
+            if i % 2500 == 0:
+                trial += 1
+                if trial % 20 == 1:
+                    asc_file.write('MSG\t%i BLOCK %i\n' % (t, trial // 20 + 1))
+                asc_file.write('MSG\t%i TRIAL %i\n' % (t, trial))
+                asc_file.write('MSG\t%i SYNC %i\n' % (t, trial % 8 + 1))
+
+            if i % 250 == 0:
+                # A saccade to a new fixation
+                new_x, new_y = rng.uniform(200, 1720), rng.uniform(100, 980)
+                asc_file.write(
+                    'EFIX L   %i\t%i\t250\t%7.1f\t%7.1f\t   1012\n' % (t - 250, t, x, y))
+                asc_file.write(
+                    'ESACC L  %i\t%i\t30\t%7.1f\t%7.1f\t%7.1f\t%7.1f\t   4.12\t    251\n'
+                    % (t, t + 30, x, y, new_x, new_y))
+                x, y = new_x, new_y
+
+            if i % 4000 == 1000:
+                blink_end = i + rng.randint(80, 200)
+                asc_file.write('SBLINK L %i\n' % t)
+
+            if i < blink_end:
+                asc_file.write(
+                    '%i\t   .\t   .\t    0.0\t   .\t   .\t    0.0\t  127.0\t.C.C.\n' % t)
+                if i == blink_end - 1:
+                    asc_file.write('EBLINK L %i\t%i\t%i\n' % (t - 100, t, 100))
+                continue
+
+            asc_file.write('%i\t%7.1f\t%7.1f\t%7.1f\t%7.1f\t%7.1f\t%7.1f\t  127.0\t.....\n' % (
+                t, x + rng.gauss(0, 2), y + rng.gauss(0, 2), 1000 + rng.gauss(0, 5),
+                x + rng.gauss(0, 2) + 15, y + rng.gauss(0, 2), 1050 + rng.gauss(0, 5)))
+
+        asc_file.write('END\t%i \tSAMPLES\tEVENTS\tRES\t  38.00\t  36.00\n' % (1000 + n_samples))
+
+
+def _compress(filename, extension):
+    compressed = filename + extension
+    with open(filename, 'rb') as source, asc2csv._open_binary(compressed, 'wb') as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+    return compressed
+
+
+def _time_conversion(filename, **kwargs):
+    start = time.perf_counter()
+    asc2csv.convert_to_csv(filename, None, True, **kwargs)
+    return time.perf_counter() - start
+
+
+def _time_parsing(filename):
+    """Times the asc2csv handling of every line (csv row formatting included), without writing."""
+    start = time.perf_counter()
+    add_bools = asc2csv._has_flags(filename)
+    block = trial = 0
+    with asc2csv.open_asc(filename) as asc_file:
+        for line in asc_file:
+            if line[:1].isdigit():
+                asc2csv._format_sample(line, add_bools)
+            elif line.startswith('MSG'):
+                block, trial = asc2csv.update_block_and_trial(line, block, trial)
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmarks asc2csv on a synthetic recording.')
+    ap.add_argument('-m', '--minutes', type=float, default=5, help='Length of the recording.')
+    args = vars(ap.parse_args())
+
+    extensions = ['.gz', '.xz']
+    if asc2csv.zstandard is not None:
+        extensions.append('.zst')
+
+    with tempfile.TemporaryDirectory() as directory:
+        plain = os.path.join(directory, 'fixture.asc')
+        write_fixture(plain, minutes=args['minutes'])
+        size = os.path.getsize(plain)
+        megabytes = size / 1e6
+
+        print('Fixture: %.1f min at 1 kHz, %.1f MB\n' % (args['minutes'], megabytes))
+        print('%-24s %10s %12s' % ('', 'MB/s', 'size ratio'))
+
+        seconds = _time_conversion(plain)
+        print('%-24s %10.1f %12.3f' % ('asc -> csv', megabytes / seconds, 1.0))
+
+        seconds = _time_parsing(plain)
+        print('%-24s %10.1f %12s' % ('asc -> rows (asc2csv)', megabytes / seconds, '-'))
+
+        start = time.perf_counter()
+        ascfast.read_samples(plain)
+        seconds = time.perf_counter() - start
+        print('%-24s %10.1f %12s' % ('asc -> arrays (ascfast)', megabytes / seconds, '-'))
+
+        for extension in extensions:
+            compressed = _compress(plain, extension)
+            seconds = _time_conversion(compressed)
+            print('%-24s %10.1f %12.3f' % ('asc' + extension + ' -> csv', megabytes / seconds,
+                                           os.path.getsize(compressed) / size))
+            os.remove(compressed)
+
+        csv_size = os.path.getsize(os.path.join(directory, 'fixture.csv'))
+        for extension in extensions:
+            seconds = _time_conversion(plain, compress=extension[1:])
+            output = os.path.join(directory, 'fixture.csv' + extension)
+            print('%-24s %10.1f %12.3f' % ('asc -> csv' + extension, megabytes / seconds,
+                                           os.path.getsize(output) / csv_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import unittest
+import csv
+import os
+import shutil
+import tempfile
+
+import asc2csv
+import ascepoch
+
+
+def _offset_line(time, offset, text):
+    """Returns the asc line of a message sent with an offset, as flush_messages sends them."""
+    return 'MSG\t%d %d %s\n' % (time, offset, text)
+
+
+class TestOffsetMessages(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.asc')
+
+        with open(self.filename, 'w') as asc_file:
+            asc_file.write('START\t1000 \tLEFT\tSAMPLES\tEVENTS\n')
+            asc_file.write('SAMPLES\tGAZE\tLEFT\tRATE\t1000.00\tTRACKING\tCR\tFILTER\t2\n')
+            for i in range(100):
+                time = 1000 + i
+                if time == 1010:
+                    asc_file.write(_offset_line(time, 10, 'BLOCK 1'))
+                if time == 1060:
+                    asc_file.write(_offset_line(time, 20, 'TRIAL 2'))
+                asc_file.write('%d\t  %.1f\t  500.0\t 1000.0\t...\n' % (time, i))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_message(self):
+        self.assertEqual(asc2csv.parse_message(_offset_line(1150, 150, 'BLOCK 1')),
+                         (1000, 'BLOCK 1'))
+        self.assertEqual(asc2csv.parse_message('MSG\t1000.5 -2 SYNC 1\n'), (1002.5, 'SYNC 1'))
+        self.assertEqual(asc2csv.parse_message('MSG\t1000 150\n'), (1000, '150'))
+        self.assertIsNone(asc2csv.parse_message('MSG\t1000\n'))
+
+    def test_convert_to_csv(self):
+        asc2csv.convert_to_csv(self.filename, None, True, events=True)
+
+        with open(os.path.join(self.directory, 'session.csv')) as csv_file:
+            rows = [line.split(',') for line in csv_file]
+        self.assertEqual(rows[9][:3], ['0', '0', '1009'])
+        self.assertEqual(rows[10][:3], ['1', '0', '1010'])
+        self.assertEqual(rows[60][:3], ['1', '2', '1060'])
+
+        with open(os.path.join(self.directory, 'session_messages.csv'), newline='') as csv_file:
+            messages = list(csv.reader(csv_file))[1:]
+        self.assertEqual(messages, [['1', '0', '1000', 'BLOCK 1'],
+                                    ['1', '2', '1040', 'TRIAL 2']])
+
+    def test_epoch_asc(self):
+        result = ascepoch.epoch_asc(self.filename, ['TRIAL'], tmin=0, tmax=5)
+
+        self.assertEqual(result['metadata'][0]['time'], 1040)
+        self.assertEqual(result['metadata'][0]['trial'], 2)
+        self.assertEqual(result['epochs'][0, :, 0].tolist(), [40, 41, 42, 43, 44])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import ascepoch
+
+
+def _write_asc(filename, rate, messages):
+    """Writes a monocular asc file with x = the sample index, and messages at given samples."""
+    step = 1000 / rate
+    with open(filename, 'w') as asc_file:
+        asc_file.write('START\t1000 \tLEFT\tSAMPLES\tEVENTS\n')
+        asc_file.write('SAMPLES\tGAZE\tLEFT\tRATE\t%.2f\tTRACKING\tCR\tFILTER\t2\n' % rate)
+        for i in range(200):
+            time = 1000 + i * step
+            for sample, text in messages:
+                if sample == i:
+                    asc_file.write('MSG\t%s%s\n' % (('%g' % time), text))
+            asc_file.write('%g\t  %.1f\t  500.0\t 1000.0\t...\n' % (time, i))
+
+
+class TestEpochAsc(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.asc')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fractional_timestamps(self):
+        # At 2000 Hz every other timestamp ends in .5
+        _write_asc(self.filename, 2000, [(50, ' SYNC 1'), (101, ' SYNC 2')])
+        result = ascepoch.epoch_asc(self.filename, ['SYNC'], tmin=-5, tmax=10)
+
+        self.assertEqual([epoch['time'] for epoch in result['metadata']], [1025.0, 1050.5])
+        self.assertEqual(result['epochs'].shape, (2, 30, 3))
+        np.testing.assert_array_equal(result['epochs'][0, :, 0], np.arange(40, 70))
+        np.testing.assert_array_equal(result['epochs'][1, :, 0], np.arange(91, 121))
+
+    def test_message_without_text(self):
+        _write_asc(self.filename, 1000, [(20, ''), (50, ' SYNC 1')])
+        result = ascepoch.epoch_asc(self.filename, ['SYNC'], tmin=0, tmax=10)
+
+        self.assertEqual(len(result['metadata']), 1)
+        self.assertEqual(result['metadata'][0]['time'], 1050)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import ascfast
+import bench_asc2csv
+
+
+class TestReadSamples(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.asc')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fixture(self):
+        bench_asc2csv.write_fixture(self.filename, minutes=0.1)
+        samples = ascfast.read_samples(self.filename, chunk_size=1 << 16)
+
+        self.assertEqual(samples['time'].dtype, np.int64)
+        np.testing.assert_array_equal(samples['time'], 1000 + np.arange(6000))
+        self.assertEqual(samples['values'].shape, (6000, 7))
+        self.assertTrue(np.isnan(samples['values'][1000, 0]))  # The first blink
+        self.assertEqual(samples['values'][1000, 2], 0)
+        self.assertTrue(samples['flags'][1000, 1])
+        self.assertEqual(samples['trial'][[0, 2499, 2500, 5999]].tolist(), [1, 1, 2, 3])
+        self.assertEqual(samples['block'][0], 1)
+
+    def test_fractional_timestamps(self):
+        # At 2000 Hz every other timestamp ends in .5
+        with open(self.filename, 'w') as asc_file:
+            asc_file.write('SAMPLES\tGAZE\tLEFT\tRATE\t2000.00\tTRACKING\tCR\tFILTER\t2\n')
+            for i in range(100):
+                if i == 50:
+                    asc_file.write('MSG\t1025 TRIAL 1\n')
+                asc_file.write('%g\t  %.1f\t  500.0\t 1000.0\t...\n' % (1000 + i / 2, i))
+
+        samples = ascfast.read_samples(self.filename)
+
+        np.testing.assert_array_equal(samples['time'], 1000 + np.arange(100) / 2)
+        np.testing.assert_array_equal(samples['values'][:, 0], np.arange(100))
+        self.assertEqual(samples['trial'][[49, 50]].tolist(), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import io
+
+import numpy as np
+
+import ascresample
+
+
+def _rows(n_samples, blink):
+    """Returns asc2csv rows at 1000 Hz, with a blink (gaze NA, pupil 0.0) in range blink."""
+    rows = []
+    for i in range(n_samples):
+        if i in blink:
+            x, y, pupil = 'NA', 'NA', '0.0'
+        else:
+            x, y, pupil = '960.0', '540.0', '1100.0'
+        rows.append('1,1,%i,%s,%s,%s,...\n' % (1000 + i, x, y, pupil))
+    return rows
+
+
+class TestResampledWriter(unittest.TestCase):
+    def test_blink_is_not_filtered(self):
+        out_file = io.StringIO()
+        writer = ascresample.ResampledWriter(out_file, 250, chunk_size=300)
+        writer.start_recording(1000, 3)
+        for row in _rows(1000, range(400, 500)):
+            writer.add_row(row)
+        writer.close()
+
+        fields = [line.split(',') for line in out_file.getvalue().splitlines()]
+        times = np.array([int(f[2]) for f in fields])
+        pupil = np.array([np.nan if f[5] == 'NA' else float(f[5]) for f in fields])
+
+        self.assertEqual(len(fields), 250)
+        blink = (times >= 1400) & (times < 1500)
+        self.assertTrue(np.isnan(pupil[blink]).all())
+        # The samples next to the blink keep the pupil size
+        np.testing.assert_allclose(pupil[~blink], 1100.0)
+        self.assertTrue(all(f[3] == 'NA' for f, b in zip(fields, blink) if b))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import ascwatch
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.watcher = ascwatch._Watcher(self.directory, self.executor,
+                                         (None, False, None, None, None))
+
+    def tearDown(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.directory)
+
+    def _poll(self):
+        """Polls and waits for the submitted conversions."""
+        self.watcher.poll()
+        concurrent.futures.wait(list(self.watcher.running))
+
+    def test_failed_file_is_not_retried(self):
+        filename = os.path.join(self.directory, 'broken.asc.gz')
+        with open(filename, 'wb') as asc_file:
+            asc_file.write(b'not gzip data')
+
+        self._poll()  # Seen for the first time
+        self.assertEqual(len(self.watcher.running), 0)
+        self._poll()  # Unchanged, so submitted
+        self.assertEqual(len(self.watcher.running), 1)
+
+        for _ in range(3):
+            self._poll()
+            self.assertEqual(len(self.watcher.running), 0)
+        self.assertIn(filename, self.watcher.failed)
+
+        # Retried once the file changes
+        with open(filename, 'ab') as asc_file:
+            asc_file.write(b'more')
+        self._poll()
+        self._poll()
+        self.assertEqual(len(self.watcher.running), 1)
+
+    def test_converted_file_is_recorded(self):
+        filename = os.path.join(self.directory, 'session.asc')
+        with open(filename, 'w') as asc_file:
+            asc_file.write('1000\t  960.0\t  540.0\t 1000.0\t...\n')
+
+        for _ in range(4):
+            self._poll()
+
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, 'session.csv')))
+        self.assertEqual(self.watcher.failed, {})
+        self.assertEqual(self.watcher.manifest.entries['session.asc']['hash'],
+                         ascwatch._file_hash(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,339 @@
+"""Stand-ins for pylink.EyeLink that produce samples and link events without a tracker.
+
+Used by MockEyeLinker when mock_options are given. The trackers implement the small part of
+the pylink interface that eyelinker reads (startRecording, stopRecording, getNewestSample,
+getNextData and getFloatData), so gaze_data, pupil_size, drain_samples and the link event
+dispatcher work exactly as they do with a real tracker.
+
+Samples are released according to the time since startRecording was called, multiplied by
+speed, so a replay can run faster than real time for load testing. Samples are created when
+they are read, so very high speeds are limited by how fast python can create them (roughly
+100000 samples per second).
+
+Classes:
+SyntheticTracker -- Generates a seeded stream of fixations, saccades and blinks with noise.
+ReplayTracker -- Replays the samples and events of an asc file.
+"""
+
+import collections
+import math
+import random
+import threading
+import time
+
+import pylink as pl
+
+
+class _EyeData:
+    def __init__(self, x, y, pupil):
+        self._gaze = (x, y)
+        self._pupil = pupil
+
+    def getGaze(self):
+        return self._gaze
+
+    def getPupilSize(self):
+        return self._pupil
+
+
+_missing_eye = _EyeData(pl.MISSING_DATA, pl.MISSING_DATA, 0.0)
+
+
+class _Sample:
+    def __init__(self, sample_time, left=None, right=None):
+        self._time = sample_time
+        self._left = left
+        self._right = right
+
+    def getTime(self):
+        return self._time
+
+    def getStatus(self):
+        return 0
+
+    def isLeftSample(self):
+        return self._left is not None
+
+    def isRightSample(self):
+        return self._right is not None
+
+    def isBinocular(self):
+        return self._left is not None and self._right is not None
+
+    def getLeftEye(self):
+        return self._left or _missing_eye
+
+    def getRightEye(self):
+        return self._right or _missing_eye
+
+
+class _Event:
+    def __init__(self, data_type, eye, start, end=None, start_gaze=None, end_gaze=None):
+        self._type = data_type
+        self._eye = eye
+        self._start = start
+        self._end = start if end is None else end
+        self._start_gaze = start_gaze
+        self._end_gaze = end_gaze
+
+    def getType(self):
+        return self._type
+
+    def getEye(self):
+        return self._eye
+
+    def getStartTime(self):
+        return self._start
+
+    def getEndTime(self):
+        return self._end
+
+    def getStartGaze(self):
+        return self._start_gaze
+
+    def getEndGaze(self):
+        return self._end_gaze
+
+    def getAverageGaze(self):
+        return self._end_gaze
+
+
+class _StreamTracker:
+    """Releases (time, data type, item) tuples from a generator as time passes.
+
+    Parameters:
+    items -- a generator of (tracker time in ms, pylink data type, sample or event)
+    speed -- how much faster than real time the items are released
+    max_queue -- the size of the link buffer, older items are dropped like on a real tracker
+    """
+    def __init__(self, items, speed=1.0, max_queue=65536):
+        if speed <= 0:
+            raise ValueError('speed must be larger than 0.')
+
+        self.speed = speed
+        self._items = items
+        self._next = None
+        self._queue = collections.deque(maxlen=max_queue)
+        self._newest = None
+        self._current = None
+        self._recording = False
+        self._start_wall = None
+        self._start_time = None
+        self._lock = threading.Lock()  # The event dispatcher reads from another thread
+
+    def _peek(self):
+        if self._next is None:
+            self._next = next(self._items, None)
+        return self._next
+
+    def _advance(self):
+        if not self._recording:
+            return
+
+        if self._start_time is None:
+            if self._peek() is None:  # Nothing (left) to replay
+                return
+            self._start_time = self._next[0]
+
+        now = self._start_time + (time.perf_counter() - self._start_wall) * 1000 * self.speed
+        while self._peek() is not None and self._next[0] <= now:
+            _, data_type, item = self._next
+            self._queue.append((data_type, item))
+            if data_type == pl.SAMPLE_TYPE:
+                self._newest = item
+            self._next = None
+
+    def startRecording(self, *args):
+        with self._lock:
+            self._recording = True
+            self._start_wall = time.perf_counter()
+            self._start_time = None
+
+    def stopRecording(self):
+        with self._lock:
+            self._advance()
+            self._recording = False
+
+    def getNewestSample(self):
+        with self._lock:
+            self._advance()
+            return self._newest
+
+    def getNextData(self):
+        with self._lock:
+            self._advance()
+            if not self._queue:
+                return 0
+            data_type, self._current = self._queue.popleft()
+            return data_type
+
+    def getFloatData(self):
+        return self._current
+
+
+def _tracker_time(value):
+    """Returns a time in ms as an int, or a float if it has a fraction (e.g. at 2000 Hz)."""
+    value = round(value, 3)
+    return int(value) if value.is_integer() else value
+
+
+def _asc_time(field):
+    """Returns an asc timestamp like asc2csv.parse_timestamp, '1000.5' at 2000 Hz is a float."""
+    return float(field) if '.' in field else int(field)
+
+
+def _eye_indices(eye):
+    return {'LEFT': [0], 'RIGHT': [1], 'BOTH': [0, 1]}[eye]
+
+
+def _make_sample(sample_time, eyes, x, y, pupil):
+    """Returns a sample with the same data for each recorded eye, x and y can be missing."""
+    data = _EyeData(x, y, pupil)
+    return _Sample(sample_time, data if 0 in eyes else None, data if 1 in eyes else None)
+
+
+class _Synthetic:
+    """The state of the synthetic stream, see SyntheticTracker."""
+    def __init__(self, eye, rate, seed, resolution):
+        self.rng = random.Random(seed)
+        self.eyes = _eye_indices(eye)
+        self.period = 1000.0 / rate
+        self.resolution = resolution
+        self.time = 1000.0
+        self.x = resolution[0] / 2
+        self.y = resolution[1] / 2
+        self.pupil = 1000.0
+
+    def samples(self, n, path):
+        """Yields n samples, path maps the fraction of the way through to a gaze position."""
+        for i in range(n):
+            x, y = path(i / max(1, n - 1))
+            self.pupil += self.rng.gauss(0, 2) + (1000 - self.pupil) * 0.001
+            if x != pl.MISSING_DATA:
+                x += self.rng.gauss(0, 0.5)
+                y += self.rng.gauss(0, 0.5)
+            sample = _make_sample(_tracker_time(self.time), self.eyes, x, y, self.pupil)
+            yield self.time, pl.SAMPLE_TYPE, sample
+            self.time += self.period
+
+    def events(self, data_type, start, end=None, start_gaze=None, end_gaze=None):
+        due = start if end is None else end
+        for eye in self.eyes:
+            event = _Event(data_type, eye, _tracker_time(start), _tracker_time(due), start_gaze,
+                           end_gaze)
+            yield due, data_type, event
+
+    def fixation(self):
+        start, position = self.time, (self.x, self.y)
+        yield from self.events(pl.STARTFIX, start, start_gaze=position)
+        n = int(self.rng.uniform(150, 500) / self.period)
+        yield from self.samples(n, lambda fraction: position)
+        yield from self.events(pl.ENDFIX, start, self.time - self.period, position, position)
+
+    def saccade(self):
+        start, origin = self.time, (self.x, self.y)
+        self.x = self.rng.uniform(0.1, 0.9) * self.resolution[0]
+        self.y = self.rng.uniform(0.1, 0.9) * self.resolution[1]
+        amplitude = math.hypot(self.x - origin[0], self.y - origin[1])
+
+        def path(fraction):
+            step = (1 - math.cos(math.pi * fraction)) / 2
+            return (origin[0] + step * (self.x - origin[0]),
+                    origin[1] + step * (self.y - origin[1]))
+
+        yield from self.events(pl.STARTSACC, start, start_gaze=origin)
+        yield from self.samples(int((20 + amplitude / 30) / self.period), path)
+        yield from self.events(
+            pl.ENDSACC, start, self.time - self.period, origin, (self.x, self.y))
+
+    def blink(self):
+        start = self.time
+        yield from self.events(pl.STARTBLINK, start)
+        n = int(self.rng.uniform(80, 250) / self.period)
+        yield from self.samples(n, lambda fraction: (pl.MISSING_DATA, pl.MISSING_DATA))
+        yield from self.events(pl.ENDBLINK, start, self.time - self.period)
+
+    def items(self):
+        while True:
+            yield from self.fixation()
+            if self.rng.random() < 0.1:
+                yield from self.blink()
+            else:
+                yield from self.saccade()
+
+
+class SyntheticTracker(_StreamTracker):
+    """Generates a seeded stream of fixations, saccades and blinks with noise.
+
+    The same seed always produces the same samples and events.
+
+    Parameters:
+    eye -- which eye(s) are in the samples, either "LEFT", "RIGHT" or "BOTH"
+    rate -- the sample rate in Hz
+    seed -- the random seed
+    resolution -- the (width, height) of the screen in pixels, saccade targets are on screen
+    speed -- how much faster than real time the samples are released
+    """
+    def __init__(self, eye='BOTH', rate=1000, seed=0, resolution=(1920, 1080), speed=1.0):
+        super().__init__(_Synthetic(eye, rate, seed, resolution).items(), speed)
+
+
+_asc_events = {
+    'SFIX': pl.STARTFIX, 'EFIX': pl.ENDFIX,
+    'SSACC': pl.STARTSACC, 'ESACC': pl.ENDSACC,
+    'SBLINK': pl.STARTBLINK, 'EBLINK': pl.ENDBLINK,
+}
+
+
+def _asc_value(field, missing):
+    return missing if field == '.' else float(field)
+
+
+def _asc_sample(fields, eyes):
+    data = []
+    for i in range(len(eyes)):
+        x, y, pupil = fields[1 + 3 * i:4 + 3 * i]
+        data.append(_EyeData(_asc_value(x, pl.MISSING_DATA), _asc_value(y, pl.MISSING_DATA),
+                             _asc_value(pupil, 0.0)))
+
+    by_eye = dict(zip(eyes, data))
+    return _Sample(_asc_time(fields[0]), by_eye.get(0), by_eye.get(1))
+
+
+def _asc_event(fields):
+    data_type = _asc_events[fields[0]]
+    eye = 0 if fields[1] == 'L' else 1
+    start = _asc_time(fields[2])
+    if fields[0][0] == 'S':
+        return start, data_type, _Event(data_type, eye, start)
+
+    end = _asc_time(fields[3])
+    return end, data_type, _Event(data_type, eye, start, end)
+
+
+def _replay_items(filename):
+    """Yields the samples and events of an asc file in the order they were written."""
+    eyes = [0, 1]
+    with open(filename) as asc_file:
+        for line in asc_file:
+            if line[:1].isdigit():
+                fields = line.split()
+                yield float(fields[0]), pl.SAMPLE_TYPE, _asc_sample(fields, eyes)
+            elif line.startswith('SAMPLES') or line.startswith('START'):
+                eyes = [eye for eye, name in enumerate(('LEFT', 'RIGHT')) if name in line]
+            elif line[:1] in ('S', 'E') and line.split()[0] in _asc_events:
+                yield _asc_event(line.split())
+
+
+class ReplayTracker(_StreamTracker):
+    """Replays the samples and events of an asc file (from edf2asc).
+
+    Samples are released with the original timing, divided by speed. Once the end of the file
+    is reached no more samples arrive, as if the tracker had stopped.
+
+    Parameters:
+    filename -- the asc file to replay
+    speed -- how much faster than real time the samples are released
+    """
+    def __init__(self, filename, speed=1.0):
+        super().__init__(_replay_items(filename), speed)
@@ -0,0 +1,85 @@
+import sys
+import time
+import types
+import unittest
+
+try:
+    import pylink
+except ImportError:
+    pylink = sys.modules['pylink'] = types.ModuleType('pylink')
+if not hasattr(pylink, '__file__'):  # A stub shared by the test modules, add the base class
+    vars(pylink).setdefault('EyeLinkCustomDisplay', object)
+
+import numpy as np
+
+import PsychoPyCustomDisplay
+
+
+def _wait_for_image(pipeline, timeout=1):
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        newest = pipeline.take_newest()
+        if newest is not None:
+            return newest[1]
+        time.sleep(0.001)
+    return None
+
+
+class TestCameraPipeline(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = PsychoPyCustomDisplay._CameraPipeline()
+        self.pipeline.start()
+        self.addCleanup(self.pipeline.stop)
+        # Index i is red i, green 0, blue 255
+        self.palette = (np.arange(256, dtype=np.uint32) | (255 << 16)).astype(np.uint32)
+
+    def add_frame(self, lines, width=4, totlines=3):
+        return [self.pipeline.add_line(width, line, totlines, bytes([line] * width),
+                                       self.palette) for line in lines]
+
+    def test_frame(self):
+        self.assertEqual(self.add_frame([1, 2, 3]), [False, False, True])
+
+        image = _wait_for_image(self.pipeline)
+        self.assertEqual(image.size, (4, 3))
+        self.assertEqual(image.getpixel((0, 0))[:3], (1, 0, 255))
+        self.assertEqual(image.getpixel((3, 2))[:3], (3, 0, 255))
+        self.assertEqual(self.pipeline.dropped_frames, 0)
+
+    def test_line_one_starts_a_frame(self):
+        # The end of a frame that started before, then a frame with its first lines missing
+        self.assertEqual(self.add_frame([3, 1, 2, 3]), [False, False, False, True])
+        self.assertEqual(self.add_frame([2, 3]), [False, False])
+
+        image = _wait_for_image(self.pipeline)
+        self.assertEqual([image.getpixel((0, y))[0] for y in range(3)], [1, 2, 3])
+        self.assertEqual(self.pipeline.dropped_frames, 2)
+
+    def test_wrong_length_frame_is_dropped(self):
+        self.pipeline.add_line(4, 1, 2, bytes(4), self.palette)
+        self.assertFalse(self.pipeline.add_line(4, 2, 2, bytes(3), self.palette))
+        self.assertEqual(self.pipeline.dropped_frames, 1)
+        self.assertIsNone(_wait_for_image(self.pipeline, timeout=0.05))
+
+    def test_conversion_error(self):
+        self.pipeline.submit(4, 3, bytes(5), self.palette)  # Too few pixels for the image
+        end = time.perf_counter() + 1
+        while self.pipeline.conversion_errors == 0 and time.perf_counter() < end:
+            time.sleep(0.001)
+        self.assertEqual(self.pipeline.conversion_errors, 1)
+        self.assertIsInstance(self.pipeline.error, ValueError)
+        self.assertEqual(self.pipeline.dropped_frames, 1)
+
+        # The worker keeps converting after the error
+        self.add_frame([1, 2, 3])
+        self.assertIsNotNone(_wait_for_image(self.pipeline))
+
+    def test_newest_frame_replaces_older(self):
+        self.pipeline.stop()  # Frames queue up while the worker is not running
+        self.pipeline.submit(4, 3, bytes([1] * 12), self.palette)
+        self.pipeline.submit(4, 3, bytes([2] * 12), self.palette)
+        self.assertEqual(self.pipeline.dropped_frames, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
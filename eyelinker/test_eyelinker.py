@@ -0,0 +1,185 @@
+import sys
+import threading
+import types
+import unittest
+from unittest import mock
+
+try:
+    import pylink
+except ImportError:
+    pylink = sys.modules['pylink'] = types.ModuleType('pylink')
+if not hasattr(pylink, '__file__'):  # A stub shared by the test modules, add what eyelinker uses
+    for name, value in [('STARTBLINK', 3), ('ENDBLINK', 4), ('STARTSACC', 5), ('ENDSACC', 6),
+                        ('STARTFIX', 7), ('ENDFIX', 8), ('SAMPLE_TYPE', 200),
+                        ('MISSING_DATA', -32768), ('EyeLinkCustomDisplay', object)]:
+        vars(pylink).setdefault(name, value)
+
+import eyelinker
+
+
+class _FakeTracker:
+    """Records what is sent over the link. error is returned by sends, or raised if it is one."""
+    def __init__(self, error=0):
+        self.error = error
+        self.sent = []
+        self.connected = 1
+
+    def _send(self, kind, text):
+        if isinstance(self.error, Exception):
+            raise self.error
+        self.sent.append((kind, text))
+        return self.error
+
+    def sendMessage(self, text):
+        return self._send('message', text)
+
+    def sendCommand(self, text):
+        return self._send('command', text)
+
+    def isConnected(self):
+        return self.connected
+
+    def stopRecording(self):
+        self.sent.append(('stopRecording', None))
+
+    def closeDataFile(self):
+        self.sent.append(('closeDataFile', None))
+
+    def close(self):
+        pass
+
+
+class TestConnectedEyeLinker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = _FakeTracker()
+        window = types.SimpleNamespace(size=(800, 600), color=(0, 0, 0))
+        self.eyelinker = eyelinker.ConnectedEyeLinker(
+            window, 'test.edf', 'LEFT', tracker=self.tracker, create_display=False)
+
+    def test_send(self):
+        self.eyelinker.send_message('TRIAL 1')
+        self.eyelinker.send_command('draw_cross 10 10 1')
+
+        self.assertEqual(self.tracker.sent, [('message', 'TRIAL 1'),
+                                             ('command', 'draw_cross 10 10 1')])
+        self.assertFalse(self.eyelinker.buffering)
+
+    def test_link_error_buffers(self):
+        for error in [RuntimeError('link lost'), -1]:  # pylink raises or returns a code
+            with self.subTest(error=error):
+                self.tracker.error = error
+                self.eyelinker._buffered = None
+
+                self.eyelinker.send_message('TRIAL 1')
+                self.eyelinker.send_command('draw_cross 10 10 1')
+
+                self.assertTrue(self.eyelinker.buffering)
+                self.assertEqual([(kind, text) for _, kind, text in self.eyelinker._buffered],
+                                 [('message', 'TRIAL 1'), ('command', 'draw_cross 10 10 1')])
+
+    def test_reconnect_sends_buffered(self):
+        self.tracker.error = -1
+        self.eyelinker.send_message('TRIAL 1')
+        self.eyelinker.send_command('draw_cross 10 10 1')
+
+        new_tracker = _FakeTracker()
+        with mock.patch.object(eyelinker.pl, 'EyeLink', lambda: new_tracker, create=True):
+            self.assertEqual(self.eyelinker.reconnect(), 2)
+
+        self.assertFalse(self.eyelinker.buffering)
+        self.assertIs(self.eyelinker.tracker, new_tracker)
+        self.assertEqual(new_tracker.sent[0][0], 'message')
+        self.assertRegex(new_tracker.sent[0][1], r'^[0-9]+ TRIAL 1$')
+        self.assertEqual(new_tracker.sent[1], ('command', 'draw_cross 10 10 1'))
+
+    def test_is_connected_holds_link_lock(self):
+        results = []
+        with self.eyelinker._link_lock:
+            thread = threading.Thread(target=lambda: results.append(self.eyelinker.is_connected()))
+            thread.start()
+            thread.join(0.05)
+            self.assertTrue(thread.is_alive())  # Waits while another thread uses the link
+        thread.join(1)
+        self.assertEqual(results, [True])
+
+        self.tracker.connected = 0
+        self.assertFalse(self.eyelinker.is_connected())
+
+
+class TestDeferredMessages(unittest.TestCase):
+    def setUp(self):
+        self.tracker = _FakeTracker()
+        window = types.SimpleNamespace(size=(800, 600), color=(0, 0, 0))
+        self.eyelinker = eyelinker.ConnectedEyeLinker(
+            window, 'test.edf', 'LEFT', tracker=self.tracker, create_display=False)
+
+        # send_message is called at 10 and 10.25 s, the queue is flushed at 10.5 s
+        self.now = [10.0]
+        for name, replacement in [('perf_counter', lambda: self.now[0]),
+                                  ('sleep', lambda seconds: None)]:
+            patcher = mock.patch.object(eyelinker.time, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def defer_two_messages(self):
+        self.eyelinker.defer_messages()
+        self.eyelinker.send_message('STIMULUS')
+        self.now[0] = 10.25
+        self.eyelinker.send_message('RESPONSE')
+        self.now[0] = 10.5
+
+    def test_flush_sends_in_order_with_offsets(self):
+        self.defer_two_messages()
+        self.assertEqual(self.tracker.sent, [])
+
+        self.assertEqual(self.eyelinker.flush_messages(), 2)
+        self.assertEqual(self.tracker.sent, [('message', '500 STIMULUS'),
+                                             ('message', '250 RESPONSE')])
+
+        # Messages are sent right away again
+        self.eyelinker.send_message('TRIAL END')
+        self.assertEqual(self.tracker.sent[-1], ('message', 'TRIAL END'))
+        self.assertEqual(self.eyelinker.flush_messages(), 0)
+
+    def test_commands_are_not_deferred(self):
+        self.eyelinker.defer_messages()
+        self.eyelinker.send_command('draw_cross 10 10 1')
+        self.assertEqual(self.tracker.sent, [('command', 'draw_cross 10 10 1')])
+
+    def test_stop_recording_flushes_first(self):
+        self.defer_two_messages()
+        self.eyelinker.stop_recording()
+
+        self.assertEqual(self.tracker.sent, [('message', '500 STIMULUS'),
+                                             ('message', '250 RESPONSE'),
+                                             ('stopRecording', None)])
+
+    def test_close_edf_flushes_first(self):
+        self.defer_two_messages()
+        self.eyelinker.close_edf()
+
+        self.assertEqual(self.tracker.sent, [('message', '500 STIMULUS'),
+                                             ('message', '250 RESPONSE'),
+                                             ('closeDataFile', None)])
+        self.assertFalse(self.eyelinker.edf_open)
+
+    def test_flush_during_link_drop(self):
+        self.defer_two_messages()
+        self.tracker.error = RuntimeError('link lost')
+
+        self.eyelinker.flush_messages()
+
+        # Buffered with the time send_message was called, so reconnect sends the same offsets
+        self.assertEqual(self.eyelinker._buffered, [(10.0, 'message', 'STIMULUS'),
+                                                    (10.25, 'message', 'RESPONSE')])
+
+        new_tracker = _FakeTracker()
+        self.now[0] = 11.0
+        with mock.patch.object(eyelinker.pl, 'EyeLink', lambda: new_tracker, create=True):
+            self.eyelinker.reconnect()
+        self.assertEqual(new_tracker.sent, [('message', '1000 STIMULUS'),
+                                            ('message', '750 RESPONSE')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import sys
+import threading
+import types
+import unittest
+
+try:
+    import pylink
+except ImportError:
+    pylink = sys.modules['pylink'] = types.ModuleType('pylink')
+if not hasattr(pylink, '__file__'):  # A stub shared by the test modules, add what linkevents uses
+    for name, value in [('STARTBLINK', 3), ('ENDBLINK', 4), ('STARTSACC', 5), ('ENDSACC', 6),
+                        ('STARTFIX', 7), ('ENDFIX', 8), ('SAMPLE_TYPE', 200),
+                        ('MISSING_DATA', -32768)]:
+        vars(pylink).setdefault(name, value)
+
+import numpy as np
+
+import linkevents
+
+
+class _FakeEyeData:
+    def __init__(self, x, y, pupil):
+        self.gaze = (x, y)
+        self.pupil = pupil
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return self.pupil
+
+
+class _FakeSample:
+    def __init__(self, time, left=None, right=None):
+        self.time = time
+        self.left = left
+        self.right = right
+
+    def getTime(self):
+        return self.time
+
+    def getStatus(self):
+        return 0
+
+    def isLeftSample(self):
+        return self.left is not None
+
+    def isRightSample(self):
+        return self.right is not None
+
+    def getLeftEye(self):
+        return self.left
+
+    def getRightEye(self):
+        return self.right
+
+
+class _FakeEvent:
+    def __init__(self, eye, start, end):
+        self.eye = eye
+        self.start = start
+        self.end = end
+
+    def getEye(self):
+        return self.eye
+
+    def getStartTime(self):
+        return self.start
+
+    def getEndTime(self):
+        return self.end
+
+
+class _FakeTracker:
+    """Returns queued (data type, item) pairs from the link buffer, raises queued errors."""
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.lock = threading.Lock()
+        self.current = None
+
+    def add(self, *items):
+        with self.lock:
+            self.items.extend(items)
+
+    def getNextData(self):
+        with self.lock:
+            if not self.items:
+                return 0
+            data_type, self.current = self.items.pop(0)
+        if isinstance(data_type, Exception):
+            raise data_type
+        return data_type
+
+    def getFloatData(self):
+        return self.current
+
+
+class TestLinkEventDispatcher(unittest.TestCase):
+    def test_dispatch(self):
+        dispatcher = linkevents.LinkEventDispatcher(_FakeTracker())
+        received = []
+        dispatcher.on('saccade_start', received.append)
+        future = dispatcher.next_event('saccade_start')
+        other = dispatcher.next_event('blink_end')
+
+        dispatcher.dispatch('saccade_start', 1, 1000)
+
+        self.assertEqual(received, [linkevents.LinkEvent('saccade_start', 1, 1000, None)])
+        self.assertEqual(future.result(0), received[0])
+        self.assertFalse(other.done())
+
+        # Futures are resolved once, callbacks are called until removed
+        dispatcher.remove('saccade_start', received.append)
+        dispatcher.dispatch('saccade_start', 1, 1010)
+        self.assertEqual(len(received), 1)
+
+        with self.assertRaises(ValueError):
+            dispatcher.on('saccade', received.append)
+
+    def test_broken_callback(self):
+        dispatcher = linkevents.LinkEventDispatcher(_FakeTracker())
+        received = []
+        dispatcher.on('fixation_end', lambda event: 1 / 0)
+        dispatcher.on('fixation_end', received.append)
+
+        dispatcher.dispatch('fixation_end', 0, 1000)
+
+        self.assertEqual(len(received), 1)
+
+    def test_worker_reads_events_and_samples(self):
+        tracker = _FakeTracker([
+            (pylink.SAMPLE_TYPE, _FakeSample(1000, left=_FakeEyeData(1, 2, 300))),
+            (pylink.STARTSACC, _FakeEvent(0, 1001, 1001)),
+            (pylink.SAMPLE_TYPE, _FakeSample(
+                1002, left=_FakeEyeData(pylink.MISSING_DATA, 2, 0),
+                right=_FakeEyeData(5, 6, 400))),
+            (pylink.ENDSACC, _FakeEvent(0, 1001, 1020)),
+        ])
+        dispatcher = linkevents.LinkEventDispatcher(tracker)
+        saccade_end = dispatcher.next_event('saccade_end')
+        starts = []
+        dispatcher.on('saccade_start', starts.append)
+
+        dispatcher.start(poll_interval=0.001)
+        event = saccade_end.result(timeout=1)
+        dispatcher.stop()
+
+        self.assertEqual((event.kind, event.eye, event.time), ('saccade_end', 0, 1020))
+        self.assertEqual([e.time for e in starts], [1001])
+
+        samples = dispatcher.drain_samples()
+        self.assertEqual(samples.dtype, linkevents.SAMPLE_DTYPE)
+        np.testing.assert_array_equal(samples['time'], [1000, 1002, 1002])
+        np.testing.assert_array_equal(samples['eye'], [0, 0, 1])
+        np.testing.assert_array_equal(samples['gaze_x'], [1, np.nan, 5])
+        self.assertEqual(len(dispatcher.drain_samples()), 0)
+
+    def test_worker_failure(self):
+        tracker = _FakeTracker([
+            (pylink.SAMPLE_TYPE, _FakeSample(1000, left=_FakeEyeData(1, 2, 300))),
+            (RuntimeError('link lost'), None),
+        ])
+        dispatcher = linkevents.LinkEventDispatcher(tracker)
+
+        dispatcher.start(poll_interval=0.001)
+        dispatcher._thread.join(1)
+        self.assertFalse(dispatcher.running)
+
+        # The error is raised once, then the samples read before it are returned
+        with self.assertRaises(RuntimeError):
+            dispatcher.drain_samples()
+        np.testing.assert_array_equal(dispatcher.drain_samples()['time'], [1000])
+
+        # The dispatcher can be started again
+        tracker.add((pylink.STARTFIX, _FakeEvent(1, 1100, 1100)))
+        fixation = dispatcher.next_event('fixation_start')
+        dispatcher.start(poll_interval=0.001)
+        self.assertTrue(dispatcher.running)
+        self.assertEqual(fixation.result(timeout=1).time, 1100)
+        dispatcher.stop()
+        self.assertFalse(dispatcher.running)
+
+    def test_stop_raises_worker_error(self):
+        dispatcher = linkevents.LinkEventDispatcher(
+            _FakeTracker([(RuntimeError('link lost'), None)]))
+        dispatcher.start(poll_interval=0.001)
+        dispatcher._thread.join(1)
+
+        with self.assertRaises(RuntimeError):
+            dispatcher.stop()
+        dispatcher.stop()  # Raised only once
+
+
+if __name__ == '__main__':
+    unittest.main()
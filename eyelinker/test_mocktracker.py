@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+try:
+    import pylink
+except ImportError:
+    pylink = sys.modules['pylink'] = types.ModuleType('pylink')
+if not hasattr(pylink, '__file__'):  # A stub shared by the test modules, add what mocktracker uses
+    for name, value in [('STARTBLINK', 3), ('ENDBLINK', 4), ('STARTSACC', 5), ('ENDSACC', 6),
+                        ('STARTFIX', 7), ('ENDFIX', 8), ('SAMPLE_TYPE', 200),
+                        ('MISSING_DATA', -32768)]:
+        vars(pylink).setdefault(name, value)
+
+import mocktracker
+
+
+def _read_all(tracker, seconds=0.02):
+    """Returns the (data type, item) pairs released while recording for a while."""
+    tracker.startRecording()
+    time.sleep(seconds)
+    items = []
+    data_type = tracker.getNextData()
+    while data_type:
+        items.append((data_type, tracker.getFloatData()))
+        data_type = tracker.getNextData()
+    tracker.stopRecording()
+    return items
+
+
+class TestReplayTracker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.asc')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        with open(self.filename, 'w') as asc_file:
+            asc_file.write(text)
+
+    def test_replay_2000_hz(self):
+        self.write('START\t1000 \tLEFT\tSAMPLES\tEVENTS\n'
+                   'SFIX L   1000.5\n'
+                   '1000\t  100.0\t  200.0\t 1000.0\t...\n'
+                   '1000.5\t  101.0\t  201.0\t 1001.0\t...\n'
+                   '1001\t    .\t    .\t    0.0\t...\n'
+                   'EFIX L   1000.5\t1001\t1\t  100.5\t  200.5\t   1000\n')
+
+        items = _read_all(mocktracker.ReplayTracker(self.filename, speed=1000))
+
+        self.assertEqual([data_type for data_type, _ in items], [
+            pylink.STARTFIX, pylink.SAMPLE_TYPE, pylink.SAMPLE_TYPE, pylink.SAMPLE_TYPE,
+            pylink.ENDFIX])
+        samples = [item for data_type, item in items if data_type == pylink.SAMPLE_TYPE]
+        self.assertEqual([sample.getTime() for sample in samples], [1000, 1000.5, 1001])
+        self.assertEqual(samples[1].getLeftEye().getGaze(), (101, 201))
+        self.assertFalse(samples[1].isRightSample())
+        self.assertEqual(samples[2].getLeftEye().getGaze(),
+                         (pylink.MISSING_DATA, pylink.MISSING_DATA))
+        self.assertEqual(items[0][1].getStartTime(), 1000.5)
+        self.assertEqual((items[-1][1].getStartTime(), items[-1][1].getEndTime()), (1000.5, 1001))
+
+    def test_empty_file(self):
+        self.write('')
+        tracker = mocktracker.ReplayTracker(self.filename)
+
+        self.assertEqual(_read_all(tracker, seconds=0), [])
+        tracker.startRecording()
+        self.assertIsNone(tracker.getNewestSample())
+
+
+class TestSyntheticTracker(unittest.TestCase):
+    def test_2000_hz_timestamps(self):
+        items = _read_all(mocktracker.SyntheticTracker(eye='LEFT', rate=2000, speed=10))
+        times = [item.getTime() for data_type, item in items
+                 if data_type == pylink.SAMPLE_TYPE]
+
+        self.assertGreater(len(times), 100)
+        self.assertEqual(set(b - a for a, b in zip(times, times[1:])), {0.5})
+        self.assertIsInstance(times[0], int)
+        self.assertIsInstance(times[1], float)
+
+    def test_seed(self):
+        def first_samples(seed):
+            items = _read_all(mocktracker.SyntheticTracker(seed=seed, speed=10))
+            return [(item.getTime(), item.getLeftEye().getGaze(), item.getLeftEye().getPupilSize())
+                    for data_type, item in items if data_type == pylink.SAMPLE_TYPE][:100]
+
+        self.assertEqual(first_samples(1), first_samples(1))
+        self.assertNotEqual(first_samples(1), first_samples(2))
+
+    def test_events(self):
+        items = _read_all(mocktracker.SyntheticTracker(eye='BOTH', speed=10), seconds=0.05)
+        events = [item for data_type, item in items if data_type != pylink.SAMPLE_TYPE]
+
+        self.assertEqual(events[0].getType(), pylink.STARTFIX)
+        self.assertEqual({event.getEye() for event in events}, {0, 1})
+        for event in events:
+            self.assertLessEqual(event.getStartTime(), event.getEndTime())
+
+
+if __name__ == '__main__':
+    unittest.main()
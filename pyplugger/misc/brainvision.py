@@ -0,0 +1,231 @@
+"""Reads the BrainVision files (.vhdr, .eeg and .vmrk) recorded by pycorder.
+
+The header (.vhdr) describes the binary data file (.eeg) and names the marker file (.vmrk).
+The data file is memory mapped, so selecting a channel of a recording that lasts hours only
+reads that channel from disk, and no copy of the full recording is made.
+
+Functions:
+read_header -- Returns the settings of a .vhdr file.
+read_data -- Returns the samples of a recording as a memory mapped array.
+channel_data -- Returns the raw values of one channel.
+read_markers -- Returns the markers of a .vmrk file as a numpy structured array.
+
+Classes:
+MarkerIndex -- The markers of a .vmrk file, indexed for fast lookups by code and position.
+"""
+
+import configparser
+import os
+
+import numpy as np
+
+
+_binary_formats = {'INT_16': '<i2', 'UINT_16': '<u2', 'INT_32': '<i4', 'IEEE_FLOAT_32': '<f4'}
+
+MARKER_DTYPE = np.dtype([('type', 'U32'), ('description', 'U32'), ('code', '<i4'),
+                         ('position', '<i8'), ('size', '<i8'), ('channel', '<i4')])
+
+
+def _read_ini(filename):
+    """Reads a BrainVision header or marker file, which is an ini file after the first line."""
+    with open(filename, encoding='utf-8', errors='replace') as ini_file:
+        lines = ini_file.read().splitlines()
+
+    parser = configparser.ConfigParser(interpolation=None, strict=False,
+                                       comment_prefixes=(';',), inline_comment_prefixes=None)
+    parser.optionxform = str  # Keep the case of keys like Ch1 and Mk1
+    parser.read_string('\n'.join(lines[1:]))
+    return parser
+
+
+def read_header(vhdr_filename):
+    """Returns the settings of a .vhdr file as a dictionary.
+
+    Keys: data_file and marker_file (full paths), n_channels, sampling_rate (Hz), dtype,
+    orientation ('MULTIPLEXED' or 'VECTORIZED'), channels (names), resolutions and units.
+
+    Parameters:
+    vhdr_filename -- the header file written by pycorder
+    """
+    ini = _read_ini(vhdr_filename)
+    common = ini['Common Infos']
+    directory = os.path.dirname(os.path.abspath(vhdr_filename))
+
+    if common.get('DataFormat', 'BINARY').upper() != 'BINARY':
+        raise ValueError('Only binary BrainVision data files are supported.')
+
+    n_channels = int(common['NumberOfChannels'])
+    binary_format = ini['Binary Infos']['BinaryFormat'].strip().upper()
+
+    channels, resolutions, units = [], [], []
+    for i in range(1, n_channels + 1):
+        # name,reference,resolution,unit with \1 for commas in names
+        fields = ini['Channel Infos']['Ch%i' % i].split(',')
+        channels.append(fields[0].replace('\\1', ','))
+        resolutions.append(float(fields[2]) if len(fields) > 2 and fields[2] else 1.0)
+        units.append(fields[3] if len(fields) > 3 else 'µV')
+
+    return {
+        'data_file': os.path.join(directory, common['DataFile']),
+        'marker_file': os.path.join(directory, common['MarkerFile']),
+        'n_channels': n_channels,
+        'sampling_rate': 1e6 / float(common['SamplingInterval']),
+        'dtype': np.dtype(_binary_formats[binary_format]),
+        'orientation': common.get('DataOrientation', 'MULTIPLEXED').strip().upper(),
+        'channels': channels,
+        'resolutions': np.array(resolutions),
+        'units': units,
+    }
+
+
+def read_data(vhdr_filename):
+    """Returns the samples of a recording and its header.
+
+    The samples are a read only memory mapped array of raw values with one row per channel,
+    so data[i] is channel i (multiplexed files give a strided view). Multiply by
+    header['resolutions'] to get the values in the channel units.
+
+    Parameters:
+    vhdr_filename -- the header file written by pycorder
+    """
+    header = read_header(vhdr_filename)
+    data = np.memmap(header['data_file'], dtype=header['dtype'], mode='r')
+    n_samples = data.size // header['n_channels']
+    data = data[:n_samples * header['n_channels']]
+
+    if header['orientation'] == 'VECTORIZED':
+        data = data.reshape(header['n_channels'], n_samples)
+    else:
+        data = data.reshape(n_samples, header['n_channels']).T
+
+    return data, header
+
+
+def channel_data(data, header, channel):
+    """Returns the raw values of one channel (still memory mapped).
+
+    Parameters:
+    data, header -- as returned by read_data
+    channel -- the channel name or index
+    """
+    if not isinstance(channel, int):
+        if channel not in header['channels']:
+            raise ValueError('There is no channel %r, the channels are: %s'
+                             % (channel, ', '.join(header['channels'])))
+        channel = header['channels'].index(channel)
+    return data[channel]
+
+
+def _marker_code(description):
+    """Returns the number in a marker description such as 'S  1' or 'R 12', or -1."""
+    digits = description[1:].strip()
+    return int(digits) if digits.isdigit() else -1
+
+
+def read_markers(vmrk_filename):
+    """Returns the markers of a .vmrk file as a numpy structured array (see MARKER_DTYPE).
+
+    position is the 0 based sample index (the file counts from 1), code is the number in
+    descriptions like 'S  1' (-1 for other markers) and channel is 0 for all channels.
+
+    Parameters:
+    vmrk_filename -- the marker file written by pycorder
+    """
+    rows = []
+    with open(vmrk_filename, encoding='utf-8', errors='replace') as marker_file:
+        for line in marker_file:
+            if not line.startswith('Mk'):
+                continue
+            # Mk<n>=<type>,<description>,<position>,<size>,<channel>[,<date>]
+            fields = line.split('=', 1)[1].rstrip('\n').split(',')
+            rows.append((fields[0], fields[1], _marker_code(fields[1]), int(fields[2]) - 1,
+                         int(fields[3] or 1), int(fields[4] or 0)))
+
+    return np.array(rows, dtype=MARKER_DTYPE)
+
+
+class MarkerIndex:
+    """The markers of a .vmrk file, indexed for fast lookups by code and position.
+
+    The markers are sorted by position, and a second order sorts them by code and then
+    position, so every lookup is a binary search instead of a scan of the file. Use load to
+    read a marker file, which caches the parsed markers next to it.
+
+    Attributes:
+    markers -- the structured array from read_markers, sorted by position
+
+    Parameters:
+    markers -- a structured array from read_markers
+    """
+    def __init__(self, markers):
+        self.markers = markers[np.argsort(markers['position'], kind='stable')]
+        self._by_code = np.argsort(self.markers['code'], kind='stable')  # Positions stay sorted
+
+        codes = self.markers['code'][self._by_code]
+        unique, starts = np.unique(codes, return_index=True)
+        ends = np.append(starts[1:], len(codes))
+        self._code_ranges = {int(code): (start, end)
+                             for code, start, end in zip(unique, starts, ends)}
+
+    @classmethod
+    def load(cls, vmrk_filename, cache=True):
+        """Returns the MarkerIndex of a marker file.
+
+        With cache, the parsed markers are saved to <vmrk_filename>.npz and reused as long as
+        the modification time and size of the marker file do not change.
+
+        Parameters:
+        vmrk_filename -- the marker file written by pycorder
+        cache -- whether to read and write the cache file
+        """
+        stat = os.stat(vmrk_filename)
+        key = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        cache_filename = vmrk_filename + '.npz'
+
+        if cache and os.path.isfile(cache_filename):
+            with np.load(cache_filename) as cached:
+                if np.array_equal(cached['key'], key):
+                    return cls(cached['markers'])
+
+        markers = read_markers(vmrk_filename)
+
+        if cache:
+            try:
+                with open(cache_filename, 'wb') as cache_file:
+                    np.savez(cache_file, key=key, markers=markers)
+            except OSError:  # e.g. a read only directory, the cache is optional
+                pass
+
+        return cls(markers)
+
+    def __len__(self):
+        return len(self.markers)
+
+    def codes(self):
+        """Returns the codes that occur, sorted."""
+        return sorted(self._code_ranges)
+
+    def find(self, code=None, start=None, stop=None, kind=None):
+        """Returns the markers matching all given conditions, sorted by position.
+
+        Parameters:
+        code -- the marker code, e.g. 12 for 'S 12'
+        start -- the first sample position to include
+        stop -- the sample position to stop before
+        kind -- the marker type, e.g. 'Stimulus' (not case sensitive)
+        """
+        if code is None:
+            rows = np.arange(len(self.markers))
+        else:
+            first, last = self._code_ranges.get(int(code), (0, 0))
+            rows = self._by_code[first:last]
+
+        positions = self.markers['position'][rows]
+        low = 0 if start is None else np.searchsorted(positions, start, 'left')
+        high = len(rows) if stop is None else np.searchsorted(positions, stop, 'left')
+        found = self.markers[rows[low:high]]
+
+        if kind is not None:
+            found = found[np.char.lower(found['type']) == kind.lower()]
+
+        return found
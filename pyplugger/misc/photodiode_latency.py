@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""Measures the delay between EEG triggers and the photodiode in a BrainVision recording.
+
+A photodiode taped over the patch drawn by draw_photodiode_stimuli (or mark_next_flip) and
+recorded as an extra EEG channel shows when a stimulus actually appeared on screen. This
+script finds every onset of the patch in that channel and pairs each trigger marker with the
+first onset in a window after it, reporting the latency distribution for every trigger code.
+
+The photodiode channel is read from the memory mapped data file in chunks and thresholded
+with numpy, so hours of data take seconds. The threshold defaults to halfway between the
+mean off and on level of the channel (estimated from a subsample), which works however
+briefly the patch is shown.
+
+Functions:
+detect_onsets -- Returns the sample positions where the photodiode signal turns on.
+pair_markers -- Pairs trigger markers with the first photodiode onset after them.
+latency_report -- Returns summary statistics of the latencies for every code.
+main -- Command line entry point.
+"""
+
+import argparse
+import csv
+
+import numpy as np
+
+import brainvision
+
+
+def _threshold(signal, sample_size=1000000, max_iterations=100):
+    """Returns the value halfway between the mean off and on level of the signal.
+
+    Starting halfway between the 0.01th and 99.99th percentile, the threshold is moved to the
+    midpoint of the means below and above it until it settles (the isodata method). Unlike a
+    percentile, this does not depend on how long the patch is on. Values beyond those
+    percentiles (e.g. spikes) are clipped, so they cannot pull the means.
+    """
+    step = max(1, len(signal) // sample_size)
+    values = np.asarray(signal[::step], dtype=float)
+    low, high = np.percentile(values, [0.01, 99.99])
+    values = np.clip(values, low, high)
+
+    threshold = (low + high) / 2
+    for _ in range(max_iterations):
+        above = values > threshold
+        if above.all() or not above.any():
+            break
+        previous, threshold = threshold, (values[above].mean() + values[~above].mean()) / 2
+        if abs(threshold - previous) <= (high - low) * 1e-6:
+            break
+    return threshold
+
+
+def detect_onsets(signal, threshold=None, min_gap=1, invert=False, chunk_size=1 << 22):
+    """Returns the sample positions where the photodiode signal turns on.
+
+    Parameters:
+    signal -- a 1d array (e.g. from brainvision.channel_data)
+    threshold -- the value separating on from off, see _threshold if None
+    min_gap -- the shortest time off (in samples) between two onsets, shorter dips are noise
+    invert -- True if the patch makes the signal go down
+    chunk_size -- how many samples are read at a time
+    """
+    if threshold is None:
+        threshold = _threshold(signal)
+
+    ups, downs = [], []
+    previous = None
+    for start in range(0, len(signal), chunk_size):
+        chunk = np.asarray(signal[start:start + chunk_size])
+        on = chunk < threshold if invert else chunk > threshold
+        if previous is None and len(on):
+            previous = on[0]  # A patch that is on when the recording starts is no onset
+        changes = np.flatnonzero(on[1:] != on[:-1]) + 1
+        if len(on) and on[0] != previous:
+            changes = np.concatenate(([0], changes))
+        changes += start
+        ups.append(changes[on[changes - start]])
+        downs.append(changes[~on[changes - start]])
+        if len(on):
+            previous = on[-1]
+
+    ups, downs = np.concatenate(ups), np.concatenate(downs)
+    if len(ups) == 0:
+        return ups
+
+    # The time off before each onset, from the preceding offset
+    offs_before = downs[np.searchsorted(downs, ups[1:]) - 1]
+    keep = np.concatenate(([True], ups[1:] - offs_before >= min_gap))
+    return ups[keep]
+
+
+def pair_markers(markers, onsets, rate, codes=None, window=(-20, 200)):
+    """Pairs trigger markers with the first photodiode onset after them.
+
+    Returns a structured array with the marker code, position and latency (in ms, nan if no
+    onset was found in the window).
+
+    Parameters:
+    markers -- the structured array from brainvision.read_markers
+    onsets -- the sorted onset positions from detect_onsets
+    rate -- the sampling rate in Hz
+    codes -- the trigger codes to use, all stimulus markers if None
+    window -- the earliest and latest latency in ms for an onset to belong to a marker
+    """
+    triggers = markers[(markers['code'] >= 0) & (np.char.lower(markers['type']) == 'stimulus')]
+    if codes is not None:
+        triggers = triggers[np.isin(triggers['code'], codes)]
+
+    first = triggers['position'] + int(np.floor(window[0] * rate / 1000))
+    index = np.searchsorted(onsets, first)
+    found = index < len(onsets)
+
+    latency = np.full(len(triggers), np.nan)
+    latency[found] = (onsets[index[found]] - triggers['position'][found]) * 1000 / rate
+    latency[latency > window[1]] = np.nan
+
+    result = np.zeros(len(triggers), dtype=[('code', '<i4'), ('position', '<i8'),
+                                            ('latency', '<f8')])
+    result['code'] = triggers['code']
+    result['position'] = triggers['position']
+    result['latency'] = latency
+    return result
+
+
+def latency_report(pairs):
+    """Returns a list of dictionaries with latency statistics (in ms) for every code."""
+    report = []
+    for code in np.unique(pairs['code']):
+        latency = pairs['latency'][pairs['code'] == code]
+        found = latency[~np.isnan(latency)]
+        row = {'code': int(code), 'n': len(latency), 'missing': len(latency) - len(found)}
+        if len(found):
+            p5, median, p95 = np.percentile(found, [5, 50, 95])
+            row.update(mean=found.mean(), sd=found.std(), min=found.min(), p5=p5,
+                       median=median, p95=p95, max=found.max())
+        report.append(row)
+    return report
+
+
+def _print_report(report):
+    columns = ['mean', 'sd', 'min', 'p5', 'median', 'p95', 'max']
+    print('%6s %6s %8s ' % ('code', 'n', 'missing') + ' '.join('%8s' % c for c in columns))
+    for row in report:
+        values = ' '.join('%8.2f' % row[c] if c in row else '%8s' % '-' for c in columns)
+        print('%6i %6i %8i %s' % (row['code'], row['n'], row['missing'], values))
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description='Measures trigger to photodiode latencies in a BrainVision recording.')
+    ap.add_argument('vhdr', help='The header file of the recording.')
+    ap.add_argument('channel', help='The name (or index) of the photodiode channel.')
+    ap.add_argument('-c', '--code', type=int, action='append', help='Only use this code.')
+    ap.add_argument('--threshold', type=float, help='The raw threshold value.')
+    ap.add_argument('--invert', action='store_true', help='The patch lowers the signal.')
+    ap.add_argument('--min-gap', type=float, default=10, help='Shortest time off in ms.')
+    ap.add_argument('--window', type=float, nargs=2, default=(-20, 200),
+                    help='Earliest and latest latency in ms.')
+    ap.add_argument('-o', '--output', help='A csv file for the latency of every trigger.')
+
+    args = vars(ap.parse_args())
+
+    data, header = brainvision.read_data(args['vhdr'])
+    channel = int(args['channel']) if args['channel'].isdigit() else args['channel']
+    signal = brainvision.channel_data(data, header, channel)
+    rate = header['sampling_rate']
+
+    onsets = detect_onsets(signal, args['threshold'], int(args['min_gap'] * rate / 1000),
+                           args['invert'])
+    markers = brainvision.MarkerIndex.load(header['marker_file']).markers
+    pairs = pair_markers(markers, onsets, rate, args['code'], args['window'])
+
+    print('%i photodiode onsets and %i triggers in %.1f minutes.'
+          % (len(onsets), len(pairs), signal.shape[0] / rate / 60))
+    _print_report(latency_report(pairs))
+
+    if args['output']:
+        with open(args['output'], 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['code', 'position', 'latency'])
+            writer.writerows(pairs.tolist())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""Aligns the eye tracker and EEG clocks using the events sent by send_synced_event.
+
+send_synced_event writes 'SYNC <code>' to the EDF file and sends the same code to the EEG
+parallel port, so both recordings contain the same sequence of codes on their own clocks.
+This script streams the asc file (from edf2asc) for the SYNC messages and the .vmrk file for
+the trigger markers, matches the two code sequences with a global sequence alignment (so
+missing or extra events on either side do not shift the rest of the session) and fits a
+linear model from tracker time to EEG samples. Pairs that do not fit (e.g. a wrongly matched
+repeated code) are dropped as outliers before the final fit.
+
+The result is saved as an npz file with the matched pairs, the fit and a timeline of every
+SYNC event from both recordings on the EEG clock. Optionally, the gaze samples are resampled
+onto the EEG samples, ready to be analysed together with the EEG data.
+
+Functions:
+read_sync_messages -- Returns the times and codes of the SYNC messages in an asc file.
+align_codes -- Returns the indices of matching codes in two sequences.
+fit_clock -- Fits EEG sample = slope * tracker time + intercept to the matched events.
+resample_gaze -- Returns the gaze samples of an asc file at every EEG sample.
+main -- Command line entry point.
+"""
+
+import argparse
+import re
+
+import numpy as np
+
+import brainvision
+
+
+def read_sync_messages(asc_filename, keyword='SYNC'):
+    """Returns the times (ms, tracker clock) and codes of the SYNC messages in an asc file.
+
+    Messages sent with an offset (MSG <time> <offset> SYNC <code>) get the time they were meant
+    for, time - offset, and the messages are returned in time order.
+
+    Parameters:
+    asc_filename -- the asc file from edf2asc
+    keyword -- the keyword given to send_synced_event
+    """
+    # The optional number is the offset of messages sent with an offset
+    pattern = re.compile(
+        r'MSG\s+([0-9.]+)\s+(?:(-?\d+)\s+)?%s\s+(-?\d+)\s*$' % re.escape(keyword))
+
+    times, codes = [], []
+    with open(asc_filename) as asc_file:
+        for line in asc_file:
+            if line.startswith('MSG'):
+                match = pattern.match(line)
+                if match:
+                    offset = int(match.group(2)) if match.group(2) else 0
+                    times.append(float(match.group(1)) - offset)
+                    codes.append(int(match.group(3)))
+
+    times, codes = np.array(times), np.array(codes, dtype=np.int64)
+    order = np.argsort(times, kind='stable')
+    return times[order], codes[order]
+
+
+def align_codes(a, b, match=2, mismatch=-3, gap=-1):
+    """Returns the indices of matching codes in two sequences, using a global alignment.
+
+    Needleman-Wunsch with a linear gap penalty. Each row of the score matrix is computed with
+    numpy: the moves from the row above are vectorized, and the moves along the row become a
+    running maximum. Returns two index arrays (into a and b) of the aligned equal codes.
+
+    Parameters:
+    a, b -- sequences of codes
+    match, mismatch, gap -- the alignment scores
+    """
+    a, b = np.asarray(a), np.asarray(b)
+    n, m = len(a), len(b)
+    columns = np.arange(m + 1)
+
+    previous = gap * columns
+    # 0: diagonal, 1: from above (skip a[i]), 2: from the left (skip b[j])
+    moves = np.zeros((n + 1, m + 1), dtype=np.int8)
+    moves[0, 1:] = 2
+    moves[1:, 0] = 1
+
+    for i in range(1, n + 1):
+        scores = np.where(a[i - 1] == b, match, mismatch)
+        diagonal = previous[:-1] + scores
+        above = previous[1:] + gap
+
+        best = np.empty(m + 1)
+        best[0] = gap * i
+        best[1:] = np.maximum(diagonal, above)
+        moves[i, 1:] = np.where(diagonal >= above, 0, 1)
+
+        # A run of left moves: best[j] = max over k <= j of best[k] + gap * (j - k)
+        row = np.maximum.accumulate(best - gap * columns) + gap * columns
+        moves[i, 1:][row[1:] > best[1:]] = 2
+        previous = row
+
+    pairs = []
+    i, j = n, m
+    while i > 0 and j > 0:
+        move = moves[i, j]
+        if move == 0:
+            if a[i - 1] == b[j - 1]:
+                pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif move == 1:
+            i -= 1
+        else:
+            j -= 1
+
+    pairs = np.array(pairs[::-1], dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def fit_clock(tracker_times, eeg_samples, max_residual=None):
+    """Fits EEG sample = slope * tracker time + intercept to the matched events.
+
+    Pairs with a residual larger than max_residual (in samples, by default 5 times the median
+    absolute residual and at least 2 samples) are excluded and the model is fit again.
+
+    Returns a dictionary with slope, intercept, inliers (a boolean array) and residuals.
+
+    Parameters:
+    tracker_times -- the tracker times of the matched events
+    eeg_samples -- the EEG sample positions of the same events
+    max_residual -- the largest residual in samples for a pair to be used
+    """
+    x = np.asarray(tracker_times, dtype=float)
+    y = np.asarray(eeg_samples, dtype=float)
+    if len(x) < 2:
+        raise ValueError('At least two matched events are needed to fit the clocks.')
+
+    inliers = np.ones(len(x), dtype=bool)
+    for _ in range(3):
+        slope, intercept = np.polyfit(x[inliers], y[inliers], 1)
+        residuals = y - (slope * x + intercept)
+        limit = max_residual
+        if limit is None:
+            limit = max(2.0, 5 * np.median(np.abs(residuals[inliers])))
+        inliers = np.abs(residuals) <= limit
+
+    return {'slope': slope, 'intercept': intercept, 'inliers': inliers, 'residuals': residuals}
+
+
+def to_eeg_samples(tracker_times, fit):
+    """Returns the EEG sample positions (floats) of tracker times."""
+    return fit['slope'] * np.asarray(tracker_times, dtype=float) + fit['intercept']
+
+
+def _read_gaze(asc_filename, n_values):
+    """Returns the times and the first n_values columns of every sample line, '.' is nan."""
+    times, values = [], []
+    with open(asc_filename) as asc_file:
+        for line in asc_file:
+            if line[:1].isdigit():
+                fields = line.split()
+                times.append(float(fields[0]))  # Fractional at 2000 Hz
+                values.append([np.nan if v == '.' else float(v)
+                               for v in fields[1:n_values + 1]])
+
+    return np.array(times), np.array(values, dtype=float).reshape(-1, n_values)
+
+
+def resample_gaze(asc_filename, fit, n_samples, n_values=3):
+    """Returns the gaze samples of an asc file at every EEG sample.
+
+    Samples are linearly interpolated between the two nearest gaze samples. EEG samples
+    outside the eye tracking recording, or next to missing data, are nan.
+
+    Parameters:
+    asc_filename -- the asc file from edf2asc
+    fit -- the result of fit_clock
+    n_samples -- the number of EEG samples
+    n_values -- the number of sample columns to use (3 is x, y and pupil of the first eye)
+    """
+    times, values = _read_gaze(asc_filename, n_values)
+    positions = to_eeg_samples(times, fit)
+    targets = np.arange(n_samples)
+
+    gaze = np.full((n_samples, n_values), np.nan)
+    if len(times) < 2:
+        return gaze
+
+    # Recording gaps (e.g. between trials) are not interpolated across
+    inside = (targets >= positions[0]) & (targets <= positions[-1])
+    nearest = np.clip(np.searchsorted(positions, targets[inside]), 1, len(positions) - 1)
+    step = np.median(np.diff(positions))
+    in_gap = positions[nearest] - positions[nearest - 1] > 1.5 * step
+
+    for column in range(n_values):
+        # nan values in either neighbour make the interpolated value nan
+        gaze[inside, column] = np.interp(targets[inside], positions, values[:, column])
+        bad = np.isnan(values[nearest, column]) | np.isnan(values[nearest - 1, column])
+        gaze[np.flatnonzero(inside)[bad | in_gap], column] = np.nan
+
+    return gaze
+
+
+def _timeline(tracker_times, tracker_codes, eeg_markers, fit):
+    """Returns every SYNC event of both recordings on the EEG clock, sorted by time."""
+    source = np.concatenate([np.zeros(len(tracker_codes), dtype=np.int8),
+                             np.ones(len(eeg_markers), dtype=np.int8)])
+    codes = np.concatenate([tracker_codes, eeg_markers['code']])
+    samples = np.concatenate([to_eeg_samples(tracker_times, fit), eeg_markers['position']])
+    order = np.argsort(samples, kind='stable')
+    return source[order], codes[order], samples[order]
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Aligns eye tracking and EEG clocks.')
+    ap.add_argument('asc', help='The asc file of the eye tracking recording.')
+    ap.add_argument('vhdr', help='The header file of the EEG recording.')
+    ap.add_argument('--keyword', default='SYNC', help='The keyword of the synced messages.')
+    ap.add_argument('--resample', action='store_true',
+                    help='Also resample the gaze samples onto the EEG clock.')
+    ap.add_argument('-o', '--output', help='The npz file to write.')
+
+    args = vars(ap.parse_args())
+
+    tracker_times, tracker_codes = read_sync_messages(args['asc'], args['keyword'])
+    header = brainvision.read_header(args['vhdr'])
+    markers = brainvision.MarkerIndex.load(header['marker_file']).find(kind='Stimulus')
+    markers = markers[markers['code'] >= 0]
+
+    i, j = align_codes(tracker_codes, markers['code'])
+    fit = fit_clock(tracker_times[i], markers['position'][j])
+    rate = header['sampling_rate']
+
+    inliers = fit['inliers']
+    print('%i SYNC messages, %i EEG triggers, %i matched, %i used for the fit.'
+          % (len(tracker_codes), len(markers), len(i), inliers.sum()))
+    print('Drift: %.1f ppm, residual sd: %.3f ms.' % (
+        (fit['slope'] * 1000 / rate - 1) * 1e6, fit['residuals'][inliers].std() * 1000 / rate))
+
+    source, codes, samples = _timeline(tracker_times, tracker_codes, markers, fit)
+    result = {
+        'tracker_time': tracker_times[i], 'eeg_sample': markers['position'][j],
+        'code': tracker_codes[i], 'inlier': inliers, 'residual': fit['residuals'],
+        'slope': fit['slope'], 'intercept': fit['intercept'], 'sampling_rate': rate,
+        'timeline_source': source, 'timeline_code': codes, 'timeline_eeg_sample': samples,
+    }
+
+    if args['resample']:
+        data, _ = brainvision.read_data(args['vhdr'])
+        result['gaze'] = resample_gaze(args['asc'], fit, data.shape[1])
+
+    output = args['output'] or args['asc'].rsplit('.', 1)[0] + '_sync.npz'
+    np.savez(output, **result)
+    print('Wrote %s.' % output)
+
+
+if __name__ == '__main__':
+    main()
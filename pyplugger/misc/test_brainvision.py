@@ -0,0 +1,209 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+
+import brainvision
+import photodiode_latency
+
+
+_header = '''Brain Vision Data Exchange Header File Version 1.0
+; Data created by the test
+
+[Common Infos]
+Codepage=UTF-8
+DataFile=session.eeg
+MarkerFile=session.vmrk
+DataFormat=BINARY
+DataOrientation=%s
+NumberOfChannels=3
+SamplingInterval=2000
+
+[Binary Infos]
+BinaryFormat=INT_16
+
+[Channel Infos]
+Ch1=Fp1,,0.1,µV
+Ch2=A\\1B,,0.5,µV
+Ch3=Photo,,1,mV
+'''
+
+_markers = '''Brain Vision Data Exchange Marker File, Version 1.0
+
+[Common Infos]
+DataFile=session.eeg
+
+[Marker Infos]
+Mk1=New Segment,,1,1,0,20240101120000000000
+Mk2=Stimulus,S 12,5,1,0
+Mk3=Stimulus,S  1,3,1,0
+Mk4=Response,R  1,7,1,0
+Mk5=Stimulus,S 12,9,1,0
+'''
+
+
+class TestBrainVision(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.vhdr = os.path.join(self.directory, 'session.vhdr')
+        self.vmrk = os.path.join(self.directory, 'session.vmrk')
+        # Channel i has the values 100 * i + sample index
+        self.samples = np.arange(10) + 100 * np.arange(3)[:, None]
+
+        with open(self.vmrk, 'w', encoding='utf-8') as vmrk_file:
+            vmrk_file.write(_markers)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_recording(self, orientation):
+        with open(self.vhdr, 'w', encoding='utf-8') as vhdr_file:
+            vhdr_file.write(_header % orientation)
+        samples = self.samples if orientation == 'VECTORIZED' else self.samples.T
+        samples.astype('<i2').tofile(os.path.join(self.directory, 'session.eeg'))
+
+    def test_read_header(self):
+        self.write_recording('MULTIPLEXED')
+        header = brainvision.read_header(self.vhdr)
+
+        self.assertEqual(header['data_file'], os.path.join(self.directory, 'session.eeg'))
+        self.assertEqual(header['marker_file'], self.vmrk)
+        self.assertEqual(header['n_channels'], 3)
+        self.assertEqual(header['sampling_rate'], 500)
+        self.assertEqual(header['dtype'], np.dtype('<i2'))
+        self.assertEqual(header['channels'], ['Fp1', 'A,B', 'Photo'])
+        np.testing.assert_array_equal(header['resolutions'], [0.1, 0.5, 1])
+        self.assertEqual(header['units'], ['µV', 'µV', 'mV'])
+
+    def test_read_data(self):
+        for orientation in ['MULTIPLEXED', 'VECTORIZED']:
+            with self.subTest(orientation=orientation):
+                self.write_recording(orientation)
+                data, header = brainvision.read_data(self.vhdr)
+
+                self.assertEqual(header['orientation'], orientation)
+                np.testing.assert_array_equal(data, self.samples)
+                np.testing.assert_array_equal(
+                    brainvision.channel_data(data, header, 'Photo'), self.samples[2])
+                np.testing.assert_array_equal(
+                    brainvision.channel_data(data, header, 1), self.samples[1])
+                with self.assertRaises(ValueError):
+                    brainvision.channel_data(data, header, 'Cz')
+                del data  # Closes the memory map before the next file is written
+
+    def test_read_markers(self):
+        markers = brainvision.read_markers(self.vmrk)
+
+        # Positions are counted from 1 in the file
+        np.testing.assert_array_equal(markers['position'], [0, 4, 2, 6, 8])
+        np.testing.assert_array_equal(markers['code'], [-1, 12, 1, 1, 12])
+        self.assertEqual(list(markers['type']),
+                         ['New Segment', 'Stimulus', 'Stimulus', 'Response', 'Stimulus'])
+
+    def test_find(self):
+        index = brainvision.MarkerIndex(brainvision.read_markers(self.vmrk))
+
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.codes(), [-1, 1, 12])
+        np.testing.assert_array_equal(index.markers['position'], [0, 2, 4, 6, 8])
+        np.testing.assert_array_equal(index.find(code=12)['position'], [4, 8])
+        np.testing.assert_array_equal(index.find(code=1)['position'], [2, 6])
+        np.testing.assert_array_equal(index.find(code=1, kind='stimulus')['position'], [2])
+        np.testing.assert_array_equal(index.find(start=2, stop=6)['position'], [2, 4])
+        np.testing.assert_array_equal(index.find(code=12, start=5)['position'], [8])
+        self.assertEqual(len(index.find(code=99)), 0)
+
+    def test_cache(self):
+        first = brainvision.MarkerIndex.load(self.vmrk)
+        self.assertTrue(os.path.isfile(self.vmrk + '.npz'))
+
+        with mock.patch.object(brainvision, 'read_markers') as read_markers:
+            cached = brainvision.MarkerIndex.load(self.vmrk)
+        read_markers.assert_not_called()
+        np.testing.assert_array_equal(cached.markers, first.markers)
+
+        # A new modification time with the same size invalidates the cache
+        stat = os.stat(self.vmrk)
+        os.utime(self.vmrk, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with mock.patch.object(brainvision, 'read_markers',
+                               wraps=brainvision.read_markers) as read_markers:
+            brainvision.MarkerIndex.load(self.vmrk)
+        read_markers.assert_called_once_with(self.vmrk)
+
+        # So does a new size, even with the same modification time
+        stat = os.stat(self.vmrk)
+        with open(self.vmrk, 'a', encoding='utf-8') as vmrk_file:
+            vmrk_file.write('Mk6=Stimulus,S  2,10,1,0\n')
+        os.utime(self.vmrk, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(brainvision.MarkerIndex.load(self.vmrk).codes(), [-1, 1, 2, 12])
+
+
+class TestPhotodiodeLatency(unittest.TestCase):
+    def setUp(self):
+        # 1000 Hz, the patch is on for 16 ms every 2.5 s (0.64% of samples) and when the
+        # recording starts, with noise and one spike
+        rng = np.random.default_rng(0)
+        self.signal = rng.normal(100, 5, 60000)
+        self.onsets = np.arange(500, 60000, 2500)
+        for onset in np.concatenate(([0], self.onsets)):
+            self.signal[onset:onset + 16] = 1000 + rng.normal(0, 5, 16)
+        self.signal[1200] = 50000
+
+    def test_threshold(self):
+        threshold = photodiode_latency._threshold(self.signal)
+        self.assertGreater(threshold, 200)
+        self.assertLess(threshold, 900)
+
+    def test_detect_onsets(self):
+        onsets = photodiode_latency.detect_onsets(self.signal, min_gap=10)
+        # No onset at 0, and the spike is the only extra onset
+        np.testing.assert_array_equal(onsets, np.sort(np.append(self.onsets, 1200)))
+
+        # The same across chunk boundaries, and for an inverted signal
+        without_spike = self.signal.copy()
+        without_spike[1200] = 100
+        chunked = photodiode_latency.detect_onsets(without_spike, min_gap=10, chunk_size=777)
+        np.testing.assert_array_equal(chunked, self.onsets)
+        inverted = photodiode_latency.detect_onsets(-without_spike, min_gap=10, invert=True)
+        np.testing.assert_array_equal(inverted, self.onsets)
+
+    def test_min_gap(self):
+        signal = np.zeros(100)
+        signal[10:20] = 1
+        signal[22:30] = 1  # A 2 sample dip is noise
+        signal[50:60] = 1
+
+        np.testing.assert_array_equal(
+            photodiode_latency.detect_onsets(signal, 0.5, min_gap=5), [10, 50])
+        np.testing.assert_array_equal(
+            photodiode_latency.detect_onsets(signal, 0.5, min_gap=1), [10, 22, 50])
+
+    def test_pair_markers(self):
+        rows = [('New Segment', '', -1, 0, 1, 0),
+                ('Stimulus', 'S  1', 1, 470, 1, 0),  # 30 ms before the onset at 500
+                ('Response', 'R  1', 1, 2990, 1, 0),
+                ('Stimulus', 'S  2', 2, 2995, 1, 0),
+                ('Stimulus', 'S  2', 2, 4000, 1, 0)]  # No onset in the window
+        markers = np.array(rows, dtype=brainvision.MARKER_DTYPE)
+        onsets = np.array([500, 3000, 5500])
+
+        pairs = photodiode_latency.pair_markers(markers, onsets, rate=1000)
+        np.testing.assert_array_equal(pairs['code'], [1, 2, 2])
+        np.testing.assert_array_equal(pairs['latency'], [30, 5, np.nan])
+
+        # At 500 Hz a sample lasts 2 ms
+        pairs = photodiode_latency.pair_markers(markers, onsets, rate=500, codes=[2])
+        np.testing.assert_array_equal(pairs['latency'], [10, np.nan])
+
+        report = photodiode_latency.latency_report(
+            photodiode_latency.pair_markers(markers, onsets, rate=1000))
+        self.assertEqual([(row['code'], row['n'], row['missing']) for row in report],
+                         [(1, 1, 0), (2, 2, 1)])
+        self.assertEqual(report[1]['median'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
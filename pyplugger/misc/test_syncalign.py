@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import syncalign
+
+
+class TestSyncAlign(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.asc')
+
+        # 2000 Hz, so every other timestamp ends in .5, and x = the sample index
+        with open(self.filename, 'w') as asc_file:
+            for i in range(100):
+                time = 1000 + i / 2
+                if i == 20:
+                    asc_file.write('MSG\t1010 SYNC 3\n')
+                if i == 60:  # Sent with an offset after the next message was sent
+                    asc_file.write('MSG\t1030 15 SYNC 4\n')
+                    asc_file.write('MSG\t1030.5 SYNC 5\n')
+                asc_file.write('%g\t  %.1f\t  500.0\t 1000.0\t...\n' % (time, i))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_sync_messages(self):
+        times, codes = syncalign.read_sync_messages(self.filename)
+
+        np.testing.assert_array_equal(times, [1010, 1015, 1030.5])
+        np.testing.assert_array_equal(codes, [3, 4, 5])
+
+    def test_resample_gaze(self):
+        # One EEG sample per tracker sample, starting at tracker time 1000
+        fit = {'slope': 2.0, 'intercept': -2000.0}
+        gaze = syncalign.resample_gaze(self.filename, fit, 100)
+
+        np.testing.assert_array_equal(gaze[:, 0], np.arange(100))
+        np.testing.assert_array_equal(gaze[:, 2], 1000)
+
+    def test_align_codes(self):
+        # Codes cycle through 1-8, as send_synced_event is used in the experiments
+        tracker = np.tile(np.arange(1, 9), 3)
+        eeg = np.delete(tracker, 5)  # A trigger the EEG missed
+        eeg = np.insert(eeg, 12, 9)  # And two extra ones, in the middle and at the start
+        eeg = np.insert(eeg, 0, 2)
+
+        i, j = syncalign.align_codes(tracker, eeg)
+
+        np.testing.assert_array_equal(i, np.delete(np.arange(24), 5))
+        np.testing.assert_array_equal(j, np.delete(np.arange(1, 25), 12))
+        np.testing.assert_array_equal(tracker[i], eeg[j])
+
+        # Nothing to match
+        i, j = syncalign.align_codes([], eeg)
+        self.assertEqual((len(i), len(j)), (0, 0))
+
+    def test_fit_clock(self):
+        # 500 Hz, the EEG clock runs 50 ppm fast, with some jitter and two wrong pairs
+        rng = np.random.default_rng(0)
+        tracker_times = np.arange(1000, 601000, 2500.0)
+        slope = 0.5 * (1 + 50e-6)
+        eeg_samples = np.round(slope * tracker_times + 1234 + rng.normal(0, 0.2, 240))
+        eeg_samples[[30, 200]] += [40, -25]
+
+        fit = syncalign.fit_clock(tracker_times, eeg_samples)
+
+        np.testing.assert_array_equal(np.flatnonzero(~fit['inliers']), [30, 200])
+        self.assertAlmostEqual((fit['slope'] / 0.5 - 1) * 1e6, 50, delta=2)  # Drift in ppm
+        self.assertAlmostEqual(fit['intercept'], 1234, delta=0.5)
+        self.assertLess(np.abs(fit['residuals'][fit['inliers']]).max(), 1)
+
+        # A fixed limit, and the pairs needed for a fit
+        fit = syncalign.fit_clock(tracker_times, eeg_samples, max_residual=30)
+        np.testing.assert_array_equal(np.flatnonzero(~fit['inliers']), [30])
+        with self.assertRaises(ValueError):
+            syncalign.fit_clock([1000], [500])
+
+
+if __name__ == '__main__':
+    unittest.main()
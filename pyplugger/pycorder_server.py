@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""A local stand-in for pycorder in remote mode, for testing pyplugger without the EEG system.
+
+The server accepts one connection at a time and understands the messages pyplugger sends:
+
+'1<config file>' -- load a configuration
+'2<experiment name>' -- set the experiment name
+'3<subject number>' -- set the subject number
+'4' -- apply the settings
+'M', 'I', 'T' -- switch to monitoring, impedance or test mode
+'S' -- start saving (only possible in monitoring mode)
+'Q' -- stop saving
+'X' -- stop saving and leave the current mode
+
+Like pycorder, messages are not delimited, so every received chunk is one message. The only
+exception is a chunk of single letter commands (e.g. 'MS' sent without a delay), which is split
+into its letters. Every message is stored with a time.perf_counter_ns() timestamp, and messages
+that pycorder would not accept (e.g. 'S' outside of monitoring mode) are added to errors.
+
+Run this script to print the messages of an experiment as they arrive:
+python pycorder_server.py --port 6700
+
+Classes:
+PyCorderServer -- Listens for pyplugger connections on a background thread.
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+
+_modes = {'M': 'monitoring', 'I': 'impedance', 'T': 'test'}
+_settings = {'1': 'config_file', '2': 'experiment_name', '3': 'subject_number'}
+_single_commands = set('4MITSQX')
+
+
+class PyCorderServer:
+    """Listens for pyplugger connections on a background thread.
+
+    Attributes:
+    messages -- a list of (time.perf_counter_ns(), message) tuples in the order received
+    errors -- a list of strings describing messages pycorder would not accept
+    config_file, experiment_name, subject_number -- set by the 1, 2 and 3 messages
+    mode -- None, 'M', 'I' or 'T'
+    recording -- True while saving
+
+    Parameters:
+    host -- the address to listen on
+    port -- the port to listen on, 0 picks a free port (see the port attribute)
+    callback -- optionally, a function called with (timestamp, message) for every message
+    """
+    def __init__(self, host='127.0.0.1', port=6700, callback=None):
+        self.host = host
+        self.port = port
+        self.callback = callback
+        self.messages = []
+        self.errors = []
+        self.config_file = None
+        self.experiment_name = None
+        self.subject_number = None
+        self.mode = None
+        self.recording = False
+
+        self._server = None
+        self._thread = None
+        self._running = False
+        self._received = threading.Condition()
+
+    def start(self):
+        """Starts listening, returns once connections are accepted."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(1)
+        self._server.settimeout(0.1)
+        self.port = self._server.getsockname()[1]
+
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops listening and closes the connection."""
+        if not self._running:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._server.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def wait_for_messages(self, count, timeout=5):
+        """Waits until count messages have been received. Returns False on a timeout."""
+        with self._received:
+            return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def _serve(self):
+        while self._running:
+            try:
+                connection, _ = self._server.accept()
+            except socket.timeout:
+                continue
+
+            with connection:
+                connection.settimeout(0.1)
+                self._receive(connection)
+
+    def _receive(self, connection):
+        while self._running:
+            try:
+                chunk = connection.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            if not chunk:
+                return
+
+            timestamp = time.perf_counter_ns()
+            for message in _split(chunk.decode(errors='replace')):
+                self._handle(timestamp, message)
+
+    def _handle(self, timestamp, message):
+        command, value = message[0], message[1:]
+
+        if command in _settings:
+            setattr(self, _settings[command], value)
+        elif command in _modes:
+            self.recording = False
+            self.mode = command
+        elif command == 'S':
+            if self.mode != 'M':
+                self.errors.append('S received outside of monitoring mode.')
+            self.recording = self.mode == 'M'
+        elif command in ('Q', 'X'):
+            if not self.recording:
+                self.errors.append('%s received while not recording.' % command)
+            self.recording = False
+            if command == 'X':
+                self.mode = None
+        elif command != '4':
+            self.errors.append('Unknown message %r.' % message)
+
+        with self._received:
+            self.messages.append((timestamp, message))
+            self._received.notify_all()
+
+        if self.callback is not None:
+            self.callback(timestamp, message)
+
+
+def _split(chunk):
+    """Returns the messages in a received chunk."""
+    if all(c in _single_commands for c in chunk):
+        return list(chunk)
+    return [chunk]
+
+
+def main():
+    ap = argparse.ArgumentParser(description='A local stand-in for pycorder in remote mode.')
+    ap.add_argument('--host', default='127.0.0.1', help='The address to listen on.')
+    ap.add_argument('-p', '--port', type=int, default=6700, help='The port to listen on.')
+    args = vars(ap.parse_args())
+
+    start = time.perf_counter_ns()
+
+    def print_message(timestamp, message):
+        print('%10.3f s  %s' % ((timestamp - start) / 1e9, message))
+
+    server = PyCorderServer(args['host'], args['port'], callback=print_message)
+    server.start()
+    print('Listening on %s:%i. Press Ctrl+C to stop.' % (server.host, server.port))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+    for error in server.errors:
+        print('Error: ' + error)
+
+
+if __name__ == '__main__':
+    main()
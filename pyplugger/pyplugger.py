@@ -18,21 +18,37 @@ PyPlugger -- This is a factory function that returns either a ConnectedPyPlugger
 Classes:
 ConnectedPyPlugger -- Returned if a connection is possible. Provides high-level functionality
  through pycorder.
-MockPyPlugger-- Has the same attributes and methods as ConnectedPyPlugger, but all functions
- simply pass and no checks are made to the attributes. This makes it easier to debug the psychopy
- code if there is no connection.
+MockPyPlugger-- Has the same attributes and methods as ConnectedPyPlugger, but nothing is sent.
+ Triggers and remote commands are recorded with timestamps instead, so they can be checked
+ after a debug run. All other functions simply pass and no checks are made to the attributes.
+
+See pycorder_server.py for a local stand-in for pycorder, useful for testing a
+ ConnectedPyPlugger without the EEG system.
 """
 
 
+import select
 import socket
+import threading
 import time
 
 import psychopy.event
 import psychopy.parallel
 import psychopy.visual
 
+try:  # The session event log from the template directory is optional
+    import eventlog
+except ImportError:
+    eventlog = None
+
+
+def _log_event(event_type, code=0, payload=None):
+    """Writes an event to the session event log of the template experiments, if available."""
+    if eventlog is not None:
+        eventlog.log('pyplugger', event_type, code, payload)
+
 
-def _try_connection(tcp_ip, tcp_port):
+def _try_connection(tcp_ip, tcp_port, timeout=5):
     """Attempts to connect to pycorder.
 
     Returns a bool indicating if a connection was made and an exception if applicable.
@@ -41,12 +57,13 @@ def _try_connection(tcp_ip, tcp_port):
     Parameters:
     tcp_ip -- the ip address of the pycorder computer
     tcp_port -- the port to connect to, should always be 6700
+    timeout -- how long in seconds to wait for a connection
     """
     print('Attempting to connect to EEG system...')
     try:
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((tcp_ip, tcp_port))
-        return True, None
-    except socket.timeout as e:
+        with socket.create_connection((tcp_ip, tcp_port), timeout=timeout):
+            return True, None
+    except OSError as e:  # Includes timeouts and refused connections
         return False, e
 
 
@@ -85,15 +102,18 @@ def PyPlugger(window, config_file, tcp_ip="100.1.1.3",
     config_file -- A path to an xml config file created by pycorder on the pycorder computer
     tcp_ip -- the ip address of the pycorder computer
     tcp_port -- the port to connect to, should always be 6700
-    parallel_port_address -- the address of the parallel port as required by psychopy.parallel
+    parallel_port_address -- the address of the parallel port as required by psychopy.parallel,
+     or None to send no triggers (e.g. when testing with pycorder_server.py)
     text_color -- Defined using window color to black or white, but can be overwritten by
      providing a (r,g,b) tuple with values between -1 and 1
     """
+    kwargs = dict(tcp_ip=tcp_ip, tcp_port=tcp_port, parallel_port_address=parallel_port_address,
+                  text_color=text_color)
+
     connected, e = _try_connection(tcp_ip, tcp_port)
 
     if connected:
-        return ConnectedPyPlugger(window, config_file, tcp_ip="100.1.1.3",
-                                  tcp_port=6700, parallel_port_address=53328, text_color=None)
+        return ConnectedPyPlugger(window, config_file, **kwargs)
     else:
         _display_not_connected_text(window)
 
@@ -103,8 +123,7 @@ def PyPlugger(window, config_file, tcp_ip="100.1.1.3",
         connected, e = _try_connection(tcp_ip, tcp_port)
         if connected:
             window.flip()
-            return ConnectedPyPlugger(window, config_file, tcp_ip="100.1.1.3",
-                                      tcp_port=6700, parallel_port_address=53328, text_color=None)
+            return ConnectedPyPlugger(window, config_file, **kwargs)
         else:
             print('Could not connect, select again.')
             response = _get_connection_failure_response()
@@ -115,8 +134,7 @@ def PyPlugger(window, config_file, tcp_ip="100.1.1.3",
     elif response == 'd':
         window.flip()
         print('Continuing with mock eeg. EEG data will not be saved!')
-        return MockPyPlugger(window, config_file, tcp_ip="100.1.1.3",
-                             tcp_port=6700, parallel_port_address=53328, text_color=None)
+        return MockPyPlugger(window, config_file, **kwargs)
 
 
 class ConnectedPyPlugger:
@@ -127,12 +145,23 @@ class ConnectedPyPlugger:
         self.config_file = config_file
         self.tcp_ip = tcp_ip
         self.tcp_port = tcp_port
+        self.parallel_port_address = parallel_port_address
         self.current_mode = None
         self.socket = None
         self.mock = False
+        self.max_buffered = 100
+
+        self._link_lock = threading.Lock()
+        self._buffered = None  # A list of (time, command) while the connection is down
+
+        self.photodiode_onsets = []
+        self._photodiode = None
+        self._photodiode_settings = None
+        self._photodiode_mark = None
 
-        psychopy.parallel.setPortAddress(parallel_port_address)
-        psychopy.parallel.setData(0)
+        if parallel_port_address is not None:
+            psychopy.parallel.setPortAddress(parallel_port_address)
+            psychopy.parallel.setData(0)
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -142,13 +171,14 @@ class ConnectedPyPlugger:
         else:
             self.text_color = text_color
 
-    def initialize_session(self, experiment_name, subject_number, timeout=5):
+    def initialize_session(self, experiment_name, subject_number, timeout=5, delay=1):
         """Sets up the socket connection.
 
         Parameters:
         experiment_name -- the name of the experiment to be used in the filename
         subject_number -- the subject number to be used in the filename
         timeout -- an int describing how long in seconds to wait for a connection
+        delay -- how long to wait after sending each message
         """
         messages = ['1' + self.config_file,
                     '2' + str(experiment_name),
@@ -160,8 +190,8 @@ class ConnectedPyPlugger:
         self.socket.connect((self.tcp_ip, self.tcp_port))
 
         for tcp_message in messages:
-            self.socket.send(tcp_message.encode())
-            time.sleep(1)
+            self._send(tcp_message)
+            time.sleep(delay)
 
     def switch_mode(self, mode, delay=5):
         """Switches between recording modes.
@@ -170,7 +200,7 @@ class ConnectedPyPlugger:
         mode -- A string containing the mode, "M" for monitoring or "I" for impedance
         delay -- how long to wait after sending the command
         """
-        self.socket.send(mode.encode())
+        self._send(mode)
         self.current_mode = mode
         time.sleep(delay)
 
@@ -182,7 +212,7 @@ class ConnectedPyPlugger:
         Parameters:
         delay -- how long to wait after sending the command
         """
-        self.socket.send("S".encode())
+        self._send('S')
         time.sleep(delay)  # Ensure recording has started
 
     def stop_recording(self, delay=5, exit_mode=False):
@@ -197,27 +227,102 @@ class ConnectedPyPlugger:
         else:
             cmd = 'Q'
 
-        self.socket.send(cmd.encode())
+        self._send(cmd)
         time.sleep(delay)  # Ensure recording has ended
 
-    @staticmethod
-    def start_event(event):
+    def _send(self, command):
+        """Sends a command to pycorder, or buffers it if the connection is down."""
+        _log_event('command', payload=command)
+        with self._link_lock:
+            if self._buffered is None:
+                try:
+                    self.socket.send(command.encode())
+                    return
+                except OSError:  # The connection dropped
+                    self._buffered = []
+
+            if len(self._buffered) >= self.max_buffered:
+                print('Warning: EEG connection down too long, dropping buffered command.')
+                self._buffered.pop(0)
+            self._buffered.append((time.perf_counter(), command))
+
+    @property
+    def buffering(self):
+        """True while commands are buffered because the connection is down."""
+        return self._buffered is not None
+
+    def is_connected(self):
+        """A cheap check of the connection to pycorder, used as a heartbeat.
+
+        Detects connections closed by pycorder without sending anything.
+        """
+        if self.socket is None:
+            return False
+
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            if readable and not self.socket.recv(1, socket.MSG_PEEK):
+                return False  # Closed by pycorder
+        except OSError:
+            return False
+
+        return True
+
+    def start_buffering(self):
+        """Buffers commands instead of sending them, until reconnect is called."""
+        with self._link_lock:
+            if self._buffered is None:
+                self._buffered = []
+
+    def reconnect(self, timeout=5, delay=1):
+        """Opens a new connection to pycorder and sends the buffered commands in order.
+
+        pycorder does not timestamp commands, so they take effect when they are replayed. Raises
+        OSError if pycorder cannot be reached. Returns the number of commands that were sent.
+
+        Parameters:
+        timeout -- how long in seconds to wait for a connection
+        delay -- how long to wait after sending each buffered command
+        """
+        connection = socket.create_connection((self.tcp_ip, self.tcp_port), timeout=timeout)
+
+        with self._link_lock:
+            if self.socket is not None:
+                self.socket.close()
+            self.socket = connection
+
+            buffered, self._buffered = self._buffered or [], None
+            for sent, command in buffered:
+                print('Sending EEG command %r, delayed by %.1f s.'
+                      % (command, time.perf_counter() - sent))
+                connection.send(command.encode())
+                time.sleep(delay)
+
+        return len(buffered)
+
+    def start_event(self, event):
         """Sends an event to the parallel port.
 
+        Does nothing if parallel_port_address is None.
+
         Parameters:
         event -- data describing how pins should be set, see parallel docs for details
         """
-        psychopy.parallel.setData(event)
+        if self.parallel_port_address is not None:
+            psychopy.parallel.setData(event)
+        _log_event('trigger', event)
 
-    @staticmethod
-    def end_event():
+    def end_event(self):
         """Resets the parallel port to 0.
 
         To be called some time after an event has been sent. Not strictly necessary if all that
         matters is the start of your events."""
-        psychopy.parallel.setData(0)
+        if self.parallel_port_address is not None:
+            psychopy.parallel.setData(0)
+        _log_event('trigger', 0)
 
-    def draw_photodiode_stimuli(self, color=(1.0, 1.0, 1.0), radius=20, x=None, y=None):
+    def _photodiode_patch(self, color=(1.0, 1.0, 1.0), radius=20, x=None, y=None):
+        """Returns the photodiode patch, created once and only changed if the settings change."""
         # top right corner, because (0,0) is window center
         if x is None:
             x = self.window.size[0] / 2 - 30
@@ -225,8 +330,46 @@ class ConnectedPyPlugger:
         if y is None:
             y = self.window.size[1] / 2 - 30
 
-        psychopy.visual.Circle(self.window, fillColor=color, radius=radius, pos=(x, y),
-                               lineWidth=0, units='pix').draw()
+        settings = (tuple(color), radius, x, y)
+        if self._photodiode is None:
+            self._photodiode = psychopy.visual.Circle(self.window, fillColor=color, radius=radius,
+                                                      pos=(x, y), lineWidth=0, units='pix')
+        elif settings != self._photodiode_settings:
+            self._photodiode.fillColor = color
+            self._photodiode.radius = radius
+            self._photodiode.pos = (x, y)
+        self._photodiode_settings = settings
+
+        return self._photodiode
+
+    def draw_photodiode_stimuli(self, color=(1.0, 1.0, 1.0), radius=20, x=None, y=None):
+        """Draws the photodiode patch once, for the next flip.
+
+        See mark_next_flip for a patch that is synced with a trigger and drawn automatically.
+        """
+        self._photodiode_patch(color, radius, x, y).draw()
+
+    def mark_next_flip(self, code=None, flips=1, color=(1.0, 1.0, 1.0), radius=20, x=None,
+                       y=None):
+        """Shows the photodiode patch from the next flip on and sends a trigger with that flip.
+
+        The patch is drawn automatically for the given number of flips. The trigger is sent
+        with window.callOnFlip, right after the flip that shows the patch, and reset to 0 right
+        after the first flip without the patch, so it is held as long as the patch is shown.
+        Each onset is added to photodiode_onsets as a (time.perf_counter_ns(), code) tuple, to
+        be compared with the photodiode channel of the EEG recording later.
+
+        A new mark replaces one that has not finished: the patch stays on for the new number of
+        flips, and the trigger is reset once, at the end of the new mark.
+
+        Parameters:
+        code -- the trigger code, or None to only show the patch
+        flips -- for how many flips the patch is shown
+        color, radius, x, y -- see draw_photodiode_stimuli
+        """
+        patch = self._photodiode_patch(color, radius, x, y)
+        patch.autoDraw = True
+        self._photodiode_mark = _PhotodiodeMark(self, patch, code, flips, self._photodiode_mark)
 
     def display_eeg_instructions(self, eeg_instruction_text=None):
         """Displays a window with some generic EEG instructions.
@@ -284,25 +427,104 @@ class ConnectedPyPlugger:
 
 
 # Creates a mock object to be used if tracker doesn't connect for debug purposes
+# Private methods are left out, so they cannot replace the ones of MockPyPlugger (e.g. _send)
+class _PhotodiodeMark:
+    """Removes the photodiode patch after a number of flips and holds the trigger meanwhile.
+
+    Every step runs right after a flip, with window.callOnFlip.
+
+    Parameters:
+    plugger -- the ConnectedPyPlugger or MockPyPlugger sending the triggers
+    patch -- the patch, already drawn automatically, or None if nothing is drawn
+    code -- the trigger code, or None to only show the patch
+    flips -- for how many flips the patch is shown
+    previous -- the mark this one replaces, cancelled if it has not finished
+    """
+    def __init__(self, plugger, patch, code, flips, previous=None):
+        self.plugger = plugger
+        self.patch = patch
+        self.code = code
+        self.flips = max(1, flips)
+        self.shown = 0
+        self.cancelled = False
+        self.done = False
+        self.end_event = code is not None
+
+        if previous is not None and not previous.done:
+            previous.cancelled = True
+            # A trigger sent by the previous mark is reset by this one
+            self.end_event = self.end_event or previous.end_event
+
+        plugger.window.callOnFlip(self._onset)
+
+    def _onset(self):
+        if self.cancelled:
+            return
+
+        onset = time.perf_counter_ns()
+        if self.code is not None:
+            self.plugger.start_event(self.code)
+        self.plugger.photodiode_onsets.append((onset, self.code))
+        self._flipped()
+
+    def _flipped(self):
+        if self.cancelled:
+            return
+
+        if self.shown < self.flips:  # The patch was shown in this flip
+            self.shown += 1
+            if self.shown == self.flips and self.patch is not None:
+                self.patch.autoDraw = False
+            self.plugger.window.callOnFlip(self._flipped)
+            return
+
+        self.done = True
+        if self.end_event:
+            self.plugger.end_event()
+
+
 method_list = [fn_name for fn_name in dir(ConnectedPyPlugger)
-               if callable(getattr(ConnectedPyPlugger, fn_name)) and not fn_name.startswith("__")]
+               if callable(getattr(ConnectedPyPlugger, fn_name)) and not fn_name.startswith("_")]
 
 
 def _mock_func(*args, **kwargs):
     pass
 
 
+# Methods the MockPyPlugger records instead of ignoring
+_recorded_methods = ['initialize_session', 'switch_mode', 'start_recording', 'stop_recording',
+                     'start_event', 'end_event', 'mark_next_flip']
+
+
 class MockPyPlugger:
-    """Returned if a connection could not be made, useful for debugging away from the trackers."""
+    """Returned if a connection could not be made, useful for debugging away from the trackers.
+
+    Instead of being sent, triggers and pycorder commands are recorded:
+    triggers -- a list of (time.perf_counter_ns(), code) tuples, one for every start_event and
+     end_event (code 0) call
+    commands -- a list of (time.perf_counter_ns(), message) tuples with the messages that would
+     have been sent to pycorder, e.g. '2experiment_name' or 'S'
+    photodiode_onsets -- a list of (time.perf_counter_ns(), code) tuples, one for the flip after
+     every mark_next_flip call. The patch itself is not drawn, but its trigger is reset (code 0
+     in triggers) when the patch would be removed, like in ConnectedPyPlugger.
+
+    None of the delays are used, so the experiment runs at full speed.
+    """
     def __init__(self, window, config_file, tcp_ip="100.1.1.3",
                  tcp_port=6700, parallel_port_address=53328, text_color=None):
         self.window = window
         self.config_file = config_file
         self.tcp_ip = tcp_ip
         self.tcp_port = tcp_port
+        self.parallel_port_address = parallel_port_address
         self.current_mode = None
         self.socket = None
         self.mock = True
+        self.buffering = False
+        self.triggers = []
+        self.commands = []
+        self.photodiode_onsets = []
+        self._photodiode_mark = None
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -314,3 +536,36 @@ class MockPyPlugger:
 
         for fn_name in method_list:
             setattr(self, fn_name, _mock_func)
+
+        for fn_name in _recorded_methods:
+            setattr(self, fn_name, getattr(self, '_record_' + fn_name))
+
+    def _send(self, message):
+        self.commands.append((time.perf_counter_ns(), message))
+        _log_event('command', payload=message)
+
+    def _record_initialize_session(self, experiment_name, subject_number, *args, **kwargs):
+        for message in ['1' + self.config_file, '2' + str(experiment_name),
+                        '3' + str(subject_number), '4']:
+            self._send(message)
+
+    def _record_switch_mode(self, mode, *args, **kwargs):
+        self._send(mode)
+        self.current_mode = mode
+
+    def _record_start_recording(self, *args, **kwargs):
+        self._send('S')
+
+    def _record_stop_recording(self, delay=5, exit_mode=False):
+        self._send('X' if exit_mode else 'Q')
+
+    def _record_start_event(self, event):
+        self.triggers.append((time.perf_counter_ns(), event))
+        _log_event('trigger', event)
+
+    def _record_end_event(self):
+        self.triggers.append((time.perf_counter_ns(), 0))
+        _log_event('trigger', 0)
+
+    def _record_mark_next_flip(self, code=None, flips=1, *args, **kwargs):
+        self._photodiode_mark = _PhotodiodeMark(self, None, code, flips, self._photodiode_mark)
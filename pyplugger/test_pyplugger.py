@@ -0,0 +1,155 @@
+import unittest
+from unittest import mock
+
+import pycorder_server
+import pyplugger
+
+
+class _FakeWindow:
+    """Draws autoDraw stimuli, flips and then calls the callOnFlip functions, like psychopy."""
+    def __init__(self):
+        self.color = (0.0, 0.0, 0.0)
+        self.size = (800, 600)
+        self.flips = 0
+        self.drawn = []  # The flip number of every flip that showed an autoDraw stimulus
+        self.stimuli = []
+        self._on_flip = []
+
+    def callOnFlip(self, function, *args):
+        self._on_flip.append((function, args))
+
+    def flip(self, clearBuffer=True):
+        self.flips += 1
+        if any(stimulus.autoDraw for stimulus in self.stimuli):
+            self.drawn.append(self.flips)
+
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args in on_flip:
+            function(*args)
+
+
+class _FakeCircle:
+    def __init__(self, window, **kwargs):
+        self.autoDraw = False
+        window.stimuli.append(self)
+
+
+class TestMockPyPlugger(unittest.TestCase):
+    def setUp(self):
+        self.window = _FakeWindow()
+        self.eeg = pyplugger.MockPyPlugger(self.window, 'config.xml')
+
+    def test_commands(self):
+        self.eeg.initialize_session('experiment', 3)
+        self.eeg.switch_mode('M')
+        self.eeg.start_recording()
+        self.eeg.stop_recording(exit_mode=True)
+
+        self.assertEqual([message for _, message in self.eeg.commands],
+                         ['1config.xml', '2experiment', '33', '4', 'M', 'S', 'X'])
+        self.assertEqual(self.eeg.current_mode, 'M')
+
+    def test_triggers(self):
+        self.eeg.start_event(12)
+        self.eeg.end_event()
+        self.eeg.mark_next_flip(5)
+        self.window.flip()
+        self.assertEqual([code for _, code in self.eeg.triggers], [12, 0, 5])
+
+        self.window.flip()  # The patch would be removed, so the trigger is reset
+        self.assertEqual([code for _, code in self.eeg.triggers], [12, 0, 5, 0])
+        self.assertEqual([code for _, code in self.eeg.photodiode_onsets], [5])
+
+
+class TestMarkNextFlip(unittest.TestCase):
+    def setUp(self):
+        self.window = _FakeWindow()
+        self.eeg = pyplugger.ConnectedPyPlugger(self.window, 'config.xml',
+                                                parallel_port_address=None)
+        self.triggers = []  # (flip number, code)
+        self.eeg.start_event = lambda code: self.triggers.append((self.window.flips, code))
+        self.eeg.end_event = lambda: self.triggers.append((self.window.flips, 0))
+
+        patcher = mock.patch('psychopy.visual.Circle', _FakeCircle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _flip(self, n):
+        for _ in range(n):
+            self.window.flip()
+
+    def test_one_flip(self):
+        self.eeg.mark_next_flip(5)
+        self._flip(4)
+
+        # Shown in flip 1, the trigger is held until after flip 2 (the first without the patch)
+        self.assertEqual(self.window.drawn, [1])
+        self.assertEqual(self.triggers, [(1, 5), (2, 0)])
+        self.assertEqual([code for _, code in self.eeg.photodiode_onsets], [5])
+
+    def test_several_flips(self):
+        self.eeg.mark_next_flip(7, flips=3)
+        self._flip(6)
+
+        self.assertEqual(self.window.drawn, [1, 2, 3])
+        self.assertEqual(self.triggers, [(1, 7), (4, 0)])
+
+    def test_no_code(self):
+        self.eeg.mark_next_flip(flips=2)
+        self._flip(4)
+
+        self.assertEqual(self.window.drawn, [1, 2])
+        self.assertEqual(self.triggers, [])
+        self.assertEqual([code for _, code in self.eeg.photodiode_onsets], [None])
+
+    def test_replaced_mark(self):
+        self.eeg.mark_next_flip(5, flips=3)
+        self._flip(1)
+        self.eeg.mark_next_flip(6, flips=3)
+        self._flip(6)
+
+        # The second patch is shown for its full 3 flips and the trigger is reset once
+        self.assertEqual(self.window.drawn, [1, 2, 3, 4])
+        self.assertEqual(self.triggers, [(1, 5), (2, 6), (5, 0)])
+
+    def test_replaced_by_mark_without_code(self):
+        self.eeg.mark_next_flip(5, flips=2)
+        self._flip(1)
+        self.eeg.mark_next_flip(flips=1)
+        self._flip(3)
+
+        # The trigger of the first mark is still reset
+        self.assertEqual(self.window.drawn, [1, 2])
+        self.assertEqual(self.triggers, [(1, 5), (3, 0)])
+
+
+class TestConnectedPyPlugger(unittest.TestCase):
+    def setUp(self):
+        self.server = pycorder_server.PyCorderServer(port=0)
+        self.server.start()
+        self.eeg = pyplugger.ConnectedPyPlugger(
+            _FakeWindow(), 'config.xml', tcp_ip='127.0.0.1', tcp_port=self.server.port,
+            parallel_port_address=None)
+
+    def tearDown(self):
+        if self.eeg.socket is not None:
+            self.eeg.socket.close()
+        self.server.stop()
+
+    def test_session(self):
+        self.eeg.initialize_session('experiment', 3, delay=0.05)
+        self.eeg.switch_mode('M', delay=0.05)
+        self.eeg.start_recording(delay=0.05)
+        self.eeg.stop_recording(delay=0.05, exit_mode=True)
+
+        self.assertTrue(self.server.wait_for_messages(7))
+        self.assertEqual([message for _, message in self.server.messages],
+                         ['1config.xml', '2experiment', '33', '4', 'M', 'S', 'X'])
+        self.assertEqual(self.server.errors, [])
+        self.assertEqual((self.server.config_file, self.server.experiment_name,
+                          self.server.subject_number), ('config.xml', 'experiment', '3'))
+        self.assertFalse(self.server.recording)
+
+
+if __name__ == '__main__':
+    unittest.main()
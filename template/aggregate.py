@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""Combines the data files written by BaseExperiment into a single dataset.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+Every session of an experiment built on BaseExperiment leaves behind an
+experimentname_subjectnumber.csv file (open_csv_data_file) and an
+experimentname_subjectnumber_info.json file (save_experiment_info). When a file
+already exists and cannot be overwritten, a (1), (2), ... suffix is added. This
+script finds those files, reads them in parallel, adds the fields from the info
+file to every trial row and writes everything to one parquet file.
+
+A session that was restarted for the same participant shows up as several
+suffixed files sharing a 'Unique Subject Identifier'. Only one of those files
+is kept (the most recent one by default). Files with different identifiers are
+always kept, as they belong to different participants.
+
+A manifest is written next to the output so that rerunning the script only
+reads files that are new or have changed since the last run. Pickle files are
+crash recovery files and are not read.
+
+pandas is installed with psychopy. Writing parquet files also needs pyarrow (or
+fastparquet), which is not: pip install pyarrow.
+
+Functions:
+aggregate -- Builds (or updates) the combined dataset.
+find_sessions -- Finds the csv files and pairs them with their info files.
+main -- Command line entry point.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import importlib.util
+import json
+import os
+import re
+
+import pandas as pd
+
+
+_csv_pattern = re.compile(r'^(?P<base>.+?)(?:\((?P<copy>[0-9]+)\))?\.csv$')
+
+
+def _signature(path):
+    """Returns a (size, mtime) pair used to tell if a file has changed."""
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _find_info_file(directory, base, copy):
+    """Returns the info file belonging to a csv file, or None if there is none.
+
+    The suffix of the info file is chosen separately from the suffix of the csv file, but both
+     are normally created during the same session so they match. Only the info file with the
+     same suffix is used, as an info file with another suffix belongs to another session.
+    """
+    if copy:
+        filename = base + '_info(' + str(copy) + ').json'
+    else:
+        filename = base + '_info.json'
+
+    path = os.path.join(directory, filename)
+    return path if os.path.isfile(path) else None
+
+
+def _require_parquet():
+    """Raises ImportError if pandas has no parquet engine to write with."""
+    if not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+        raise ImportError('Writing parquet files requires pyarrow (pip install pyarrow) or '
+                          'fastparquet.')
+
+
+def find_sessions(directory, experiment_name=None, keep='last'):
+    """Finds the csv files and pairs them with their info files.
+
+    Returns a list of dictionaries with the keys 'csv', 'info' and 'experiment_info'.
+
+    Parameters:
+    directory -- the directory containing the data files
+    experiment_name -- if given, only files starting with this name are used
+    keep -- 'last' or 'first', which of several files with the same
+        'Unique Subject Identifier' should be used
+    """
+    if keep not in ('first', 'last'):
+        raise ValueError('keep must be set to first or last.')
+
+    pattern = '*.csv' if experiment_name is None else experiment_name + '_*.csv'
+
+    sessions = {}
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        match = _csv_pattern.match(os.path.basename(path))
+        base = match.group('base')
+        copy = int(match.group('copy') or 0)
+
+        info_path = _find_info_file(directory, base, copy)
+        if info_path is None:
+            experiment_info = {}
+        else:
+            with open(info_path) as info_file:
+                experiment_info = json.loads(info_file.read())
+
+        # Without an identifier there is no way to tell restarts apart, so every file is kept
+        identifier = experiment_info.get('Unique Subject Identifier', path)
+        key = (base, identifier)
+
+        if key in sessions:
+            previous_copy = sessions[key]['copy']
+            if (keep == 'last') != (copy > previous_copy):
+                continue
+
+        sessions[key] = {
+            'csv': path, 'info': info_path, 'copy': copy, 'experiment_info': experiment_info
+        }
+
+    return sorted(sessions.values(), key=lambda session: session['csv'])
+
+
+def _read_session(session):
+    """Reads one csv file and adds the info fields as columns."""
+    data = pd.read_csv(session['csv'], na_values=['NA'], keep_default_na=False)
+
+    for field, value in session['experiment_info'].items():
+        if field not in data.columns:
+            data[field] = value
+
+    data['source_file'] = os.path.basename(session['csv'])
+
+    return data
+
+
+def _load_manifest(manifest_filename):
+    try:
+        with open(manifest_filename) as manifest_file:
+            return json.loads(manifest_file.read())
+    except FileNotFoundError:
+        return {}
+
+
+def _make_columns_writable(dataset):
+    """Casts mixed type columns to strings so they can be stored in a single typed column."""
+    for column in dataset.columns:
+        if dataset[column].dtype == object:
+            not_null = dataset[column].notna()
+            dataset.loc[not_null, column] = dataset.loc[not_null, column].astype(str)
+
+    return dataset
+
+
+def aggregate(directory, output, experiment_name=None, keep='last', workers=None, full=False):
+    """Builds (or updates) the combined dataset.
+
+    Returns the combined pandas.DataFrame and the number of csv files that had to be read.
+
+    Parameters:
+    directory -- the directory containing the data files
+    output -- the parquet file to write
+    experiment_name -- if given, only files starting with this name are used
+    keep -- 'last' or 'first', see find_sessions
+    workers -- the number of processes used to read files (defaults to the number of cpus)
+    full -- if True, the manifest is ignored and every file is read again
+    """
+    _require_parquet()
+
+    manifest_filename = output + '.manifest.json'
+    manifest = {} if full or not os.path.isfile(output) else _load_manifest(manifest_filename)
+
+    sessions = find_sessions(directory, experiment_name=experiment_name, keep=keep)
+
+    new_manifest = {}
+    unchanged = []
+    to_read = []
+    for session in sessions:
+        name = os.path.basename(session['csv'])
+        signature = [_signature(session['csv']), _signature(session['info'])]
+        new_manifest[name] = signature
+
+        if manifest.get(name) == signature:
+            unchanged.append(name)
+        else:
+            to_read.append(session)
+
+    frames = []
+    if unchanged:
+        previous = pd.read_parquet(output)
+        frames.append(previous[previous['source_file'].isin(unchanged)])
+
+    if to_read:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            frames.extend(executor.map(_read_session, to_read))
+
+    if frames:
+        dataset = pd.concat(frames, ignore_index=True, sort=False)
+    else:
+        dataset = pd.DataFrame({'source_file': []})
+
+    dataset = _make_columns_writable(dataset)
+    dataset.to_parquet(output, index=False)
+
+    with open(manifest_filename, 'w') as manifest_file:
+        manifest_file.write(json.dumps(new_manifest))
+
+    return dataset, len(to_read)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Combines experiment csv and info files.')
+    ap.add_argument('directory', help='The directory containing the data files.')
+    ap.add_argument('-o', '--output', default='combined.parquet', help='The file to write.')
+    ap.add_argument('-e', '--experiment', help='Only use files from this experiment.')
+    ap.add_argument(
+        '-k', '--keep', default='last', choices=['first', 'last'],
+        help='Which session to keep when a Unique Subject Identifier appears more than once.'
+    )
+    ap.add_argument('-j', '--workers', type=int, help='The number of files to read at once.')
+    ap.add_argument('--full', help='Read every file again.', action='store_true')
+
+    args = vars(ap.parse_args())
+
+    dataset, files_read = aggregate(
+        args['directory'], args['output'], experiment_name=args['experiment'],
+        keep=args['keep'], workers=args['workers'], full=args['full']
+    )
+
+    print('Read %i new or changed files.' % files_read)
+    print('Wrote %i rows to %s.' % (len(dataset), args['output']))
+
+
+if __name__ == '__main__':
+    main()
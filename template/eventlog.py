@@ -0,0 +1,200 @@
+"""A binary log of the timing relevant events of a session.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+Flips, key presses, eye tracker messages, EEG triggers and saves otherwise end up in different
+places (print statements, the EDF file, the marker file and the csv). The event log puts all of
+them on one clock, time.perf_counter_ns (the clock of the pyplugger onsets and mock records).
+
+Every event is a fixed size record (time, source, type, code and the offset of an optional text
+payload) written into a memory mapped file. The file is preallocated and grows by chunks, so a
+write is a struct.pack_into into memory and can be done inside the frame loop. Text payloads
+(e.g. message text) are appended to a second file, <filename>.payload. The number of records is
+kept in the header of the file, so a log is readable even if the experiment crashes.
+
+BaseExperiment.open_event_log opens the log for the session. eyelinker and pyplugger write to
+it through log() if this module can be imported, and do nothing otherwise.
+
+Functions:
+open_session_log -- Opens the event log that log() writes to.
+close_session_log -- Closes the event log opened by open_session_log.
+log -- Writes an event to the session log, if one is open.
+read_log -- Returns the records of an event log as a numpy structured array.
+read_payloads -- Returns the text payloads of records.
+
+Classes:
+EventLog -- Writes events to a log file.
+"""
+
+import mmap
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+SOURCES = ('experiment', 'eyelinker', 'pyplugger')
+EVENT_TYPES = ('flip', 'key', 'message', 'status', 'command', 'trigger', 'save')
+
+_source_codes = {name: i for i, name in enumerate(SOURCES)}
+_event_type_codes = {name: i for i, name in enumerate(EVENT_TYPES)}
+
+_MAGIC = b'TEVLOG01'
+_HEADER = struct.Struct('<8sq')  # magic, number of records
+_RECORD = struct.Struct('<qBBiqi')
+
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('source', 'u1'), ('type', 'u1'), ('code', '<i4'),
+                         ('payload', '<i8'), ('length', '<i4')])
+
+_session_log = None
+
+
+class EventLog:
+    """Writes events to a log file.
+
+    Writes are thread safe, so the connection supervisor and link event threads can log too.
+
+    Attributes:
+    filename -- the log file, the payloads are in filename + '.payload'
+    count -- the number of records written
+
+    Parameters:
+    filename -- the log file, overwritten if it exists
+    chunk_records -- the number of records the file grows by when it is full
+    """
+    def __init__(self, filename, chunk_records=65536):
+        self.filename = filename
+        self.count = 0
+        self.chunk_records = chunk_records
+
+        self._lock = threading.Lock()
+        self._file = open(filename, 'w+b')
+        self._payload_file = open(filename + '.payload', 'wb')
+        self._payload_size = 0
+        self._map = None
+        self._capacity = 0
+        self._grow()
+
+    def _grow(self):
+        """Extends the file by chunk_records records and maps it again."""
+        if self._map is not None:
+            self._map.close()
+
+        self._capacity += self.chunk_records
+        self._file.truncate(_HEADER.size + self._capacity * _RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.count)
+
+    def write(self, source, event_type, code=0, payload=None):
+        """Writes an event with the current time.
+
+        Parameters:
+        source -- one of SOURCES
+        event_type -- one of EVENT_TYPES
+        code -- an integer, e.g. the trigger code or frame number
+        payload -- an optional string (or bytes), e.g. the message text
+        """
+        timestamp = time.perf_counter_ns()
+        source = _source_codes[source]
+        event_type = _event_type_codes[event_type]
+
+        with self._lock:
+            if self._map is None:
+                raise ValueError('The event log %s is closed.' % self.filename)
+
+            offset, length = -1, 0
+            if payload is not None:
+                if isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                offset, length = self._payload_size, len(payload)
+                self._payload_file.write(payload)
+                # Readers trust the count in the header, so the payload must be in the file first
+                self._payload_file.flush()
+                self._payload_size += length
+
+            if self.count == self._capacity:
+                self._grow()
+
+            _RECORD.pack_into(self._map, _HEADER.size + self.count * _RECORD.size, timestamp,
+                              source, event_type, code, offset, length)
+            self.count += 1
+            _HEADER.pack_into(self._map, 0, _MAGIC, self.count)
+
+    def flush(self):
+        """Writes the records and payloads to disk, e.g. between blocks."""
+        with self._lock:
+            if self._map is not None:
+                self._payload_file.flush()
+                self._map.flush()
+
+    def close(self):
+        """Closes the log and removes the unused part of the file."""
+        with self._lock:
+            if self._map is None:
+                return
+            self._map.close()
+            self._map = None
+            self._file.truncate(_HEADER.size + self.count * _RECORD.size)
+            self._file.close()
+            self._payload_file.close()
+
+
+def open_session_log(filename, chunk_records=65536):
+    """Opens the event log that log() writes to, closing any previous one. Returns the log.
+
+    Parameters:
+    filename -- the log file, overwritten if it exists
+    chunk_records -- the number of records the file grows by when it is full
+    """
+    global _session_log
+    close_session_log()
+    _session_log = EventLog(filename, chunk_records)
+    return _session_log
+
+
+def close_session_log():
+    """Closes the event log opened by open_session_log."""
+    global _session_log
+    if _session_log is not None:
+        _session_log.close()
+        _session_log = None
+
+
+def log(source, event_type, code=0, payload=None):
+    """Writes an event to the session log, if one is open. See EventLog.write."""
+    if _session_log is not None:
+        _session_log.write(source, event_type, code, payload)
+
+
+def read_log(filename):
+    """Returns the records of an event log as a numpy structured array (see RECORD_DTYPE).
+
+    source and type are indices into SOURCES and EVENT_TYPES. payload is the offset of the text
+    in the payload file (-1 if there is none) and length its size in bytes.
+
+    Parameters:
+    filename -- the log file
+    """
+    with open(filename, 'rb') as log_file:
+        header = log_file.read(_HEADER.size)
+        if len(header) < _HEADER.size or not header.startswith(_MAGIC):
+            raise ValueError('%s is not an event log.' % filename)
+        _, count = _HEADER.unpack(header)
+        return np.fromfile(log_file, dtype=RECORD_DTYPE, count=count)
+
+
+def read_payloads(filename, records):
+    """Returns the text payloads of records as a list of strings (None without a payload).
+
+    Parameters:
+    filename -- the log file
+    records -- records from read_log
+    """
+    with open(filename + '.payload', 'rb') as payload_file:
+        data = payload_file.read()
+
+    return [None if offset < 0 else data[offset:offset + length].decode('utf-8', 'replace')
+            for offset, length in zip(records['payload'].tolist(), records['length'].tolist())]
@@ -0,0 +1,242 @@
+"""Builds randomized trial lists with constraints on the trial order.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+Reshuffling a trial list until it happens to meet a constraint gets slow quickly: the chance
+that a shuffle of a few hundred trials has no run longer than 3 can be tiny. These functions
+build valid orders directly instead:
+
+- Run length constraints (no more than max_run of the same condition in a row) are met by
+  picking the trials one at a time, only from the conditions that still leave a valid order
+  for the rest of the block. This never needs to backtrack.
+- Balanced transitions (every condition follows every condition equally often) are a random
+  Eulerian circuit through the complete graph of the conditions.
+
+Both take time linear in the number of trials. All randomness comes from a numpy Generator,
+so the same seed (by default the subject number) always produces the same list. Lists can be
+cached to a json file, so a restarted session uses exactly the same trials.
+
+Functions:
+factorial -- Returns every combination of the levels of the factors.
+constrained_order -- Orders labels so no label repeats more than max_run times in a row.
+balanced_order -- Orders labels so every transition between labels occurs equally often.
+trial_list -- Returns a randomized list of trials for a factorial design.
+subject_seed -- Returns a seed from the subject number in experiment_info.
+cached_trial_list -- Like trial_list, but reuses the list saved in a json file if possible.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def factorial(factors, repeats=1):
+    """Returns every combination of the levels of the factors, as a list of dictionaries.
+
+    Parameters:
+    factors -- a dictionary of factor names and lists of levels
+    repeats -- how many times each combination is included
+    """
+    names = list(factors)
+    shape = [len(factors[name]) for name in names]
+    # One row per combination, one column per factor, with the index of the level
+    combinations = np.indices(shape).reshape(len(shape), -1).T
+    combinations = np.tile(combinations, (repeats, 1))
+
+    return [{name: factors[name][i] for name, i in zip(names, row)}
+            for row in combinations.tolist()]
+
+
+def _feasible(counts, last, run, max_run):
+    """Returns whether the remaining counts can follow a run of label last of length run."""
+    other = counts.sum() - counts
+    capacity = max_run * (other + 1)
+    if last is not None:
+        capacity[last] = (max_run - run) + max_run * other[last]
+    return bool(np.all(counts <= capacity))
+
+
+def constrained_order(labels, max_run, rng):
+    """Orders labels so no label repeats more than max_run times in a row.
+
+    Returns a new list with the same labels. Raises ValueError if no such order exists.
+
+    Parameters:
+    labels -- a list of hashable labels, e.g. condition names
+    max_run -- the longest allowed run of the same label
+    rng -- a numpy.random.Generator
+    """
+    originals = list(dict.fromkeys(labels))
+    index = {label: i for i, label in enumerate(originals)}
+    counts = np.bincount([index[label] for label in labels], minlength=len(originals))
+
+    if not _feasible(counts, None, 0, max_run):
+        raise ValueError('No order has runs of at most %i for these labels.' % max_run)
+
+    order = []
+    last, run = None, 0
+    for _ in range(len(labels)):
+        allowed = np.zeros(len(counts), dtype=bool)
+        for candidate in np.flatnonzero(counts):
+            if candidate == last and run == max_run:
+                continue
+            counts[candidate] -= 1
+            allowed[candidate] = _feasible(
+                counts, candidate, run + 1 if candidate == last else 1, max_run)
+            counts[candidate] += 1
+
+        weights = counts * allowed
+        choice = rng.choice(len(counts), p=weights / weights.sum())
+        run = run + 1 if choice == last else 1
+        last = choice
+        counts[choice] -= 1
+        order.append(originals[choice])
+
+    return order
+
+
+def balanced_order(conditions, repeats, rng, self_transitions=True):
+    """Orders labels so every transition between labels occurs equally often.
+
+    Each condition follows every condition (including itself if self_transitions) repeats
+    times. The result is a random Eulerian circuit, without the step back to the start, so its
+    length is repeats * len(conditions) ** 2 (or repeats * n * (n - 1) without self
+    transitions) and each condition occurs equally often.
+
+    Parameters:
+    conditions -- a list of unique labels
+    repeats -- how often each transition occurs
+    rng -- a numpy.random.Generator
+    self_transitions -- whether a condition can follow itself
+    """
+    n = len(conditions)
+    # Every node has as many outgoing as incoming edges, so an Eulerian circuit exists
+    edges = []
+    for i in range(n):
+        targets = [j for j in range(n) if self_transitions or j != i] * repeats
+        edges.append([targets[k] for k in rng.permutation(len(targets))])
+
+    # Hierholzer's algorithm, the shuffled edges make the circuit random
+    stack = [int(rng.integers(n))]
+    circuit = []
+    while stack:
+        node = stack[-1]
+        if edges[node]:
+            stack.append(edges[node].pop())
+        else:
+            circuit.append(stack.pop())
+
+    circuit.reverse()
+    return [conditions[i] for i in circuit[:-1]]
+
+
+def _condition_key(trial, factor):
+    if factor is None:
+        return tuple(sorted(trial.items()))
+    return trial[factor]
+
+
+def _order_block(trials, rng, max_run, balance_transitions, factor):
+    """Orders the trials of one block, constraining the labels of factor (or the condition)."""
+    groups = {}
+    for i in rng.permutation(len(trials)):
+        groups.setdefault(_condition_key(trials[i], factor), []).append(trials[i])
+
+    keys = list(groups)
+    labels = list(range(len(keys)))
+
+    if balance_transitions:
+        n = len(keys)
+        if max_run == 1 and n == 1:
+            raise ValueError('A single condition cannot have runs of at most 1.')
+        per_label = n if max_run is None else n - 1
+        counts = {len(group) for group in groups.values()}
+        if len(counts) != 1 or counts.pop() % per_label:
+            raise ValueError('Balanced transitions need each of the %i conditions to occur a '
+                             'multiple of %i times in a block.' % (n, per_label))
+        repeats = len(groups[keys[0]]) // per_label
+        order = balanced_order(labels, repeats, rng, self_transitions=per_label == n)
+    elif max_run is not None:
+        order = constrained_order([i for i in labels for _ in groups[keys[i]]], max_run, rng)
+    else:
+        return [trials[i] for i in rng.permutation(len(trials))]
+
+    return [groups[keys[i]].pop() for i in order]
+
+
+def trial_list(factors, repeats=1, blocks=1, max_run=None, balance_transitions=False,
+               constrained_factor=None, seed=None):
+    """Returns a randomized list of trials for a factorial design.
+
+    Each block contains every combination of the factors repeats times, in its own order.
+    Every trial dictionary has the levels of the factors plus 'block' and 'trial' (both from 0).
+    Constraints apply within blocks.
+
+    Parameters:
+    factors -- a dictionary of factor names and lists of levels
+    repeats -- how many times each combination occurs in each block
+    blocks -- the number of blocks
+    max_run -- the longest allowed run of the same condition, or None
+    balance_transitions -- whether every condition should follow every condition equally
+     often. Combined with max_run=1, conditions never follow themselves. Other max_run values
+     cannot be combined with it.
+    constrained_factor -- the factor the constraints apply to, or None for the combination
+     of all factors
+    seed -- the seed for numpy.random.default_rng
+    """
+    if balance_transitions and max_run not in (None, 1):
+        raise ValueError('balance_transitions can only be combined with max_run=1 or None.')
+
+    rng = np.random.default_rng(seed)
+    design = factorial(factors, repeats)
+
+    trials = []
+    for block in range(blocks):
+        ordered = _order_block(
+            design, rng, max_run, balance_transitions, constrained_factor)
+        for i, trial in enumerate(ordered):
+            trials.append(dict(trial, block=block, trial=i))
+
+    return trials
+
+
+def subject_seed(experiment_info, salt=''):
+    """Returns a seed from the subject number in experiment_info.
+
+    Parameters:
+    experiment_info -- the dictionary from BaseExperiment.get_experiment_info_from_dialog
+    salt -- added to the subject number, to get different lists from the same subject
+    """
+    text = str(experiment_info['Subject Number']) + str(salt)
+    return int(hashlib.sha256(text.encode()).hexdigest()[:16], 16)
+
+
+def cached_trial_list(filename, **kwargs):
+    """Like trial_list, but reuses the list saved in a json file if possible.
+
+    The list is only reused if it was made with the same arguments, otherwise it is made again
+    and the file is overwritten. Levels must be json serializable.
+
+    Parameters:
+    filename -- the json file for the trial list
+
+    Keyword arguments are sent to trial_list.
+    """
+    key = json.dumps(kwargs, sort_keys=True, default=str)
+
+    if os.path.isfile(filename):
+        with open(filename) as cache_file:
+            cached = json.loads(cache_file.read())
+        if cached.get('key') == key:
+            return cached['trials']
+
+    trials = trial_list(**kwargs)
+
+    with open(filename, 'w') as cache_file:
+        cache_file.write(json.dumps({'key': key, 'trials': trials}))
+
+    return trials
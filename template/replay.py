@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+"""Replays a recorded session through an experiment to benchmark and check changes.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+The csv file (save_data_to_csv) and info file (save_experiment_info) of a past session are
+used to run an experiment built on BaseExperiment again without a participant, a screen or
+any waiting:
+
+- get_experiment_info_from_dialog fills experiment_info from the info file.
+- psychopy.event.waitKeys returns the recorded responses (the response_field column, one
+  row after another) whenever it is called with a keyList containing the next response. Other
+  calls (e.g. 'press any key' instruction screens) return the first allowed key, or 'space'.
+  A response of NA is returned as a timeout (None) from a call with a maxWait.
+  BaseExperiment.wait_for_response (and display_text_screen) return the same responses.
+- The response keyboard (used by run_trials) takes the next recorded response when it is
+  first checked after start_response_clock, and reports the key with its recorded reaction
+  time once that much virtual time has passed since the flip. A response of NA is never
+  reported, so the phase runs until it ends.
+- psychopy.core.wait and time.sleep advance a virtual clock instead of waiting, and every
+  flip advances it by one frame (at 60 Hz). The recorded reaction times (rt_field) of
+  waitKeys responses are added to the virtual clock as well.
+- psychopy.visual.Window and the common stimuli are replaced by objects that draw nothing,
+  so no display is needed. Stimuli must be used as psychopy.visual.<Stim> (not imported
+  with from psychopy.visual import ...) to be replaced.
+- Files are written to a temporary directory, and quit_experiment's sys.exit is caught.
+
+Every call to update_experiment_data is treated as the end of a trial, and every call to
+save_data_to_csv is timed, so the report contains per-trial timing and the data write
+throughput. The replayed rows are also compared to the recorded ones.
+
+Functions:
+replay_session -- Runs an experiment with the responses of a recorded session.
+format_report -- Returns the report from replay_session as readable text.
+main -- Command line entry point.
+"""
+
+import argparse
+import collections
+import contextlib
+import csv
+import importlib
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import psychopy.core
+import psychopy.event
+import psychopy.visual
+
+
+# Stimuli that are replaced by _NullStim while replaying
+_stimulus_names = [
+    'Aperture', 'BufferImageStim', 'Circle', 'DotStim', 'ElementArrayStim', 'GratingStim',
+    'ImageStim', 'Line', 'NoiseStim', 'Pie', 'Polygon', 'RadialStim', 'RatingScale', 'Rect',
+    'ShapeStim', 'SimpleImageStim', 'Slider', 'TextBox2', 'TextStim',
+]
+
+
+_sleep = time.sleep  # The real one, time.sleep is replaced while replaying
+
+_frame_seconds = 1 / 60
+
+# The attributes of a psychopy.hardware.keyboard.KeyPress that experiments use
+_KeyPress = collections.namedtuple('_KeyPress', ['name', 'rt'])
+
+
+def _no_op(*args, **kwargs):
+    pass
+
+
+class _NullStim:
+    """Accepts any arguments and attributes, and draws nothing."""
+    def __init__(self, *args, **kwargs):
+        vars(self).update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _no_op
+
+
+class _NullWindow(_NullStim):
+    """A window that is never shown. flip returns the virtual time."""
+    def __init__(self, size=(1920, 1080), clock=None, **kwargs):
+        super().__init__(**kwargs)
+        self.size = list(size)
+        self.color = kwargs.get('color', (0, 0, 0))
+        self.units = kwargs.get('units', 'pix')
+        self._clock = clock
+        self._on_flip = []
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+    def flip(self, clearBuffer=True):
+        self._clock.now += _frame_seconds
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args, kwargs in on_flip:
+            function(*args, **kwargs)
+        return self._clock.now
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1 / _frame_seconds
+
+    def close(self):
+        pass
+
+
+class _VirtualClock:
+    """Replaces waiting. speed None skips waits, otherwise waits are divided by speed."""
+    def __init__(self, speed=None):
+        self.speed = speed
+        self.now = 0.0
+
+    def wait(self, secs, *args, **kwargs):
+        self.now += secs
+        if self.speed:
+            _sleep(secs / self.speed)
+
+
+class _Responses:
+    """Hands out the recorded responses through waitKeys."""
+    def __init__(self, rows, response_field, rt_field, clock):
+        self.responses = [(row.get(response_field, 'NA'), row.get(rt_field, 'NA'))
+                          for row in rows]
+        self.index = 0
+        self.clock = clock
+
+    def next_response(self):
+        """Returns the next (key, rt) and moves past it, rt is None if it was not recorded."""
+        if self.index >= len(self.responses):
+            return 'NA', None
+        key, rt = self.responses[self.index]
+        self.index += 1
+        return key, None if rt == 'NA' else float(rt)
+
+    def wait_keys(self, maxWait=float('inf'), keyList=None, timeStamped=False, **kwargs):
+        key, rt = 'NA', 'NA'
+        if self.index < len(self.responses):
+            key, rt = self.responses[self.index]
+
+        if keyList is not None and key in keyList:
+            self.index += 1
+        elif key == 'NA' and maxWait != float('inf') and self.index < len(self.responses):
+            self.index += 1
+            self.clock.now += maxWait
+            return None
+        else:  # Not a response, e.g. an instruction screen
+            key, rt = (keyList[0] if keyList else 'space'), 'NA'
+
+        rt = 0.0 if rt == 'NA' else float(rt)
+        self.clock.now += rt
+
+        if timeStamped:
+            return [[key, rt]]
+        return [key]
+
+    def wait_for_response(self, keyList=None, max_wait=None, lockout=0, trial=None, **kwargs):
+        """Replaces BaseExperiment.wait_for_response."""
+        trial = {} if trial is None else trial
+        keys = self.wait_keys(float('inf') if max_wait is None else max_wait, keyList,
+                              timeStamped=True)
+        if keys is None:
+            return [dict(trial, response='NA', rt='NA')]
+
+        key, rt = keys[0]
+        if rt < lockout:  # Earlier key presses would have been ignored
+            self.clock.now += lockout - rt
+            rt = lockout
+        return [dict(trial, response=key, rt=rt)]
+
+
+class _KeyboardClock:
+    """The response clock of _ReplayKeyboard, measuring virtual time."""
+    def __init__(self, clock, on_reset):
+        self.clock = clock
+        self.on_reset = on_reset
+        self.start = clock.now
+
+    def reset(self):
+        self.start = self.clock.now
+        self.on_reset()
+
+    def getTime(self):
+        return self.clock.now - self.start
+
+
+class _ReplayKeyboard:
+    """Replaces the response keyboard, reporting the recorded responses at their recorded rt."""
+    def __init__(self, responses, clock):
+        self.responses = responses
+        self.clock = _KeyboardClock(clock, self._reset)
+        self._armed = False
+        self._pending = None
+
+    def _reset(self):
+        # The response is taken when the keyboard is checked, so a wait_for_response after
+        # start_response_clock does not use up a second response
+        self._armed = True
+        self._pending = None
+
+    def clearEvents(self, *args, **kwargs):
+        pass
+
+    def getKeys(self, keyList=None, **kwargs):
+        if self._armed:
+            self._armed = False
+            self._pending = self.responses.next_response()
+
+        if self._pending is None:
+            return []
+
+        key, rt = self._pending
+        if key == 'NA' or (keyList is not None and key not in keyList):
+            return []
+
+        rt = self.clock.getTime() if rt is None else rt
+        if self.clock.getTime() < rt:
+            return []
+
+        self._pending = None
+        return [_KeyPress(key, rt)]
+
+
+def _default_info_filename(csv_filename):
+    return re.sub(r'(\([0-9]+\))?\.csv$', r'_info\1.json', csv_filename)
+
+
+def _read_rows(csv_filename):
+    with open(csv_filename, newline='') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+class _Timer:
+    """Wraps update_experiment_data and save_data_to_csv of an experiment to time them."""
+    def __init__(self, experiment):
+        self.experiment = experiment
+        self.trial_seconds = []
+        self.write_seconds = 0.0
+        self.bytes_written = 0
+        self.rows_written = 0
+        self._last = time.perf_counter()
+
+        self._update = experiment.update_experiment_data
+        self._save = experiment.save_data_to_csv
+        experiment.update_experiment_data = self.update_experiment_data
+        experiment.save_data_to_csv = self.save_data_to_csv
+
+    def update_experiment_data(self, new_data):
+        self._update(new_data)
+        now = time.perf_counter()
+        for _ in new_data:
+            self.trial_seconds.append((now - self._last) / max(1, len(new_data)))
+        self._last = now
+
+    def save_data_to_csv(self):
+        filename = self.experiment.experiment_data_filename
+        size = os.path.getsize(filename)
+        lines = self.experiment.data_lines_written
+
+        start = time.perf_counter()
+        self._save()
+        self.write_seconds += time.perf_counter() - start
+
+        self.bytes_written += os.path.getsize(filename) - size
+        self.rows_written += self.experiment.data_lines_written - lines
+
+
+@contextlib.contextmanager
+def _replay_environment(responses, clock):
+    def window(*args, **kwargs):
+        kwargs.pop('clock', None)
+        return _NullWindow(clock=clock, **kwargs)
+
+    patches = [
+        mock.patch.object(psychopy.event, 'waitKeys', responses.wait_keys),
+        mock.patch.object(psychopy.event, 'getKeys', lambda *args, **kwargs: []),
+        mock.patch.object(psychopy.event, 'clearEvents', _no_op),
+        mock.patch.object(psychopy.core, 'wait', clock.wait),
+        mock.patch.object(time, 'sleep', clock.wait),
+        mock.patch.object(psychopy.visual, 'Window', window),
+    ]
+    patches += [mock.patch.object(psychopy.visual, name, _NullStim) for name in _stimulus_names]
+
+    with contextlib.ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        yield
+
+
+def _count_differences(recorded, replayed, ignore_fields):
+    differences = abs(len(recorded) - len(replayed))
+    for old, new in zip(recorded, replayed):
+        if any(old.get(k) != new.get(k) for k in old if k not in ignore_fields):
+            differences += 1
+    return differences
+
+
+def _prepare(experiment, experiment_info, responses, clock):
+    """Replaces the parts of an experiment that need a participant."""
+    def get_experiment_info_from_dialog(*args, **kwargs):
+        experiment.experiment_info = dict(experiment_info)
+        return True
+
+    experiment.get_experiment_info_from_dialog = get_experiment_info_from_dialog
+    experiment._confirm_overwrite = lambda *args, **kwargs: True
+    experiment.wait_for_response = responses.wait_for_response
+    experiment.response_keyboard = _ReplayKeyboard(responses, clock)
+
+
+def _timed_run(experiment, run):
+    """Runs the experiment, returns the wall time in seconds."""
+    start = time.perf_counter()
+    try:
+        getattr(experiment, run)()
+    except SystemExit:  # quit_experiment
+        pass
+    return time.perf_counter() - start
+
+
+def replay_session(experiment_factory, csv_filename, info_filename=None, run='run',
+                   response_field='response', rt_field='rt', speed=None, ignore_fields=()):
+    """Runs an experiment with the responses of a recorded session.
+
+    Returns a report dictionary with the keys:
+    seconds -- the wall time of the replay
+    virtual_seconds -- the time the waits and responses would have taken
+    trial_seconds -- the wall time of each trial (time between update_experiment_data calls)
+    write_seconds, rows_written, bytes_written -- the totals of the save_data_to_csv calls
+    recorded_rows, replayed_rows -- the number of rows in the recorded and new csv files
+    responses_used -- how many recorded responses were returned
+    differences -- the number of rows that differ from the recording, not counting
+        ignore_fields (nonzero for a randomized experiment that is not seeded)
+
+    Parameters:
+    experiment_factory -- a function (e.g. the experiment class) returning a new experiment
+    csv_filename -- the csv file of the recorded session
+    info_filename -- the info json file, found next to the csv file if None
+    run -- the name of the experiment method that runs the whole experiment
+    response_field -- the data field with the key pressed in each trial
+    rt_field -- the data field with the reaction time in seconds, optional
+    speed -- None to skip every wait, otherwise waits are divided by speed
+    ignore_fields -- data fields that are expected to differ, e.g. timestamps
+    """
+    if info_filename is None:
+        info_filename = _default_info_filename(csv_filename)
+
+    with open(info_filename) as info_file:
+        experiment_info = json.loads(info_file.read())
+
+    recorded = _read_rows(csv_filename)
+    clock = _VirtualClock(speed)
+    responses = _Responses(recorded, response_field, rt_field, clock)
+
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, _replay_environment(responses, clock):
+        os.chdir(directory)
+        try:
+            # Errors while creating the experiment propagate, nothing is reported
+            experiment = experiment_factory()
+            _prepare(experiment, experiment_info, responses, clock)
+            timer = _Timer(experiment)
+            seconds = _timed_run(experiment, run)
+
+            replayed = []
+            if experiment.experiment_data_filename is not None:
+                replayed = _read_rows(experiment.experiment_data_filename)
+        finally:
+            os.chdir(original_directory)
+
+    return {
+        'seconds': seconds,
+        'virtual_seconds': clock.now,
+        'trial_seconds': timer.trial_seconds,
+        'write_seconds': timer.write_seconds,
+        'rows_written': timer.rows_written,
+        'bytes_written': timer.bytes_written,
+        'recorded_rows': len(recorded),
+        'replayed_rows': len(replayed),
+        'responses_used': responses.index,
+        'differences': _count_differences(recorded, replayed, set(ignore_fields)),
+    }
+
+
+def format_report(report):
+    """Returns the report from replay_session as readable text."""
+    lines = ['Replayed %i of %i rows in %.2f s (%.1f s of waiting skipped), %i responses used.'
+             % (report['replayed_rows'], report['recorded_rows'], report['seconds'],
+                report['virtual_seconds'], report['responses_used'])]
+
+    trial_ms = [1000 * s for s in report['trial_seconds']]
+    if trial_ms:
+        lines.append('Per trial: mean %.3f ms, median %.3f ms, max %.3f ms.' % (
+            statistics.mean(trial_ms), statistics.median(trial_ms), max(trial_ms)))
+
+    if report['write_seconds'] > 0:
+        lines.append('Data writes: %i rows, %i bytes in %.4f s (%.0f rows/s, %.2f MB/s).' % (
+            report['rows_written'], report['bytes_written'], report['write_seconds'],
+            report['rows_written'] / report['write_seconds'],
+            report['bytes_written'] / report['write_seconds'] / 1e6))
+
+    lines.append('Rows that differ from the recording: %i.' % report['differences'])
+
+    return '\n'.join(lines)
+
+
+def _load_factory(spec):
+    """Returns the object named by 'module:name', e.g. 'my_experiment:MyExperiment'."""
+    module_name, _, name = spec.partition(':')
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module_name), name)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Replays a recorded session through an experiment.')
+    ap.add_argument('experiment', help='The experiment class as module:ClassName.')
+    ap.add_argument('csv', help='The csv file of the recorded session.')
+    ap.add_argument('-i', '--info', help='The info json file (found next to the csv by default).')
+    ap.add_argument('--run', default='run', help='The method that runs the experiment.')
+    ap.add_argument('--response-field', default='response', help='The response data field.')
+    ap.add_argument('--rt-field', default='rt', help='The reaction time data field.')
+    ap.add_argument('--ignore', action='append', default=[], help='A field that may differ.')
+    ap.add_argument('-n', '--repeat', type=int, default=1, help='How often to replay.')
+
+    args = vars(ap.parse_args())
+
+    factory = _load_factory(args['experiment'])
+    for _ in range(args['repeat']):
+        report = replay_session(
+            factory, os.path.abspath(args['csv']),
+            info_filename=args['info'] and os.path.abspath(args['info']), run=args['run'],
+            response_field=args['response_field'], rt_field=args['rt_field'],
+            ignore_fields=args['ignore'])
+        print(format_report(report) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Runs trials as a sequence of phases, timed by counting frames.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+Waiting with core.wait or time.sleep between flips makes every phase last a little longer
+than asked, and the error is rounded up to whole frames by the next flip. The scheduler
+instead draws and flips for a fixed number of frames, so a phase of 500 ms at 60 Hz is always
+30 flips. Durations in ms are converted with the refresh rate measured when the scheduler is
+created.
+
+Each trial is a dictionary from a precomputed trial list. Phases are described by Phase
+objects, and the same phases run for every trial. Triggers and event messages should be sent
+with the on_flip hook of a phase, which runs right after the first flip of the phase. Data is
+passed to update_experiment_data and saved between trials, where it cannot delay a flip.
+Responses are read from the response keyboard of the experiment (see
+BaseExperiment.get_response_keyboard), which timestamps key presses on the device when
+psychtoolbox is installed, and are timed from the first flip of the phase.
+Every flip is written to the session event log (see eventlog.py), with the frame index as the
+code and the phase name on the first frame.
+
+Classes:
+Phase -- One part of a trial, e.g. fixation, stimulus or response.
+TrialScheduler -- Runs trials for an experiment.
+"""
+
+import time
+
+import eventlog
+
+
+def _value(value, trial):
+    """Returns value, or value(trial) if it is a function."""
+    return value(trial) if callable(value) else value
+
+
+class Phase:
+    """One part of a trial, e.g. fixation, stimulus or response.
+
+    Give the duration as either frames or ms. Both may also be a function that takes the trial
+    dictionary and returns the duration, e.g. for a jittered interval.
+
+    Parameters:
+    name -- the name of the phase, used for the data fields
+    frames -- the duration in frames
+    ms -- the duration in ms, rounded to the nearest number of frames
+    draw -- a function called with (trial, frame index) before every flip of the phase
+    on_flip -- a function called with the trial right after the first flip, e.g. for triggers
+    response_keys -- a list of keys to record during this phase
+    end_on_response -- whether a response ends the phase early
+    on_response -- a function called with (trial, key, rt) right after a response
+    """
+    def __init__(self, name, frames=None, ms=None, draw=None, on_flip=None,
+                 response_keys=None, end_on_response=False, on_response=None):
+        if (frames is None) == (ms is None):
+            raise ValueError('Give the duration of phase %s as either frames or ms.' % name)
+
+        self.name = name
+        self.frames = frames
+        self.ms = ms
+        self.draw = draw
+        self.on_flip = on_flip
+        self.response_keys = response_keys
+        self.end_on_response = end_on_response
+        self.on_response = on_response
+
+    def frame_count(self, trial, frame_rate):
+        """Returns the number of frames this phase lasts in a trial."""
+        if self.frames is not None:
+            return int(_value(self.frames, trial))
+        return int(round(_value(self.ms, trial) * frame_rate / 1000))
+
+
+class TrialScheduler:
+    """Runs trials for an experiment.
+
+    For every trial, the data written is the trial dictionary plus:
+    <phase>_frames -- the number of frames the phase was shown
+    <phase>_onset -- the time of the first flip of the phase, in s since the trial started
+    response, rt -- the first key pressed in a phase with response_keys and its time in s since
+     the start of that phase, or 'NA'
+    Add the fields you want to keep to the data_fields of the experiment.
+
+    Attributes:
+    frame_rate -- the refresh rate used to convert ms to frames
+
+    Parameters:
+    experiment -- a BaseExperiment with an open window
+    phases -- a list of Phase objects
+    frame_rate -- the refresh rate in Hz, measured with getActualFrameRate if None
+    save_every -- save the data to the csv file after this many trials
+    """
+    def __init__(self, experiment, phases, frame_rate=None, save_every=1):
+        self.experiment = experiment
+        self.window = experiment.experiment_window
+        self.phases = phases
+        self.save_every = save_every
+
+        if frame_rate is None:
+            frame_rate = self.window.getActualFrameRate()
+        if frame_rate is None:
+            print('Warning: Could not measure the refresh rate, using 60 Hz.')
+            frame_rate = 60
+        self.frame_rate = frame_rate
+
+    def run(self, trials, block_field='block', on_trial_start=None, on_trial_end=None,
+            on_block_end=None):
+        """Runs every trial, returns the list of trial data.
+
+        The hooks are called between trials, so they can take as long as needed (e.g. to show a
+        break screen) without affecting the timing of a trial.
+
+        Parameters:
+        trials -- a list of trial dictionaries
+        block_field -- the trial field with the block, on_block_end is called when it changes
+        on_trial_start -- a function called with the trial before its first phase
+        on_trial_end -- a function called with the trial data after its last phase
+        on_block_end -- a function called with the block after its last trial
+        """
+        results = []
+
+        for i, trial in enumerate(trials):
+            if on_trial_start is not None:
+                on_trial_start(trial)
+
+            result = self.run_trial(trial)
+            results.append(result)
+            self.experiment.update_experiment_data([result])
+
+            if on_trial_end is not None:
+                on_trial_end(result)
+
+            last = i == len(trials) - 1
+            if (i + 1) % self.save_every == 0 or last:
+                self._save()
+
+            block = trial.get(block_field)
+            if on_block_end is not None and block is not None and (
+                    last or trials[i + 1].get(block_field) != block):
+                on_block_end(block)
+
+        return results
+
+    def run_trial(self, trial):
+        """Runs the phases of one trial, returns the trial data."""
+        result = dict(trial)
+        result['response'], result['rt'] = 'NA', 'NA'
+        trial_start = None
+
+        for phase in self.phases:
+            frames = phase.frame_count(trial, self.frame_rate)
+            onset = self._run_phase(phase, frames, trial, result)
+            if trial_start is None and onset is not None:
+                trial_start = onset
+
+            result[phase.name + '_onset'] = 'NA' if onset is None else onset - trial_start
+
+        return result
+
+    def _run_phase(self, phase, frames, trial, result):
+        """Shows a phase for frames flips, returns the time of the first flip."""
+        result[phase.name + '_frames'] = 0
+        onset = None
+
+        for frame in range(frames):
+            if phase.draw is not None:
+                phase.draw(trial, frame)
+
+            if frame == 0:
+                if phase.response_keys is not None:
+                    self.experiment.start_response_clock()
+                if phase.on_flip is not None:
+                    self.window.callOnFlip(phase.on_flip, trial)
+
+            self.window.flip()
+            result[phase.name + '_frames'] += 1
+            if frame == 0:
+                onset = time.perf_counter()
+                eventlog.log('experiment', 'flip', 0, phase.name)
+            else:
+                eventlog.log('experiment', 'flip', frame)
+
+            if phase.response_keys is not None and self._check_response(phase, trial, result):
+                break
+
+        return onset
+
+    def _check_response(self, phase, trial, result):
+        """Records the first response of a phase, returns True if the phase should end."""
+        if result['response'] != 'NA':
+            return False
+
+        response_keyboard = self.experiment.get_response_keyboard()
+        keys = response_keyboard.getKeys(keyList=phase.response_keys, waitRelease=False)
+        if not keys:
+            return False
+
+        result['response'], result['rt'] = keys[0].name, keys[0].rt
+        eventlog.log('experiment', 'key', payload=result['response'])
+        if phase.on_response is not None:
+            phase.on_response(trial, result['response'], result['rt'])
+
+        return phase.end_on_response
+
+    def _save(self):
+        if self.experiment.experiment_data_filename is not None:
+            self.experiment.save_data_to_csv()
@@ -0,0 +1,113 @@
+"""Keeps the eye tracker and EEG connections alive during a session.
+
+Author - Colin Quirk (cquirk@uchicago.edu)
+
+Repo: https://github.com/colinquirk/templateexperiments
+
+The EyeLinker and PyPlugger factories only check the connection once, at startup. The
+supervisor checks the connections of the devices on a background thread, using the cheap
+is_connected heartbeat of ConnectedEyeLinker and ConnectedPyPlugger. When a connection is
+lost, the device buffers its messages and commands (so the experiment keeps running) and the
+supervisor reconnects with an increasing delay between attempts. Once reconnected, the device
+sends the buffered messages. EyeLink messages keep their original time through the message
+offset, pycorder commands take effect when they are sent.
+
+Devices also start buffering on their own when a send fails, so nothing is lost between
+heartbeats. Any object with is_connected, buffering, start_buffering and reconnect can be
+supervised.
+
+Classes:
+ConnectionSupervisor -- Checks connections on a background thread and reconnects lost ones.
+"""
+
+import threading
+import time
+
+
+class _DeviceState:
+    def __init__(self):
+        self.lost = None  # When the connection was lost
+        self.backoff = 0
+        self.retry_at = 0
+
+
+class ConnectionSupervisor:
+    """Checks connections on a background thread and reconnects lost ones.
+
+    Attributes:
+    log -- a list of (time.perf_counter(), device name, text) tuples, e.g. lost connections
+    lost -- a set with the names of devices that are currently disconnected
+
+    Parameters:
+    devices -- a dictionary of names and devices, e.g. {'Eye tracker': tracker, 'EEG': eeg}.
+     Mock devices are ignored.
+    interval -- seconds between heartbeats
+    max_backoff -- the longest wait in seconds between reconnection attempts
+    """
+    def __init__(self, devices, interval=1.0, max_backoff=30.0):
+        self.devices = {name: device for name, device in devices.items()
+                        if not getattr(device, 'mock', False)}
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.log = []
+        self.lost = set()
+
+        self._states = {name: _DeviceState() for name in self.devices}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the heartbeats on a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the heartbeats. Devices that are still disconnected keep buffering."""
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def check(self):
+        """Checks every device once, reconnecting if an attempt is due."""
+        now = time.perf_counter()
+        for name, device in self.devices.items():
+            self._check(name, device, self._states[name], now)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def _write_log(self, name, text):
+        self.log.append((time.perf_counter(), name, text))
+        print('%s: %s' % (name, text))
+
+    def _check(self, name, device, state, now):
+        if state.lost is None:
+            if not device.buffering and device.is_connected():
+                return
+
+            device.start_buffering()
+            state.lost, state.backoff, state.retry_at = now, self.interval, now
+            self.lost.add(name)
+            self._write_log(name, 'Connection lost, buffering messages.')
+
+        if now < state.retry_at:
+            return
+
+        try:
+            sent = device.reconnect()
+        except (OSError, RuntimeError) as e:  # RuntimeError is raised by pylink
+            state.backoff = min(2 * state.backoff, self.max_backoff)
+            state.retry_at = time.perf_counter() + state.backoff
+            self._write_log(name, 'Reconnecting failed (%s), next attempt in %.1f s.'
+                            % (e, state.backoff))
+            return
+
+        self._write_log(name, 'Reconnected after %.1f s, %i buffered messages sent.'
+                        % (time.perf_counter() - state.lost, sent))
+        state.lost = None
+        self.lost.discard(name)
@@ -19,6 +19,7 @@ useful please let me know through email or GitHub.
 
 Functions:
 convert_color_value -- Converts a list of 3 values from 0 to 255 to -1 to 1.
+convert_color_values -- Converts an array of colors from 0 to 255 to -1 to 1.
 
 Classes:
 BaseExperiment -- All experiments inherit from BaseExperiment. Provides basic
@@ -27,27 +28,67 @@ BaseExperiment -- All experiments inherit from BaseExperiment. Provides basic
     docs or help(templateexperiments.BaseExperiment) for everything.
 """
 
+import functools
 import json
 import os
 import pickle
 import sys
+import threading
+import time
 
+import numpy as np
 import psychopy.monitors
 import psychopy.visual
 import psychopy.gui
-import psychopy.core
 import psychopy.event
 
+import eventlog
+import randomization
+from scheduler import TrialScheduler
+from supervisor import ConnectionSupervisor
+
 
 # Convenience
 def convert_color_value(color):
     """Converts a list of 3 values from 0 to 255 to -1 to 1.
 
+    Results are cached, so repeated colors are only converted once.
+
     Parameters:
     color -- A list of 3 ints between 0 and 255 to be converted.
     """
 
-    return [round(((n/127.5)-1), 2) for n in color]
+    try:
+        return list(_convert_color_tuple(tuple(color)))
+    except TypeError:  # Unhashable values, e.g. numpy arrays
+        return [round(((n/127.5)-1), 2) for n in color]
+
+
+@functools.lru_cache(maxsize=4096)
+def _convert_color_tuple(color):
+    return tuple(round(((n/127.5)-1), 2) for n in color)
+
+
+# The converted value of every int from 0 to 255, rounded exactly like convert_color_value
+_color_lookup = np.array([round(((n/127.5)-1), 2) for n in range(256)])
+
+
+def convert_color_values(colors):
+    """Converts an array of colors from 0 to 255 to -1 to 1.
+
+    Returns a float numpy array of the same shape, e.g. for the colors of an ElementArrayStim.
+    The values are the same as those of convert_color_value (rounded to 2 decimals). Integer
+    values are looked up in a 256 entry table, others are converted with numpy.
+
+    Parameters:
+    colors -- An array-like of values between 0 and 255, e.g. N x 3 for N colors.
+    """
+    colors = np.asarray(colors)
+
+    if colors.dtype.kind in 'iu' and colors.size and colors.min() >= 0 and colors.max() <= 255:
+        return _color_lookup[colors]
+
+    return np.round(colors / 127.5 - 1, 2)
 
 
 class BaseExperiment:
@@ -65,13 +106,17 @@ class BaseExperiment:
     Methods:
     display_text_screen -- draws a string centered on the screen.
     get_experiment_info_from_dialog -- gets subject info from a dialog box.
+    get_response_keyboard -- returns the keyboard used for responses.
+    open_event_log -- opens a binary log of the timing relevant events.
     open_csv_data_file -- opens a csv data file and writes the header.
     open_window -- open a psychopy window.
     quit_experiment -- ends the experiment.
     save_data_to_csv -- append new entries in experiment_data to csv data file.
     save_experiment_info -- write the info from the dialog box to a text file.
     save_experiment_pickle -- save a pickle so crashes can be recovered from.
+    start_response_clock -- times responses from the next flip.
     update_experiment_data -- extends any new data to the experiment_data list.
+    wait_for_response -- waits for a key press, returns records with the rt.
     """
 
     def __init__(self, experiment_name, data_fields, bg_color=[128, 128, 128],
@@ -109,6 +154,7 @@ class BaseExperiment:
         self.data_lines_written = 0
         self.experiment_info = {}
         self.experiment_window = None
+        self.response_keyboard = None
 
         self.overwrite_ok = None
 
@@ -278,6 +324,7 @@ class BaseExperiment:
                         data_file.write(',')
                 data_file.write('\n')
 
+        eventlog.log('experiment', 'save', len(self.experiment_data) - self.data_lines_written)
         self.data_lines_written = len(self.experiment_data)
 
     def save_experiment_pickle(self, additional_fields_dict=None):
@@ -315,6 +362,23 @@ class BaseExperiment:
         with open(pickle_filename, 'wb+') as pickle_file:
             pickle.dump(pickle_dict, pickle_file)
 
+    def open_event_log(self, filename=None):
+        """Opens the event log for the session, returns the eventlog.EventLog.
+
+        Flips, key presses and saves of the experiment, and the messages and triggers sent by
+        eyelinker and pyplugger, are logged with a shared timestamp until quit_experiment. See
+        eventlog.py for details and eventlog.read_log to read the log.
+
+        Parameters:
+        filename -- the name of the log file (default is
+            experimentname_subjectnumber.evlog)
+        """
+        if filename is None:
+            filename = (self.experiment_name + '_' +
+                        self.experiment_info['Subject Number'].zfill(3) + '.evlog')
+
+        return eventlog.open_session_log(filename)
+
     def open_window(self, **kwargs):
         """Opens the psychopy window.
 
@@ -344,8 +408,10 @@ class BaseExperiment:
         bg_color -- A list of 3 values between 0 and 255 (default is default
             background color).
         wait_for_input -- Bool that defines whether the screen will wait for
-            keyboard input before continuing. If waiting for keys, a .5 second
-            buffer is added to prevent accidental advancing.
+            keyboard input before continuing. If waiting for keys, keys
+            pressed in the first .2 seconds after the screen appears are
+            ignored to prevent accidental advancing.
+        keyList -- The keys that continue, any key if None.
 
         Additional keyword arguments are sent to psychopy.visual.TextStim().
         """
@@ -368,30 +434,451 @@ class BaseExperiment:
 
         backgroundRect.draw()
         textObject.draw()
+        if wait_for_input:
+            self.start_response_clock()
         self.experiment_window.flip()
+        eventlog.log('experiment', 'flip')
 
         keys = None
 
         if wait_for_input:
-            psychopy.core.wait(.2)  # Prevents accidental key presses
-            keys = psychopy.event.waitKeys(keyList=keyList)
+            # Prevents accidental key presses
+            responses = self.wait_for_response(keyList=keyList, lockout=.2)
+            keys = [response['response'] for response in responses]
             self.experiment_window.flip()
+            eventlog.log('experiment', 'flip')
 
         return keys
 
+    def get_response_keyboard(self):
+        """Returns the keyboard used for responses, creating it on first use.
+
+        This is a psychopy.hardware.keyboard.Keyboard, which timestamps key presses on the
+        device when psychtoolbox is installed (and falls back to psychopy.event otherwise).
+        """
+        if self.response_keyboard is None:
+            # Imported here, as it loads psychtoolbox
+            from psychopy.hardware import keyboard
+            self.response_keyboard = keyboard.Keyboard()
+
+        return self.response_keyboard
+
+    def start_response_clock(self):
+        """Measures response times from the next flip.
+
+        Call it before the flip that shows the stimulus. Key presses before that flip are
+        discarded.
+        """
+        response_keyboard = self.get_response_keyboard()
+        self.experiment_window.callOnFlip(response_keyboard.clearEvents)
+        self.experiment_window.callOnFlip(response_keyboard.clock.reset)
+
+    def wait_for_response(self, keyList=None, max_wait=None, lockout=0, trial=None,
+                          poll_interval=.001):
+        """Waits for a key press, timed from the flip after start_response_clock.
+
+        Returns a list of records for update_experiment_data, one per key pressed: the trial
+        dictionary plus 'response' (the key name) and 'rt' (in s since the flip). If no key
+        is pressed in time, the single record has 'NA' for both.
+
+        The keyboard keeps the time of every key press, so the wait sleeps between checks
+        instead of polling constantly, without affecting the response times.
+
+        Parameters:
+        keyList -- the keys to accept, any key if None
+        max_wait -- the longest time to wait in s since the flip, or None to wait forever
+        lockout -- key presses within this time in s after the flip are ignored
+        trial -- a dictionary of trial data included in every record
+        poll_interval -- the time in s between checks of the keyboard
+        """
+        response_keyboard = self.get_response_keyboard()
+        trial = {} if trial is None else trial
+
+        while True:
+            keys = [key for key in response_keyboard.getKeys(keyList=keyList, waitRelease=False)
+                    if key.rt >= lockout]
+            if keys:
+                break
+            if max_wait is not None and response_keyboard.clock.getTime() >= max_wait:
+                return [dict(trial, response='NA', rt='NA')]
+            time.sleep(poll_interval)
+
+        for key in keys:
+            eventlog.log('experiment', 'key', payload=key.name)
+
+        return [dict(trial, response=key.name, rt=key.rt) for key in keys]
+
+    def make_trial_list(self, factors, cache=True, **kwargs):
+        """Returns a randomized trial list for a factorial design, seeded by the subject number.
+
+        The list is saved to experimentname_subjectnumber_trials.json, and a restarted session
+        with the same subject number and arguments reuses it. See randomization.trial_list for
+        the constraints that are available.
+
+        Parameters:
+        factors -- a dictionary of factor names and lists of levels
+        cache -- whether to save and reuse the list
+
+        Additional keyword arguments (repeats, blocks, max_run, balance_transitions,
+        constrained_factor) are sent to randomization.trial_list().
+        """
+        kwargs['seed'] = randomization.subject_seed(self.experiment_info)
+
+        if not cache:
+            return randomization.trial_list(factors, **kwargs)
+
+        filename = (self.experiment_name + '_' +
+                    self.experiment_info['Subject Number'].zfill(3) + '_trials.json')
+        return randomization.cached_trial_list(filename, factors=factors, **kwargs)
+
+    def run_trials(self, trials, phases, frame_rate=None, save_every=1, **kwargs):
+        """Runs a list of trials with frame-counted phases and saves the data.
+
+        Returns the list of trial data. See scheduler.py for details.
+
+        Parameters:
+        trials -- a list of trial dictionaries
+        phases -- a list of scheduler.Phase objects, run in order for every trial
+        frame_rate -- the refresh rate in Hz, measured with getActualFrameRate if None
+        save_every -- save the data to the csv file after this many trials
+
+        Additional keyword arguments (block_field and the on_trial_start, on_trial_end and
+        on_block_end hooks) are sent to TrialScheduler.run().
+        """
+        scheduler = TrialScheduler(self, phases, frame_rate=frame_rate, save_every=save_every)
+        return scheduler.run(trials, **kwargs)
+
     def quit_experiment(self):
         """Completes anything that must occur when the experiment ends."""
+        eventlog.close_session_log()
         if self.experiment_window:
             self.experiment_window.close()
         print('The experiment has ended.')
         sys.exit(0)
 
 
+class _SetupCancelled(Exception):
+    """Raised on a worker thread when its setup attempt was abandoned."""
+
+
+class _SetupAttempt:
+    """One run of a device's setup on a daemon thread.
+
+    A daemon thread does not keep the experiment from exiting while it is blocked in a
+    connection attempt. Threads cannot be stopped, so a cancelled attempt stops before its next
+    step instead. Whatever it opened is closed: the partially set up device if it stops or
+    fails, or its result if it finishes after being cancelled.
+
+    Parameters:
+    setup -- a function run on the thread, called with the step function
+    on_step -- a function called with the status of each step
+    close -- a function called with a device that is given up, or None
+    """
+    def __init__(self, setup, on_step, close=None):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.partial = None
+
+        self._setup = setup
+        self._on_step = on_step
+        self._close = close
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def step(self, status, device=None):
+        """Reports the next step, raises _SetupCancelled if the attempt was cancelled.
+
+        device -- the device as set up so far, closed if the attempt does not finish
+        """
+        with self._lock:
+            if device is not None:
+                self.partial = device
+            if self._cancelled:
+                raise _SetupCancelled('setup was cancelled')
+            self._on_step(status)
+
+    def cancel(self):
+        """Stops the attempt before its next step and closes a result nobody took."""
+        with self._lock:
+            self._cancelled = True
+            result, self.result = self.result, None
+        self._discard(result)
+
+    def _run(self):
+        try:
+            result = self._setup(self.step)
+        except Exception as e:
+            self.error = e
+            self._discard(self.partial)
+        else:
+            with self._lock:
+                if self._cancelled:
+                    self.error = _SetupCancelled('setup finished after it was cancelled')
+                else:
+                    self.result, result = result, None
+            self._discard(result)
+        self.done.set()
+
+    def _discard(self, device):
+        if device is None or self._close is None:
+            return
+        try:
+            self._close(device)
+        except Exception as e:
+            print('Could not close an abandoned device: %s' % e)
+
+
+class _DeviceSetup:
+    """Runs the blocking part of a device's setup on a worker thread.
+
+    Parameters:
+    name -- shown on the status screen
+    setup -- a function run on the worker thread, its return value is the device. It is called
+     with a step function, which must be called with the status of each step before it starts
+     (e.g. step('initializing session')) and raises if the attempt was cancelled. The device
+     set up so far can be passed as a second argument, so it is closed if the attempt stops.
+    timeout -- seconds before the setup is reported as timed out
+    close -- a function that closes the connection of a device from a cancelled or failed
+     attempt
+    """
+    def __init__(self, name, setup, timeout, close=None):
+        self.name = name
+        self.setup = setup
+        self.timeout = timeout
+        self.close = close
+        self.device = None
+        self.status = 'waiting'
+        self.error = None
+        self.attempt = None
+        self.start_time = None
+
+    def _set_status(self, status):
+        self.status = status
+
+    def start(self):
+        """Cancels any running attempt and starts a new one."""
+        self.cancel()
+        self.device = None
+        self.error = None
+        self.status = 'connecting'
+        self.start_time = time.perf_counter()
+        self.attempt = _SetupAttempt(self.setup, self._set_status, self.close)
+
+    def cancel(self):
+        """Stops the running attempt before its next step, if its device was not taken."""
+        if self.attempt is not None and self.device is None:
+            self.attempt.cancel()
+
+    def update(self):
+        """Checks the worker thread, returns True once the setup finished, failed or timed out."""
+        if self.device is not None or self.error is not None:
+            return True
+
+        if self.attempt.done.is_set():
+            if self.attempt.error is None:
+                self.device = self.attempt.result
+                self.status = 'ready'
+            else:
+                self.error = self.attempt.error
+                self.status = 'failed: %s' % self.error
+        elif time.perf_counter() - self.start_time > self.timeout:
+            self.cancel()  # Any step still running has finished once cancel returns
+            self.error = TimeoutError(
+                '%s setup took longer than %i s' % (self.name, self.timeout))
+            self.status = 'timed out'
+
+        return self.device is not None or self.error is not None
+
+    def status_text(self):
+        if self.device is None and self.error is None:
+            return '%s: %s (%.0f s)' % (
+                self.name, self.status, time.perf_counter() - self.start_time)
+        return '%s: %s' % (self.name, self.status)
+
+
 class EyeTrackingEEGExperiment(BaseExperiment):
+    """An experiment recording eye tracking (eyelinker) and EEG (pyplugger) data.
+
+    The eyelinker and pyplugger modules are only imported by setup_devices, so they need to be
+    importable (e.g. in the experiment directory) only when it is used.
+    """
     def __init__(self, *args, tracker=None, eeg=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.tracker = tracker
         self.eeg = eeg
+        self.supervisor = None
+
+    def start_supervisor(self, interval=1.0, max_backoff=30.0):
+        """Checks the tracker and EEG connections in the background and reconnects lost ones.
+
+        While a connection is down, messages and commands are buffered and sent once it is back.
+        See supervisor.py for details.
+
+        Parameters:
+        interval -- seconds between connection checks
+        max_backoff -- the longest wait in seconds between reconnection attempts
+        """
+        self.stop_supervisor()
+        self.supervisor = ConnectionSupervisor(
+            {'Eye tracker': self.tracker, 'EEG': self.eeg}, interval, max_backoff)
+        self.supervisor.start()
+
+    def stop_supervisor(self):
+        """Stops the connection checks started by start_supervisor."""
+        if self.supervisor is not None:
+            self.supervisor.stop()
+            self.supervisor = None
+
+    def quit_experiment(self):
+        """Stops the connection checks and ends the experiment."""
+        self.stop_supervisor()
+        super().quit_experiment()
+
+    def setup_devices(self, edf_filename, eye, config_file, eyelinker_kwargs=None,
+                      pyplugger_kwargs=None, mock_options=None, tracker_timeout=20,
+                      eeg_timeout=30):
+        """Connects to and initializes the eye tracker and EEG system at the same time.
+
+        The tracker (connection, EDF file and initial commands) and the pycorder session
+        (initialize_session and monitoring mode, which wait several seconds) are set up on
+        worker threads, while one status screen shows the progress of both. Everything that
+        uses the window stays on the main thread: the status screen, and the tracker display,
+        which is opened with its settings once the tracker is connected. Setup takes as long as
+        the slowest device instead of the sum of both.
+
+        If a device fails or times out, the experimenter can retry the failed devices ("R"),
+        quit ("Q") or continue with mock devices in their place ("D"), like the EyeLinker and
+        PyPlugger factories. A timed out attempt stops before its next step, and the
+        connection it opened is closed.
+
+        Sets and returns self.tracker and self.eeg. The tracker is ready to record once
+        setup_tracker is called, the EEG system is in monitoring mode.
+
+        Parameters:
+        edf_filename -- EDF filename, max 12 characters with extension
+        eye -- Which eye(s) to track, either "LEFT", "RIGHT" or "BOTH"
+        config_file -- A path to an xml config file created by pycorder on the pycorder computer
+        eyelinker_kwargs -- additional keyword arguments for ConnectedEyeLinker
+        pyplugger_kwargs -- additional keyword arguments for ConnectedPyPlugger
+        mock_options -- used by the MockEyeLinker if continuing in debug mode
+        tracker_timeout -- seconds to wait for the tracker connection
+        eeg_timeout -- seconds to wait for the pycorder connection and session setup
+        """
+        import eyelinker
+        import pyplugger
+
+        eyelinker_kwargs = eyelinker_kwargs or {}
+        pyplugger_kwargs = pyplugger_kwargs or {}
+
+        def setup_tracker(step):
+            # Only the link is used here. The display draws with the window, so it is created
+            # and opened on the main thread once the tracker is connected.
+            tracker = eyelinker.ConnectedEyeLinker(
+                self.experiment_window, edf_filename, eye, create_display=False,
+                **eyelinker_kwargs)
+            step('opening the EDF file', tracker)
+            tracker.open_edf()
+            step('sending settings')
+            tracker.initialize_tracker()
+            return tracker
+
+        def close_tracker(tracker):
+            tracker.tracker.close()
+
+        def setup_eeg(step):
+            eeg = pyplugger.ConnectedPyPlugger(
+                self.experiment_window, config_file, **pyplugger_kwargs)
+            step('initializing session', eeg)
+            eeg.initialize_session(self.experiment_name, self.experiment_info['Subject Number'])
+            step('switching to monitoring mode')
+            eeg.switch_mode('M')
+            return eeg
+
+        def close_eeg(eeg):
+            if eeg.socket is not None:
+                eeg.socket.close()
+
+        devices = [_DeviceSetup('Eye tracker', setup_tracker, tracker_timeout, close_tracker),
+                   _DeviceSetup('EEG', setup_eeg, eeg_timeout, close_eeg)]
+
+        response = self._run_device_setup(devices)
+        for device in devices:  # Nothing keeps running once a choice is made
+            device.cancel()
+
+        if response == 'q':
+            self.quit_experiment()
+
+        tracker, eeg = devices
+        self.tracker, self.eeg = tracker.device, eeg.device
+
+        if self.tracker is None:
+            print('Continuing with mock eyetracking. Eyetracking data will not be saved!')
+            self.tracker = eyelinker.MockEyeLinker(
+                self.experiment_window, edf_filename, eye, mock_options=mock_options,
+                text_color=eyelinker_kwargs.get('text_color'))
+            self.tracker.open_edf()
+            self.tracker.initialize_tracker()
+
+        self.tracker.initialize_graphics()
+        self.tracker.send_tracking_settings()
+
+        if self.eeg is None:
+            print('Continuing with mock eeg. EEG data will not be saved!')
+            self.eeg = pyplugger.MockPyPlugger(
+                self.experiment_window, config_file, **pyplugger_kwargs)
+
+        self.experiment_window.flip()
+
+        return self.tracker, self.eeg
+
+    def _run_device_setup(self, devices):
+        """Shows the device status until every setup finished, returns the experimenter's choice.
+
+        Returns None if every device is ready, 'q' to quit or 'd' to continue with mocks.
+        """
+        for device in devices:
+            device.start()
+
+        while True:
+            while not all([device.update() for device in devices]):
+                self._display_device_status(devices)
+                pending = [d for d in devices if d.device is None and d.error is None]
+                pending[0].attempt.done.wait(0.1)
+
+            failed = [device for device in devices if device.device is None]
+            if not failed:
+                return None
+
+            response = self._display_device_status(devices, failed=True)
+            if response != 'r':
+                return response
+
+            for device in failed:
+                device.start()
+
+    def _display_device_status(self, devices, failed=False):
+        """Draws the status of every device. If failed, waits for an R, Q or D key press."""
+        text = '\n'.join(device.status_text() for device in devices)
+
+        if failed:
+            text += ('\n\nPress "R" to retry the failed devices\n'
+                     'Press "Q" to quit\n'
+                     'Press "D" to continue with mock devices instead of the failed ones')
+        else:
+            text = 'Setting up devices...\n\n' + text
+
+        self.display_text_screen(text, text_color=[255, 255, 255], bg_color=[0, 0, 0],
+                                 wait_for_input=False)
+
+        if failed:
+            return psychopy.event.waitKeys(keyList=['r', 'q', 'd'])[0]
 
     def send_synced_event(self, code, keyword="SYNC", end_eeg_event=False):
         if keyword is None:
@@ -402,4 +889,4 @@ class EyeTrackingEEGExperiment(BaseExperiment):
         self.eeg.start_event(code)
         self.tracker.send_message(message)
         if end_eeg_event:
-            self.eeg.end_eeg_event()
+            self.eeg.end_event()
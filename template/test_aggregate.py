@@ -0,0 +1,102 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import aggregate
+
+
+def write_session(directory, filename, rows, info_filename=None, identifier='000000'):
+    with open(os.path.join(directory, filename), 'w') as f:
+        f.write('"trial","response"\n')
+        for trial, response in rows:
+            f.write('"%s","%s"\n' % (trial, response))
+
+    if info_filename is not None:
+        with open(os.path.join(directory, info_filename), 'w') as f:
+            f.write(json.dumps({'Subject Number': '1', 'Unique Subject Identifier': identifier}))
+
+
+class TestAggregate(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.output = os.path.join(self.directory, 'combined.parquet')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_find_sessions_pairs_info(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a')], 'exp_001_info.json', 'abc')
+        write_session(self.directory, 'exp_002.csv', [(1, 'b')])
+
+        sessions = aggregate.find_sessions(self.directory)
+
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual(sessions[0]['experiment_info']['Unique Subject Identifier'], 'abc')
+        self.assertIsNone(sessions[1]['info'])
+
+    def test_info_file_suffix_must_match(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a')], 'exp_001_info.json', 'abc')
+        write_session(self.directory, 'exp_001(1).csv', [(1, 'b')])  # Its info file is missing
+
+        sessions = aggregate.find_sessions(self.directory)
+        info = {os.path.basename(s['csv']): s['info'] for s in sessions}
+        self.assertEqual(info['exp_001.csv'], os.path.join(self.directory, 'exp_001_info.json'))
+        self.assertIsNone(info['exp_001(1).csv'])
+
+    def test_missing_parquet_engine(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a')], 'exp_001_info.json', 'abc')
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            with self.assertRaisesRegex(ImportError, 'pyarrow'):
+                aggregate.aggregate(self.directory, self.output)
+
+    def test_duplicate_identifiers(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a')], 'exp_001_info.json', 'abc')
+        write_session(self.directory, 'exp_001(1).csv', [(1, 'b')], 'exp_001_info(1).json', 'abc')
+        write_session(self.directory, 'exp_001(2).csv', [(1, 'c')], 'exp_001_info(2).json', 'xyz')
+
+        last = [os.path.basename(s['csv']) for s in aggregate.find_sessions(self.directory)]
+        self.assertEqual(last, ['exp_001(1).csv', 'exp_001(2).csv'])
+
+        first = [os.path.basename(s['csv'])
+                 for s in aggregate.find_sessions(self.directory, keep='first')]
+        self.assertEqual(first, ['exp_001(2).csv', 'exp_001.csv'])
+
+    def test_aggregate(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a'), (2, 'NA')],
+                      'exp_001_info.json', 'abc')
+        write_session(self.directory, 'exp_002.csv', [(1, 'c')], 'exp_002_info.json', 'def')
+
+        dataset, files_read = aggregate.aggregate(self.directory, self.output, workers=1)
+
+        self.assertEqual(files_read, 2)
+        self.assertEqual(len(dataset), 3)
+        self.assertTrue(os.path.exists(self.output))
+        self.assertEqual(list(dataset['Unique Subject Identifier']), ['abc', 'abc', 'def'])
+        self.assertTrue(dataset['response'].isna()[1])
+
+    def test_aggregate_incremental(self):
+        write_session(self.directory, 'exp_001.csv', [(1, 'a')], 'exp_001_info.json', 'abc')
+        aggregate.aggregate(self.directory, self.output, workers=1)
+
+        write_session(self.directory, 'exp_002.csv', [(1, 'b')], 'exp_002_info.json', 'def')
+        dataset, files_read = aggregate.aggregate(self.directory, self.output, workers=1)
+        self.assertEqual(files_read, 1)
+        self.assertEqual(sorted(dataset['response']), ['a', 'b'])
+
+        time.sleep(0.01)
+        write_session(self.directory, 'exp_001.csv', [(1, 'c')], 'exp_001_info.json', 'abc')
+        dataset, files_read = aggregate.aggregate(self.directory, self.output, workers=1)
+        self.assertEqual(files_read, 1)
+        self.assertEqual(sorted(dataset['response']), ['b', 'c'])
+
+        dataset, files_read = aggregate.aggregate(self.directory, self.output, workers=1)
+        self.assertEqual(files_read, 0)
+        self.assertEqual(len(dataset), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import eventlog
+
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.evlog')
+
+    def tearDown(self):
+        eventlog.close_session_log()
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        log = eventlog.EventLog(self.filename, chunk_records=4)
+        for frame in range(10):  # Grows twice
+            log.write('experiment', 'flip', frame)
+        log.write('eyelinker', 'message', payload='TRIAL 1')
+        log.write('pyplugger', 'trigger', 12)
+        log.write('experiment', 'key', payload='space')
+        log.close()
+
+        records = eventlog.read_log(self.filename)
+        self.assertEqual(len(records), 13)
+        self.assertEqual(records.dtype, eventlog.RECORD_DTYPE)
+        self.assertTrue(np.all(np.diff(records['time']) >= 0))
+        self.assertEqual(records['code'][:10].tolist(), list(range(10)))
+        self.assertEqual(eventlog.SOURCES[records['source'][11]], 'pyplugger')
+        self.assertEqual(eventlog.EVENT_TYPES[records['type'][11]], 'trigger')
+        self.assertEqual(records['code'][11], 12)
+
+        payloads = eventlog.read_payloads(self.filename, records)
+        self.assertEqual(payloads[10:], ['TRIAL 1', None, 'space'])
+        self.assertIsNone(payloads[0])
+
+    def test_read_while_open(self):
+        log = eventlog.EventLog(self.filename)
+        log.write('experiment', 'save', 3)
+        log.flush()
+
+        records = eventlog.read_log(self.filename)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records['code'][0], 3)
+
+        # Every counted record's payload is readable without a flush
+        log.write('eyelinker', 'message', payload='TRIAL 2')
+        records = eventlog.read_log(self.filename)
+        self.assertEqual(eventlog.read_payloads(self.filename, records), [None, 'TRIAL 2'])
+        log.close()
+
+    def test_session_log(self):
+        eventlog.log('experiment', 'flip')  # Nothing is open, so nothing happens
+
+        eventlog.open_session_log(self.filename)
+        eventlog.log('eyelinker', 'status', payload='Trial 1 of 10')
+        eventlog.close_session_log()
+
+        records = eventlog.read_log(self.filename)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(eventlog.read_payloads(self.filename, records), ['Trial 1 of 10'])
+
+    def test_closed_and_invalid(self):
+        log = eventlog.EventLog(self.filename)
+        log.close()
+        with self.assertRaises(ValueError):
+            log.write('experiment', 'flip')
+
+        with self.assertRaises(ValueError):
+            eventlog.read_log(self.filename + '.payload')
+
+
+if __name__ == '__main__':
+    unittest.main()
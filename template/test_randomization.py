@@ -0,0 +1,118 @@
+import unittest
+import collections
+import itertools
+import os
+
+import numpy as np
+
+import randomization
+import template
+
+
+def _longest_run(sequence):
+    return max(len(list(group)) for _, group in itertools.groupby(sequence))
+
+
+class TestRandomization(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_factorial(self):
+        trials = randomization.factorial({'side': ['left', 'right'], 'size': [1, 2, 3]}, 2)
+        self.assertEqual(len(trials), 12)
+        self.assertEqual(trials[0], {'side': 'left', 'size': 1})
+        self.assertEqual(trials[5], {'side': 'right', 'size': 3})
+        self.assertEqual(trials[:6], trials[6:])
+
+    def test_constrained_order(self):
+        labels = ['a'] * 30 + ['b'] * 10 + ['c'] * 5
+        for max_run in (1, 2, 3):
+            if max_run == 1:
+                with self.assertRaises(ValueError):
+                    randomization.constrained_order(labels, max_run, self.rng)
+                continue
+            order = randomization.constrained_order(labels, max_run, self.rng)
+            self.assertEqual(sorted(order), sorted(labels))
+            self.assertLessEqual(_longest_run(order), max_run)
+
+    def test_constrained_order_tight(self):
+        # Only one order exists: a a b a a b a a
+        order = randomization.constrained_order(['a'] * 6 + ['b'] * 2, 2, self.rng)
+        self.assertEqual(order, list('aabaabaa'))
+
+    def test_balanced_order(self):
+        order = randomization.balanced_order(['a', 'b', 'c'], 4, self.rng)
+        self.assertEqual(len(order), 36)
+        transitions = collections.Counter(zip(order + order[:1], order[1:] + order[:1]))
+        self.assertEqual(set(transitions.values()), {4})
+        self.assertEqual(len(transitions), 9)
+
+        order = randomization.balanced_order(['a', 'b', 'c'], 2, self.rng, self_transitions=False)
+        self.assertEqual(len(order), 12)
+        self.assertEqual(_longest_run(order), 1)
+
+    def test_trial_list(self):
+        factors = {'side': ['left', 'right'], 'color': ['red', 'green', 'blue']}
+        trials = randomization.trial_list(factors, repeats=10, blocks=3, max_run=2,
+                                          constrained_factor='side', seed=5)
+
+        self.assertEqual(len(trials), 180)
+        self.assertEqual([t['block'] for t in trials], [0] * 60 + [1] * 60 + [2] * 60)
+        self.assertEqual(trials[61]['trial'], 1)
+        for block in range(3):
+            sides = [t['side'] for t in trials if t['block'] == block]
+            self.assertLessEqual(_longest_run(sides), 2)
+            conditions = collections.Counter(
+                (t['side'], t['color']) for t in trials if t['block'] == block)
+            self.assertEqual(set(conditions.values()), {10})
+
+        self.assertEqual(trials, randomization.trial_list(
+            factors, repeats=10, blocks=3, max_run=2, constrained_factor='side', seed=5))
+        self.assertNotEqual(trials, randomization.trial_list(
+            factors, repeats=10, blocks=3, max_run=2, constrained_factor='side', seed=6))
+
+    def test_trial_list_balanced_transitions(self):
+        trials = randomization.trial_list({'target': ['a', 'b']}, repeats=4,
+                                          balance_transitions=True, max_run=1, seed=0)
+        self.assertEqual(_longest_run([t['target'] for t in trials]), 1)
+
+        with self.assertRaises(ValueError):
+            randomization.trial_list({'target': ['a', 'b', 'c']}, repeats=4,
+                                     balance_transitions=True)
+
+        # Longer runs are not checked by the balanced order, so they are refused
+        with self.assertRaises(ValueError):
+            randomization.trial_list({'target': ['a', 'b']}, repeats=8, max_run=2,
+                                     balance_transitions=True)
+
+        # A single condition always follows itself
+        with self.assertRaisesRegex(ValueError, 'single condition'):
+            randomization.trial_list({'target': ['a']}, repeats=4, max_run=1,
+                                     balance_transitions=True)
+
+    def test_subject_seed(self):
+        self.assertEqual(randomization.subject_seed({'Subject Number': '7'}),
+                         randomization.subject_seed({'Subject Number': 7}))
+        self.assertNotEqual(randomization.subject_seed({'Subject Number': '7'}),
+                            randomization.subject_seed({'Subject Number': '8'}))
+
+    def test_make_trial_list_cache(self):
+        experiment = template.BaseExperiment(experiment_name='test_name', data_fields=[])
+        experiment.experiment_info['Subject Number'] = '3'
+        factors = {'side': ['left', 'right']}
+
+        try:
+            trials = experiment.make_trial_list(factors, repeats=5)
+            self.assertTrue(os.path.exists('test_name_003_trials.json'))
+            self.assertEqual(experiment.make_trial_list(factors, repeats=5), trials)
+
+            with open('test_name_003_trials.json', 'w') as f:
+                f.write('{"key": "old", "trials": []}')
+            self.assertEqual(experiment.make_trial_list(factors, repeats=5), trials)
+            self.assertEqual(experiment.make_trial_list(factors, repeats=5, cache=False), trials)
+        finally:
+            os.remove('test_name_003_trials.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+import psychopy.core
+import psychopy.event
+import psychopy.visual
+
+import replay
+import scheduler
+import template
+
+
+class _TinyExperiment(template.BaseExperiment):
+    def __init__(self):
+        super().__init__(experiment_name='tiny', data_fields=['trial', 'stim', 'response', 'rt'])
+        self.stims = ['a', 'b', 'c', 'd']
+
+    def run(self):
+        self.get_experiment_info_from_dialog()
+        self.save_experiment_info()
+        self.open_csv_data_file()
+        self.open_window()
+
+        self.display_text_screen('Press any key to begin.')
+
+        for trial, stim in enumerate(self.stims):
+            psychopy.visual.TextStim(self.experiment_window, text=stim).draw()
+            self.experiment_window.flip()
+            psychopy.core.wait(0.5)
+            keys = psychopy.event.waitKeys(maxWait=2, keyList=['f', 'j'], timeStamped=True)
+            if keys is None:
+                response, rt = 'NA', 'NA'
+            else:
+                response, rt = keys[0]
+            self.update_experiment_data(
+                [{'trial': trial, 'stim': stim, 'response': response, 'rt': rt}])
+            self.save_data_to_csv()
+
+        self.quit_experiment()
+
+
+class _ScheduledExperiment(template.BaseExperiment):
+    def __init__(self):
+        super().__init__(experiment_name='tiny', data_fields=['stim', 'response', 'rt'])
+
+    def run(self):
+        self.get_experiment_info_from_dialog()
+        self.open_csv_data_file()
+        self.open_window()
+
+        trials = [{'stim': stim} for stim in 'abc']
+        phases = [scheduler.Phase('fixation', frames=30),
+                  scheduler.Phase('response', ms=2000, response_keys=['f', 'j'],
+                                  end_on_response=True)]
+        self.run_trials(trials, phases)
+        self.quit_experiment()
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.csv_filename = os.path.join(self.directory, 'tiny_001.csv')
+
+        with open(self.csv_filename, 'w') as f:
+            f.write('"trial","stim","response","rt"\n'
+                    '"0","a","f","0.5"\n'
+                    '"1","b","j","0.25"\n'
+                    '"2","c","NA","NA"\n'
+                    '"3","d","f","1.0"\n')
+
+        with open(os.path.join(self.directory, 'tiny_001_info.json'), 'w') as f:
+            f.write(json.dumps({'Subject Number': '1'}))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_default_info_filename(self):
+        self.assertEqual(replay._default_info_filename('exp_001.csv'), 'exp_001_info.json')
+        self.assertEqual(replay._default_info_filename('exp_001(2).csv'), 'exp_001_info(2).json')
+
+    def test_replay_session(self):
+        report = replay.replay_session(_TinyExperiment, self.csv_filename)
+
+        self.assertEqual(report['recorded_rows'], 4)
+        self.assertEqual(report['replayed_rows'], 4)
+        self.assertEqual(report['responses_used'], 4)
+        self.assertEqual(report['differences'], 0)
+        self.assertEqual(report['rows_written'], 4)
+        self.assertEqual(len(report['trial_seconds']), 4)
+        self.assertGreater(report['bytes_written'], 0)
+        # 0.2 instruction lockout, 4 * 0.5 waits, 2 s timeout, 1.75 s of responses and 6 flips
+        self.assertAlmostEqual(report['virtual_seconds'], 6.05)
+
+        self.assertIn('Rows that differ from the recording: 0.', replay.format_report(report))
+
+    def test_replay_run_trials(self):
+        with open(self.csv_filename, 'w') as f:
+            f.write('"stim","response","rt"\n'
+                    '"a","f","0.5"\n'
+                    '"b","NA","NA"\n'
+                    '"c","j","0.25"\n')
+
+        report = replay.replay_session(_ScheduledExperiment, self.csv_filename)
+
+        self.assertEqual(report['replayed_rows'], 3)
+        self.assertEqual(report['responses_used'], 3)
+        self.assertEqual(report['differences'], 0)
+        # Each response phase lasts until the recorded rt, or 2 s without a response
+        self.assertAlmostEqual(report['virtual_seconds'], 3 * 0.5 + 0.5 + 2 + 0.25, delta=0.1)
+
+    def test_replay_counts_differences(self):
+        class ChangedExperiment(_TinyExperiment):
+            def __init__(self):
+                super().__init__()
+                self.stims = ['a', 'x', 'c']
+
+        report = replay.replay_session(ChangedExperiment, self.csv_filename)
+
+        self.assertEqual(report['replayed_rows'], 3)
+        self.assertEqual(report['differences'], 2)  # One changed row and one missing row
+
+    def test_replay_restores_psychopy(self):
+        wait_keys = psychopy.event.waitKeys
+        window = psychopy.visual.Window
+
+        replay.replay_session(_TinyExperiment, self.csv_filename)
+
+        self.assertIs(psychopy.event.waitKeys, wait_keys)
+        self.assertIs(psychopy.visual.Window, window)
+        self.assertFalse(os.path.exists('tiny_001.csv'))
+
+    def test_factory_error_propagates(self):
+        window = psychopy.visual.Window
+        directory = os.getcwd()
+
+        def broken_factory():
+            raise ValueError('broken experiment')
+
+        with self.assertRaisesRegex(ValueError, 'broken experiment'):
+            replay.replay_session(broken_factory, self.csv_filename)
+
+        class BrokenPrepare(_TinyExperiment):
+            def __setattr__(self, name, value):
+                if name == 'wait_for_response':
+                    raise AttributeError('cannot prepare')
+                super().__setattr__(name, value)
+
+        with self.assertRaisesRegex(AttributeError, 'cannot prepare'):
+            replay.replay_session(BrokenPrepare, self.csv_filename)
+        self.assertIs(psychopy.visual.Window, window)
+        self.assertEqual(os.getcwd(), directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import os
+
+import scheduler
+import template
+
+
+class _FakeWindow:
+    def __init__(self):
+        self.flips = 0
+        self.events = []
+        self._on_flip = []
+
+    def callOnFlip(self, function, *args):
+        self._on_flip.append((function, args))
+
+    def flip(self):
+        self.flips += 1
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args in on_flip:
+            function(*args)
+
+    def getActualFrameRate(self):
+        return 100.0
+
+
+class _FakeClock:
+    def __init__(self):
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+    def getTime(self):
+        return 0.0
+
+
+class _FakeKey:
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+
+
+class _FakeKeyboard:
+    def __init__(self, keys):
+        self.keys = keys
+        self.clock = _FakeClock()
+
+    def clearEvents(self):
+        pass
+
+    def getKeys(self, keyList=None, waitRelease=True):
+        return [_FakeKey(*key) for key in self.keys.pop(0) if keyList is None or key[0] in keyList]
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.experiment = template.BaseExperiment(
+            experiment_name='test_name', data_fields=['stim', 'response', 'rt'])
+        self.experiment.experiment_window = _FakeWindow()
+        self.experiment.experiment_info['Subject Number'] = '0'
+        self.window = self.experiment.experiment_window
+
+    def test_phase_duration(self):
+        with self.assertRaises(ValueError):
+            scheduler.Phase('fixation')
+        with self.assertRaises(ValueError):
+            scheduler.Phase('fixation', frames=1, ms=10)
+
+        self.assertEqual(scheduler.Phase('a', frames=3).frame_count({}, 60), 3)
+        self.assertEqual(scheduler.Phase('a', ms=500).frame_count({}, 60), 30)
+        self.assertEqual(scheduler.Phase('a', ms=508).frame_count({}, 60), 30)
+        jittered = scheduler.Phase('a', ms=lambda trial: trial['iti'])
+        self.assertEqual(jittered.frame_count({'iti': 250}, 100), 25)
+
+    def test_run_trials(self):
+        draws = []
+        triggers = []
+        blocks = []
+
+        def trigger(trial):
+            triggers.append(self.window.flips)
+
+        phases = [
+            scheduler.Phase('fixation', ms=50, on_flip=trigger),
+            scheduler.Phase('stim', frames=2, draw=lambda t, f: draws.append((t['stim'], f))),
+            scheduler.Phase('blank', frames=0),
+        ]
+        trials = [{'stim': 'a', 'block': 1}, {'stim': 'b', 'block': 1}, {'stim': 'c', 'block': 2}]
+
+        self.experiment.open_csv_data_file()
+        try:
+            results = self.experiment.run_trials(trials, phases, on_block_end=blocks.append)
+            with open('test_name_000.csv') as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove('test_name_000.csv')
+
+        self.assertEqual(self.window.flips, 3 * (5 + 2))
+        self.assertEqual(triggers, [1, 8, 15])  # Right after the first flip of each trial
+        self.assertEqual(draws[:2], [('a', 0), ('a', 1)])
+        self.assertEqual(blocks, [1, 2])
+        self.assertEqual(results[0]['fixation_frames'], 5)
+        self.assertEqual(results[0]['blank_frames'], 0)
+        self.assertEqual(results[0]['fixation_onset'], 0)
+        self.assertEqual(results[0]['blank_onset'], 'NA')
+        self.assertEqual(len(self.experiment.experiment_data), 3)
+        self.assertEqual(lines[1:], ['"a","NA","NA"', '"b","NA","NA"', '"c","NA","NA"'])
+
+    def test_response_ends_phase(self):
+        responses = []
+        phase = scheduler.Phase('response', frames=100, response_keys=['f', 'j'],
+                                end_on_response=True,
+                                on_response=lambda t, key, rt: responses.append(key))
+        self.experiment.response_keyboard = _FakeKeyboard([[], [], [('j', 0.02)]])
+        results = self.experiment.run_trials([{'stim': 'a'}], [phase], save_every=10)
+
+        self.assertEqual(self.window.flips, 3)
+        self.assertEqual(self.experiment.response_keyboard.clock.resets, 1)
+        self.assertEqual(results[0]['response'], 'j')
+        self.assertEqual(results[0]['rt'], 0.02)
+        self.assertEqual(responses, ['j'])
+
+
+if __name__ == '__main__':
+    unittest.main()
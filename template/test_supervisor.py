@@ -0,0 +1,84 @@
+import unittest
+
+import supervisor
+
+
+class _FakeDevice:
+    def __init__(self):
+        self.connected = True
+        self.reachable = True
+        self.buffering = False
+        self.reconnects = 0
+        self.mock = False
+
+    def is_connected(self):
+        return self.connected
+
+    def start_buffering(self):
+        self.buffering = True
+
+    def reconnect(self):
+        self.reconnects += 1
+        if not self.reachable:
+            raise OSError('unreachable')
+        self.connected = True
+        self.buffering = False
+        return 3
+
+
+class TestConnectionSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.device = _FakeDevice()
+        self.supervisor = supervisor.ConnectionSupervisor({'EEG': self.device}, interval=0)
+
+    def test_connected_device_is_left_alone(self):
+        self.supervisor.check()
+        self.assertEqual(self.device.reconnects, 0)
+        self.assertEqual(self.supervisor.log, [])
+
+    def test_lost_connection_is_buffered_and_reconnected(self):
+        self.device.connected = False
+        self.device.reachable = False
+        self.supervisor.check()
+
+        self.assertTrue(self.device.buffering)
+        self.assertEqual(self.supervisor.lost, {'EEG'})
+        self.assertEqual(self.device.reconnects, 1)
+
+        self.device.reachable = True
+        self.supervisor.check()
+
+        self.assertFalse(self.device.buffering)
+        self.assertEqual(self.supervisor.lost, set())
+        self.assertIn('3 buffered messages sent', self.supervisor.log[-1][2])
+
+    def test_device_buffering_after_failed_send_is_reconnected(self):
+        self.device.buffering = True
+        self.supervisor.check()
+        self.assertEqual(self.device.reconnects, 1)
+        self.assertFalse(self.device.buffering)
+
+    def test_backoff(self):
+        self.supervisor.interval = 1
+        self.supervisor.max_backoff = 4
+        self.device.connected = False
+        self.device.reachable = False
+
+        self.supervisor.check()
+        self.supervisor.check()  # Too early for another attempt
+        self.assertEqual(self.device.reconnects, 1)
+
+        state = self.supervisor._states['EEG']
+        self.assertEqual(state.backoff, 2)
+        for _ in range(3):
+            state.retry_at = 0
+            self.supervisor.check()
+        self.assertEqual(state.backoff, 4)
+
+    def test_mock_devices_are_ignored(self):
+        self.device.mock = True
+        self.assertEqual(supervisor.ConnectionSupervisor({'EEG': self.device}).devices, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 import unittest
 import os
 import json
+import sys
 import template
 import pickle
+import threading
+import types
+from unittest import mock
 
 
 class TestTemplateMethods(unittest.TestCase):
@@ -29,6 +33,27 @@ class TestTemplateMethods(unittest.TestCase):
         self.assertListAlmostEqual(template.convert_color_value([188, 108, 14]),
                                    [0.47, -0.15, -0.89])  # Brown
 
+    def test_convert_color_value_cached(self):
+        first = template.convert_color_value([188, 108, 14])
+        first.append('changed')  # The cached value must not be modified
+        self.assertListAlmostEqual(template.convert_color_value([188, 108, 14]),
+                                   [0.47, -0.15, -0.89])
+        self.assertListAlmostEqual(template.convert_color_value((255, 0, 0)), [1.0, -1.0, -1.0])
+
+    def test_convert_color_values(self):
+        colors = [[255, 255, 255], [128, 128, 128], [0, 0, 0], [188, 108, 14]]
+        converted = template.convert_color_values(colors)
+        self.assertEqual(converted.shape, (4, 3))
+        for color, row in zip(colors, converted):
+            self.assertEqual(list(row), template.convert_color_value(color))
+
+        every_value = template.convert_color_values(range(256))
+        self.assertEqual(list(every_value), [template.convert_color_value([n])[0]
+                                             for n in range(256)])
+
+        self.assertEqual(template.convert_color_values([[127.5, 0.0, 255.0]]).tolist(),
+                         [[0.0, -1.0, 1.0]])
+
     def test_save_experiment_info(self):
         self.basic_template.save_experiment_info()
         self.assertTrue(os.path.exists('test_name_000_info.json'))
@@ -108,6 +133,172 @@ class TestTemplateMethods(unittest.TestCase):
         os.remove('test_name_000.csv')
         os.remove('test_name_000.pickle')
 
+    def test_wait_for_response(self):
+        class Key:
+            def __init__(self, name, rt):
+                self.name, self.rt = name, rt
+
+        class Clock:
+            time = 0.0
+
+            def getTime(self):
+                self.time += 0.5
+                return self.time
+
+        class Keyboard:
+            clock = Clock()
+            presses = [[Key('f', 0.1)], [], [Key('j', 0.35)]]
+
+            def getKeys(self, keyList=None, waitRelease=True):
+                return self.presses.pop(0) if self.presses else []
+
+        self.basic_template.response_keyboard = Keyboard()
+        # The press at 0.1 s is within the lockout
+        records = self.basic_template.wait_for_response(
+            keyList=['f', 'j'], lockout=0.2, trial={'1': 'a'}, poll_interval=0)
+        self.assertEqual(records, [{'1': 'a', 'response': 'j', 'rt': 0.35}])
+
+        records = self.basic_template.wait_for_response(max_wait=1, poll_interval=0)
+        self.assertEqual(records, [{'response': 'NA', 'rt': 'NA'}])
+
+
+class _FakeDevice:
+    """Records the setup calls of a device and the thread they were made on."""
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(
+            (name, threading.current_thread() is threading.main_thread()))
+
+
+class _FakeWindow:
+    def flip(self):
+        pass
+
+
+class TestDeviceSetup(unittest.TestCase):
+    def setUp(self):
+        self.experiment = template.EyeTrackingEEGExperiment(
+            experiment_name='test_name', data_fields=['1'])
+        self.experiment.experiment_info['Subject Number'] = '0'
+        self.experiment.experiment_window = _FakeWindow()
+
+        fake_modules = {
+            'eyelinker': types.SimpleNamespace(ConnectedEyeLinker=_FakeDevice,
+                                               MockEyeLinker=_FakeDevice),
+            'pyplugger': types.SimpleNamespace(ConnectedPyPlugger=_FakeDevice,
+                                               MockPyPlugger=_FakeDevice),
+        }
+        patcher = mock.patch.dict(sys.modules, fake_modules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timeout_cancels_attempt(self):
+        release = threading.Event()
+        steps = []
+
+        def setup(step):
+            release.wait(5)
+            step('second step')
+            steps.append('second step')
+            return 'device'
+
+        device = template._DeviceSetup('Test', setup, timeout=0.05)
+        device.start()
+        self.assertTrue(device.attempt.thread.daemon)
+        device.attempt.done.wait(0.1)
+        self.assertTrue(device.update())
+        self.assertIsInstance(device.error, TimeoutError)
+
+        # The old attempt stops before its next step and does not change the status
+        first_attempt = device.attempt
+        release.set()
+        first_attempt.done.wait(1)
+        self.assertEqual(steps, [])
+        self.assertIsInstance(first_attempt.error, template._SetupCancelled)
+        self.assertEqual(device.status, 'timed out')
+
+        device.start()  # Retry
+        device.attempt.done.wait(1)
+        self.assertTrue(device.update())
+        self.assertEqual(device.device, 'device')
+        self.assertEqual(steps, ['second step'])
+
+    def test_tracker_steps_run_on_worker(self):
+        with mock.patch.object(self.experiment, '_display_device_status'):
+            tracker, eeg = self.experiment.setup_devices('test.edf', 'LEFT', 'config.xml')
+
+        # The link is set up on the worker, the display is opened on the main thread
+        self.assertEqual(tracker.kwargs, {'create_display': False})
+        self.assertEqual(tracker.calls, [
+            ('open_edf', False), ('initialize_tracker', False), ('initialize_graphics', True),
+            ('send_tracking_settings', True)])
+        self.assertEqual(eeg.calls, [('initialize_session', False), ('switch_mode', False)])
+
+    def test_cancelled_attempt_closes_partial_device(self):
+        release = threading.Event()
+        closed = []
+
+        def setup(step):
+            step('connecting', 'partial device')
+            release.wait(5)
+            step('second step')
+            return 'device'
+
+        device = template._DeviceSetup('Test', setup, timeout=0.05, close=closed.append)
+        device.start()
+        device.attempt.done.wait(0.1)
+        self.assertTrue(device.update())
+        self.assertEqual(closed, [])
+
+        release.set()
+        device.attempt.done.wait(1)
+        self.assertEqual(closed, ['partial device'])
+
+    def test_late_result_is_closed(self):
+        release = threading.Event()
+        closed = []
+
+        def setup(step):
+            release.wait(5)
+            return 'device'
+
+        device = template._DeviceSetup('Test', setup, timeout=0.05, close=closed.append)
+        device.start()
+        device.attempt.done.wait(0.1)
+        self.assertTrue(device.update())
+
+        release.set()
+        device.attempt.done.wait(1)
+        self.assertIsInstance(device.attempt.error, template._SetupCancelled)
+        self.assertIsNone(device.attempt.result)
+        self.assertEqual(closed, ['device'])
+        self.assertIsNone(device.device)
+
+    def test_failed_attempt_closes_partial_device(self):
+        closed = []
+
+        def setup(step):
+            step('connecting', 'partial device')
+            raise ConnectionError('refused')
+
+        device = template._DeviceSetup('Test', setup, timeout=5, close=closed.append)
+        device.start()
+        device.attempt.done.wait(1)
+        self.assertTrue(device.update())
+        self.assertIsInstance(device.error, ConnectionError)
+        self.assertEqual(closed, ['partial device'])
+
+    def test_quit(self):
+        with mock.patch.object(self.experiment, '_run_device_setup', return_value='q'), \
+                mock.patch.object(self.experiment, 'quit_experiment',
+                                  side_effect=SystemExit) as quit_experiment:
+            with self.assertRaises(SystemExit):
+                self.experiment.setup_devices('test.edf', 'LEFT', 'config.xml')
+        quit_experiment.assert_called_once_with()
+
 
 if __name__ == '__main__':
     unittest.main()